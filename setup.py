@@ -14,7 +14,7 @@ Features:
 
 * Colliders and rigidbodies
 
-* Import OBJ files
+* Import OBJ files, with an on-disk cache of compiled meshes
 
 * ODE Physics engine
 
@@ -34,7 +34,12 @@ setup(
     packages = ['pyngine'],
     package_dir = {'pyngine': 'src/pyngine'},
     package_data = {'pyngine': ['data/*']},
-    install_requires = ['Pygame', 'PyOpenGL', 'PyODE'],
+    install_requires = ['Pygame', 'PyOpenGL', 'PyODE', 'NumPy'],
+    entry_points = {
+        'console_scripts': [
+            'pyngine-compile-meshes = pyngine.meshcache:main',
+        ],
+    },
     classifiers = [
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Developers',
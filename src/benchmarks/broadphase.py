@@ -0,0 +1,101 @@
+"""
+Compares the time per physics step of the broadphase strategies of
+PhysicsEngine, with spheres falling onto a static floor.
+
+The touching column is the number of pairs in contact in an extra step run
+after the timed ones.
+It is 0 when the ode module does not detect collisions, in which case the
+timings do not measure the broadphase.
+
+Usage::
+
+    python broadphase.py [--counts 100 1000 10000] [--steps 60]
+"""
+
+import argparse
+import math
+import random
+import time
+
+from pyngine import * # @UnusedWildImport
+
+
+class Contacts(Component):
+    """
+    Collects the pairs of gameobjects that touch, from the collision events
+    """
+    pairs = set()
+    
+    def oncollision(self, other):
+        Contacts.pairs.add(frozenset((self.gameobject.id, other.id)))
+
+
+def populate(count):
+    """
+    Creates a floor and *count* spheres spread over a volume that grows with
+    their number, so the density of bodies is the same for every count, and
+    returns the spheres
+    """
+    side = 2 * math.sqrt(count)
+    GameObject(Transform(position=(0, -1, 0), scale=(side * 2, 1, side * 2)),
+               BoxCollider())
+    spheres = []
+    for _ in xrange(count):
+        position = (random.uniform(-side, side), random.uniform(0, 10),
+                    random.uniform(-side, side))
+        spheres.append(GameObject(Transform(position=position),
+                                  SphereCollider(), Rigidbody(1)))
+    return spheres
+
+
+def measure(broadphase, count, steps, **options):
+    """
+    Returns the average seconds per step of *steps* steps of *count* bodies,
+    and the number of pairs of gameobjects touching in the next step, which
+    should be similar for every broadphase
+    """
+    random.seed(count)
+    scene = Scene(broadphase=broadphase, **options)
+    spheres = populate(count)
+    scene.physics.step(1. / 60)
+    start = time.time()
+    for _ in xrange(steps):
+        scene.physics.step(1. / 60)
+    elapsed = (time.time() - start) / steps
+    # The events are only collected after the timed steps, so that the
+    # handlers do not add to their time
+    for sphere in spheres:
+        sphere.addcomponent(Contacts())
+    Contacts.pairs.clear()
+    scene.physics.step(1. / 60)
+    touching = len(Contacts.pairs)
+    scene.destroy()
+    return elapsed, touching
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Broadphase benchmark")
+    parser.add_argument('--counts', type=int, nargs='+',
+                        default=[100, 1000, 10000])
+    parser.add_argument('--steps', type=int, default=60)
+    options = parser.parse_args(args)
+    strategies = [('simple', {}), ('hash', {}),
+                  ('hash', {'levels': (-1, 4)}), ('quadtree', {})]
+    print("%8s %-22s %12s %10s" % ('bodies', 'broadphase', 'ms/step',
+                                   'touching'))
+    for count in options.counts:
+        side = 2 * math.sqrt(count)
+        for broadphase, extra in strategies:
+            if broadphase == 'quadtree':
+                extra = {'extents': (side * 4, 40, side * 4), 'depth': 8}
+            name = broadphase
+            if 'levels' in extra:
+                name += ' levels=%d,%d' % extra['levels']
+            elapsed, touching = measure(broadphase, count, options.steps,
+                                        **extra)
+            print("%8d %-22s %12.3f %10d" % (count, name, elapsed * 1000,
+                                             touching))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
+import argparse
+
 from pyngine import * # @UnusedWildImport
-from threading import Timer
 
 
 class PlayerMovement(Component):
@@ -21,22 +22,32 @@ class PlayerMovement(Component):
         self.canjump = True
 
 
+class Lifetime(Component):
+    def __init__(self, seconds):
+        Component.__init__(self)
+        self.seconds = seconds
+    def onspawn(self):
+        self.remaining = self.seconds
+    def update(self):
+        self.remaining -= Game.delta
+        if self.remaining <= 0:
+            self.gameobject.despawn()
+
 class Shooter(Component):
+    bullet = Prefab(lambda: Sphere(Color.green),
+                    lambda: SphereCollider('bullet'), lambda: Rigidbody(1),
+                    lambda: Lifetime(3.), scale=(.5, .5, .5), tag='Bullet')
     def start(self):
         self.shootforce = 100
-        self.canshoot = False
-        self.newbullethandler()
-    def newbullethandler(self):
-        self.canshoot = True
-        self.timer = Timer(1., self.newbullethandler)
-        self.timer.start()
+        self.reloadtime = 1.
+        self.cooldown = 0.
+        self.bullets = GameObjectPool(Shooter.bullet, size=4)
     def update(self):
-        if Input.getkey(pygame.K_q) and self.canshoot:
-            self.canshoot = False
+        self.cooldown -= Game.delta
+        if Input.getkey(pygame.K_q) and self.cooldown <= 0:
+            self.cooldown = self.reloadtime
             position = self.transform.position + self.transform.forward * 1
-            bullet = GameObject(Transform(position, scale=(.5,.5,.5)),
-                                Sphere(Color.green), SphereCollider(), Rigidbody(1))
-            bullet.tag = 'Bullet'
+            bullet = self.bullets.spawn(position)
             bullet.rigidbody.addforce(self.transform.forward * self.shootforce)
 
 
@@ -61,6 +72,7 @@ class Enemy(GameObject):
 class Platformer(Game):
     def __init__(self):
         Game.__init__(self)
+        Collider.setlayercollision('bullet', 'bullet', False)
         GameObject(Transform(position=(0,5,-5)), Light())
         Platform(pos=(0, 0 ,0), size=(20, 1, 20))
         Platform(pos=(11.5, 2, 0), size=(10, 1, 5))
@@ -73,6 +85,17 @@ class Platformer(Game):
             Enemy(pos=position)
 
 
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Platformer example")
+    parser.add_argument('--headless', type=int, metavar='TICKS',
+                        help="simulate TICKS steps without a window")
+    options = parser.parse_args(args)
+    if options.headless is None:
+        Platformer().mainloop()
+    else:
+        Game.headless = True
+        print(Platformer().run(options.headless))
+
+
 if __name__ == "__main__":
-    p = Platformer()
-    p.mainloop()
+    main()
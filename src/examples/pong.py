@@ -1,3 +1,5 @@
+import argparse
+
 from pyngine import * #@UnusedWildImport
 
 
@@ -70,6 +72,17 @@ class Pong(Game):
         Ball(pos=(0, 0, -5))
 
 
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Pong example")
+    parser.add_argument('--headless', type=int, metavar='TICKS',
+                        help="simulate TICKS steps without a window")
+    options = parser.parse_args(args)
+    if options.headless is None:
+        Pong().mainloop()
+    else:
+        Game.headless = True
+        print(Pong().run(options.headless))
+
+
 if __name__ == "__main__":
-    game = Pong()
-    game.mainloop()
+    main()
@@ -1,16 +1,34 @@
-import random
+import itertools
 import math
 import os
+import sys
+import time
+import weakref
+
+import numpy
 
 # Pygame and PyOpenGL dependencies
 import pygame
 import OpenGL.GL as GL
-import OpenGL.GLUT as GLUT
 
+import culling
 import geom
+import meshcache
+import primitives
+from geom import Vector3D, Quaternion
 from openglrenderer import OpenGLRenderer
-from physics import PhysicsEngine
+from instancing import Geometry, InstancedRenderer
+from loader import AssetLoader, Future
+from particles import ParticleSystem
+from textures import Texture, TextureManager
+from physics import Collision, PhysicsEngine, PhysicsEngineError, \
+    PhysicsMaterial
 from input import Input
+from batch import BatchResult, BatchRunner
+from ecs import Archetype, EntityStore
+from registry import GameObjectRegistry
+from culling import Frustum
+from renderqueue import RenderQueue
 
 
 
@@ -39,6 +57,11 @@ class Component(object):
         """Reference to the attached gameobject's collider"""
         return self.gameobject.collider
     
+    @property
+    def scene(self):
+        """Reference to the scene of the attached gameobject"""
+        return self.gameobject.scene
+    
     def start(self):
         """Called when the component is added to the game object"""
         pass
@@ -68,6 +91,48 @@ class Component(object):
         """
         pass
     
+    def oncollisionenter(self, collision):
+        """
+        Called after the physics step in which the attached gameobject starts
+        touching another gameobject. *collision* is a Collision with the other
+        gameobject and the contact points
+        """
+        pass
+    
+    def oncollisionstay(self, collision):
+        """
+        Called after each following physics step in which the gameobjects are
+        still touching
+        """
+        pass
+    
+    def oncollisionexit(self, collision):
+        """
+        Called after the first physics step in which the gameobjects are no
+        longer touching
+        """
+        pass
+    
+    def ondestroy(self):
+        """
+        Called when the component is removed from its gameobject or the
+        gameobject is destroyed. Components release their shared resources here
+        """
+        pass
+    
+    def onspawn(self):
+        """
+        Called each time a pool spawns the gameobject, after its transform
+        has been placed. Pooled components reset their state here
+        """
+        pass
+    
+    def ondespawn(self):
+        """
+        Called when the gameobject is returned to its pool
+        """
+        pass
+    
     def handlemessage(self, string, data):
         """
         Calls dynamically a method of the component. *string* is the name of the method
@@ -80,15 +145,88 @@ class Component(object):
             return self.__getattribute__(string)(*data)
 
 
+# Hooks that the gameobjects dispatch only to the components overriding them
+_HOOKS = ('update', 'lateupdate', 'oncollision', 'oncollisionenter',
+          'oncollisionstay', 'oncollisionexit')
+
+_overridden = {}
+
+def _overrides(component, hook):
+    """
+    Returns whether the class of *component* overrides the method *hook* of
+    Component
+    """
+    key = (type(component), hook)
+    try:
+        return _overridden[key]
+    except KeyError:
+        method = getattr(type(component), hook).__func__
+        result = _overridden[key] = method is not getattr(Component,
+                                                          hook).__func__
+        return result
+
+
 class Renderable(Component):
-    """Component used for enabling 3D rendering of a gameobject"""
+    """
+    Component used for enabling 3D rendering of a gameobject. Renderables with
+    a *geometry* can be drawn in batches with hardware instancing, and share
+    its display list for the fixed-function path. They hold a reference to the
+    geometry until they are destroyed.
+    In headless games renderables are inert: they never touch OpenGL
+    """
 
-    def __init__(self, color):
+    geometry = None
+    # Whether the fixed-function path draws the geometry from a display list
+    # or straight from its vertex buffers
+    compiled = True
+    # Whether the renderable is waiting for an asset loaded in the background,
+    # in which case it is not drawn
+    loading = False
+
+    def __init__(self, color, geometry=None):
         Component.__init__(self)
-        self.gl_list = GL.glGenLists(1)
+        self.gl_list = None
+        if geometry is None and not Game.headless:
+            self.gl_list = GL.glGenLists(1)
+        elif geometry is not None:
+            geometry.acquire()
         self.color = color
+        self.geometry = geometry
+    
+    @property
+    def transparent(self):
+        """
+        Whether the renderable is blended, in which case it is drawn after
+        the opaque ones, back to front
+        """
+        return self.color is not None and self.color[3] < 1
+    
+    @property
+    def bounds(self):
+        """
+        Bounding sphere of the geometry in world space, as a (center, radius)
+        tuple, or None if the renderable has no geometry
+        """
+        if self.geometry is None:
+            return None
+        centers, radii = culling.spheres([self.transform.rendermatrix],
+                                         [self.geometry.center],
+                                         [self.geometry.radius])
+        return tuple(centers[0]), radii[0]
+    
+    def ondestroy(self):
+        if self.geometry is not None:
+            self.geometry.release()
+            self.geometry = None
+        elif self.gl_list is not None:
+            GL.glDeleteLists(self.gl_list, 1)
+        self.gl_list = None
         
     def render(self):
+        if self.loading or Game.headless:
+            return
+        if self.gl_list is None and self.compiled:
+            self.gl_list = self.geometry.displaylist()
         OpenGLRenderer.render(self)
 
 
@@ -96,10 +234,9 @@ class Cube(Renderable):
     """Renderable component for displaying a cube"""
 
     def __init__(self, color=(0, 0, 0, 1)):
-        Renderable.__init__(self, color)
-        GL.glNewList(self.gl_list, GL.GL_COMPILE)
-        GLUT.glutSolidCube(1)
-        GL.glEndList()
+        geometry = Geometry.get(('cube',),
+                                lambda: Geometry(*primitives.cube()))
+        Renderable.__init__(self, color, geometry)
 
 
 class Sphere(Renderable):
@@ -109,10 +246,10 @@ class Sphere(Renderable):
     stacks = 18
     
     def __init__(self, color=(0, 0, 0, 1)):
-        Renderable.__init__(self, color)
-        GL.glNewList(self.gl_list, GL.GL_COMPILE)
-        GLUT.glutSolidSphere(.5, Sphere.slices, Sphere.stacks)
-        GL.glEndList()
+        slices, stacks = Sphere.slices, Sphere.stacks
+        factory = lambda: Geometry(*primitives.sphere(.5, slices, stacks))
+        geometry = Geometry.get(('sphere', slices, stacks), factory)
+        Renderable.__init__(self, color, geometry)
 
 
 class Torus(Renderable):
@@ -122,136 +259,140 @@ class Torus(Renderable):
     rings = 15
     
     def __init__(self, inner=1, outer=1, color=(0, 0, 0, 1)):
-        Renderable.__init__(self, color)
-        GL.glNewList(self.gl_list, GL.GL_COMPILE)
         f = inner + outer * 2.
-        GLUT.glutSolidTorus(inner/(f*2.), outer/f, Torus.slices, Torus.rings)
-        GL.glEndList()
+        tube, radius = inner/(f*2.), outer/f
+        slices, rings = Torus.slices, Torus.rings
+        factory = lambda: Geometry(*primitives.torus(tube, radius,
+                                                     slices, rings))
+        geometry = Geometry.get(('torus', tube, radius, slices, rings),
+                                factory)
+        Renderable.__init__(self, color, geometry)
 
 
 class Mesh(Renderable):
     """Renderable component for imported meshes"""
 
-    def __init__(self, filename):
+    mesh_folder = ''
+    compiled = False
+
+    def __init__(self, filename, background=False):
         """
         Loads a mesh from an OBJ file. *filename* is the string that indicates the
-        path to the OBJ file
+        path to the OBJ file. Meshes loaded from the same file share their
+        geometry, and the parsed file is kept in the mesh cache (see
+        ``pyngine.meshcache``) to speed up the next runs.
+        
+        If *background* is True and the file is not loaded yet, it is parsed
+        by the AssetLoader and the mesh is not drawn until it is ready. In
+        both cases, ``future`` is a Future whose result is the geometry
         """
-        Renderable.__init__(self, (0,0,0,1))
         filename = os.path.join(Mesh.mesh_folder, filename)
-        self.vertices = []
-        self.normals = []
-        self.texcoords = []
-        self.faces = []
-        self.material = None
-        for line in open(filename, 'r'):
-            values = self._process_line(line)
-            if not values:
-                continue
-            elif values[0] == 'v':
-                v = map(float, values[1:4])
-                self.vertices.append(v)
-            elif values[0] == 'vn':
-                v = map(float, values[1:4])
-                self.normals.append(v)
-            elif values[0] == 'vt':
-                self.texcoords.append(map(float, values[1:3]))
-            elif values[0] in ('usemtl', 'usemat'):
-                self.material = values[1]
-            elif values[0] == 'mtllib':
-                self.mtl = self._mtl(values[1])
-            elif values[0] == 'f':
-                self._process_face(values[1:])
-        GL.glNewList(self.gl_list, GL.GL_COMPILE)
-        GL.glEnable(GL.GL_TEXTURE_2D)
-        GL.glFrontFace(GL.GL_CCW)
-        self._process_faces()
-        GL.glDisable(GL.GL_TEXTURE_2D)
-        GL.glEndList()
-
-    def _process_line(self, line):
-        if not line.startswith('#'):
-            return line.split()
-
-    def _mtl(self, filename):
-        contents = {}
-        mtl = None
-        for line in open(filename, 'r'):
-            values = self._process_line(line)
-            if not values:
-                continue
-            elif values[0] == 'newmtl':
-                mtl = contents[values[1]] = {}
-            elif mtl is None:
-                raise ValueError, "MTL file does not start with newmtl stmt"
-            elif values[0] == 'map_Kd':
-                self._load_texture_referred(mtl, values)
-            else:
-                mtl[values[0]] = map(float, values[1:])
-        return contents
-    
-    def _load_texture_referred(self, mtl, values):
-        mtl[values[0]] = values[1]
-        surf = pygame.image.load(mtl['map_Kd'])
-        image = pygame.image.tostring(surf, 'RGBA', 1)
-        ix, iy = surf.get_rect().size
-        texid = mtl['texture_Kd'] = GL.glGenTextures(1)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, texid)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D,
-                        GL.GL_TEXTURE_MIN_FILTER,
-                        GL.GL_LINEAR)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D,
-                        GL.GL_TEXTURE_MAG_FILTER,
-                        GL.GL_LINEAR)
-        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA,
-                     ix, iy, 0, GL.GL_RGBA,
-                     GL.GL_UNSIGNED_BYTE, image)
-    
-    def _load_face(self, values):
-        face = []
-        texcoords = []
-        norms = []
-        for v in values:
-            w = v.split('/')
-            face.append(int(w[0]))
-            if len(w) >= 2 and len(w[1]) > 0:
-                texcoords.append(int(w[1]))
-            else:
-                texcoords.append(0)
-            if len(w) >= 3 and len(w[2]) > 0:
-                norms.append(int(w[2]))
-            else:
-                norms.append(0)
-        self.faces.append((face, norms, texcoords, self.material))
-    
-    def _process_faces(self):
-        for face in self.faces:
-            vertices, normals, texture_coords, material = face
-            mtl = self.mtl[material]
-            if 'texture_Kd' in mtl:
-                GL.glBindTexture(GL.GL_TEXTURE_2D, mtl['texture_Kd'])
-            else:
-                GL.glColor(*mtl['Kd'])
-            GL.glBegin(GL.GL_POLYGON)
-            for i, (vertex, normal) in enumerate(zip(vertices, normals)):
-                if normal > 0:
-                    GL.glNormal3fv(self.normals[normal - 1])
-                if texture_coords[i] > 0:
-                    GL.glTexCoord2fv(self.texcoords[texture_coords[i] - 1])
-                GL.glVertex3fv(self.vertices[vertex - 1])
-            GL.glEnd()            
+        key = ('mesh', os.path.abspath(filename))
+        self.textures = []
+        self._destroyed = False
+        if background and key not in Geometry._cache:
+            Component.__init__(self)
+            self.color = (1, 1, 1, 1)
+            self.gl_list = None
+            self.loading = True
+            upload = lambda loaded: Mesh._upload(key, loaded)
+            self.future = AssetLoader.submit(lambda: Mesh._read(filename),
+                                             upload, key)
+            self.future.adddonecallback(self._onload)
+        else:
+            geometry = Geometry.get(key, lambda: Mesh._build(
+                *meshcache.load(filename)))
+            Renderable.__init__(self, (1, 1, 1, 1), geometry)
+            self.future = Future.fromresult(geometry)
+            self._acquiretextures()
+
+    def ondestroy(self):
+        self._destroyed = True
+        for texture in self.textures:
+            texture.release()
+        self.textures = []
+        Renderable.ondestroy(self)
+
+    def _onload(self, future):
+        if future.exception() is None and not self._destroyed:
+            self.geometry = future.result().acquire()
+            self._acquiretextures()
+            self.loading = False
+
+    def _acquiretextures(self):
+        if Game.headless:
+            return
+        self.textures = [texture.acquire() for _, _, _, texture
+                         in self.geometry.parts if texture is not None]
+
+    @staticmethod
+    def _read(filename):
+        """
+        Parses the OBJ file and decodes its textures, on a worker thread
+        """
+        data = meshcache.load(filename)
+        materials = data[3]
+        images = {}
+        for mtl in materials.itervalues():
+            if 'map_Kd' in mtl:
+                path = os.path.abspath(mtl['map_Kd'])
+                images[path] = TextureManager.decode(path)
+        return data, images
+
+    @staticmethod
+    def _upload(key, loaded):
+        """
+        Builds the geometry and uploads its buffers and textures
+        """
+        data, images = loaded
+        geometry = Geometry.get(key, lambda: Mesh._build(*data))
+        if Game.headless:
+            return geometry
+        geometry.upload()
+        for _, _, _, texture in geometry.parts:
+            if texture is not None and texture.id is None:
+                # Leave the texture resident until the meshes acquire it
+                texture.acquire(images.get(texture.path)).release()
+        return geometry
+
+    @staticmethod
+    def _build(vertices, indices, parts, materials):
+        geometryparts = []
+        for first, count, material in parts:
+            mtl = materials.get(material, {})
+            color = mtl.get('Kd')
+            if color is not None:
+                color = color[:4] + (1.,) * (4 - len(color[:4]))
+            texture = None
+            if 'map_Kd' in mtl:
+                texture = TextureManager.get(mtl['map_Kd'])
+            geometryparts.append((first, count, color, texture))
+        return Geometry(vertices, indices, geometryparts)
 
 
 class Audio(Component):
     """Component used to play an audio file"""
     
-    def __init__(self, filename):
+    def __init__(self, filename, background=False):
         """
         Creates an audio component from an audio file. *filename* is the string that
-        indicates the path to the audio file
+        indicates the path to the audio file. If *background* is True, the file
+        is decoded by the AssetLoader and ``sound`` is None until ``future``
+        has finished; until then, playing the audio has no effect
         """
         Component.__init__(self)
-        self.sound = pygame.mixer.Sound(filename)
+        if background:
+            self.sound = None
+            self.future = AssetLoader.submit(
+                lambda: pygame.mixer.Sound(filename), key=('audio', filename))
+            self.future.adddonecallback(self._onload)
+        else:
+            self.sound = pygame.mixer.Sound(filename)
+            self.future = Future.fromresult(self.sound)
+    
+    def _onload(self, future):
+        if future.exception() is None:
+            self.sound = future.result()
     
     @property
     def volume(self):
@@ -266,81 +407,84 @@ class Audio(Component):
         """
         Plays the audio sound. *loops* indicates the number of times that the 
         """
-        self.sound.play(loops, maxtime, fade_ms)
+        if self.sound is not None:
+            self.sound.play(loops, maxtime, fade_ms)
     
     def stop(self):
         """Stops the audio sound"""
-        self.sound.stop()
+        if self.sound is not None:
+            self.sound.stop()
 
 
-class Particle(object):
-    def __init__(self, position, direction,
-                 size=.5, color=(0,0,0), life=1):
-        self.position = position
-        self.direction = direction
-        self.size = size
-        self.color = color
-        self.life = life
-    
-    def update(self):
-        if self.life > 0:
-            x, y ,z = self.position
-            xi, yi, zi = self.direction
-            self.position = x+xi, y+yi, z+zi
-        self.life -= 0.01
-    
-    def render(self):
-        x, y, z = self.position
-        color = self.color[:3] + (self.life,)
-        GL.glPushMatrix()
-        GL.glColor(*color)
-        GL.glTranslate(x, y, -z)
-        GLUT.glutSolidSphere(self.size * self.life, 5, 5)
-        GL.glPopMatrix()
+class ParticleEmitter(Renderable):
+    """
+    Renderable component that bursts particles when its gameobject collides.
+    The particles are stored in a ParticleSystem and drawn as instanced
+    spheres, or as points when instancing is not available
+    """
 
+    slices = 5
+    stacks = 5
+    transparent = True
 
-class ParticleEmitter(Renderable):
-    def __init__(self, num_particles=15):
+    def __init__(self, num_particles=15, capacity=1024):
         Component.__init__(self)
+        self.color = None
+        self.gl_list = None
         self.num_particles = num_particles
-        self.particles = []
+        self.particles = ParticleSystem(capacity)
+        slices, stacks = ParticleEmitter.slices, ParticleEmitter.stacks
+        factory = lambda: Geometry(*primitives.sphere(1, slices, stacks))
+        self.particlegeometry = Geometry.get(('sphere', 1, slices, stacks),
+                                             factory).acquire()
     
-    def oncollision(self, other):
+    def ondestroy(self):
+        self.particlegeometry.release()
+    
+    def oncollisionenter(self, collision):
         step = int(360 / self.num_particles)
-        for x in xrange(0, 360, step):
-            a = x * math.pi / 180
-            position = self.transform.position
-            direction = math.sin(a)*0.1, 0, math.cos(a)*0.1
-            color = random.random(), random.random(), 1
-            particle = Particle(position, direction,
-                                color=color, size=.25)
-            self.particles.append(particle)
+        angles = numpy.radians(numpy.arange(0, 360, step))
+        n = len(angles)
+        velocity = numpy.zeros((n, 3))
+        velocity[:, 0] = numpy.sin(angles) * 0.1
+        velocity[:, 2] = numpy.cos(angles) * 0.1
+        color = numpy.ones((n, 4))
+        color[:, :2] = numpy.random.random((n, 2))
+        self.particles.emit(self.transform.position, velocity,
+                            color=color, size=.25)
     
     def update(self):
-        for particle in self.particles:
-            if particle.life > 0:
-                particle.update()
-            else:
-                self.particles.remove(particle)
+        self.particles.update()
     
     def render(self):
-        for particle in self.particles:
-            particle.render()
+        if Game.headless:
+            return
+        if Game.instancing and InstancedRenderer.issupported():
+            self.particles.render(self.particlegeometry)
+        else:
+            self.particles.render()
+        OpenGLRenderer.resetstate()
 
 
 class Rigidbody(Component):
     """Component that simulates the mechanics of a rigid body"""
     
-    def __init__(self, density):
+    def __init__(self, density, autodisable=None):
         """
         Initializes the rigidbody representation. *density* is the integer that indicates
-        the density of the body
+        the density of the body. *autodisable* overrides the auto-disable
+        option of the scene for this body, for example so that the body of
+        the player never falls asleep
         """
         Component.__init__(self)
         self.density = density
-        self._body = PhysicsEngine.createbody()
+        self.autodisable = autodisable
+        self._body = None
         
     def start(self):
+        self._body = self.scene.physics.createbody()
+        if self.autodisable is not None:
+            self._body.setAutoDisableFlag(self.autodisable)
         mass = PhysicsEngine.createmass()
         mass.setBox(self.density, *self.transform.scale)
         self._body.setMass(mass)
@@ -349,12 +493,56 @@ class Rigidbody(Component):
         self.transform._setbody(self._body)
         if self.collider is not None:
             self._setcollider()
+        self.scene.physics.addbody(self)
+    
+    def ondestroy(self):
+        self.scene.physics.removebody(self)
+        self.gameobject.dormant = False
+        self.transform._sleeping = False
+    
+    def onspawn(self):
+        self._body.setLinearVel((0, 0, 0))
+        self._body.setAngularVel((0, 0, 0))
+        self._body.enable()
+        self.scene.physics.addbody(self)
+        self.transform._sleeping = False
+        self.transform._bodystep = -1
+    
+    def ondespawn(self):
+        self._body.disable()
+        self.scene.physics.removebody(self)
     
     def _setcollider(self):
         self.collider._setbody(self._body)
+    
+    def _sleep(self):
+        """
+        Called when ODE has disabled the body. The gameobject becomes dormant
+        and its transform stops reading the body
+        """
+        self.scene.physics.sleepbody(self)
+        self.gameobject.dormant = True
+        self.transform._sleeping = True
+    
+    def _wake(self):
+        if self.gameobject.dormant:
+            self.scene.physics.addbody(self)
+            self.gameobject.dormant = False
+            self.transform._sleeping = False
+            self.transform._bodystep = -1
+    
+    def wake(self):
+        """Enables a sleeping rigidbody and updates its gameobject again"""
+        self._body.enable()
+        self._wake()
+    
+    @property
+    def sleeping(self):
+        return self.gameobject.dormant
         
     def addforce(self, force):
-        """Adds a force to the rigidbody"""
+        """Adds a force to the rigidbody, waking it up"""
+        self.wake()
         self._body.addForce(force)
         
     def isenabled(self):
@@ -375,64 +563,209 @@ class Rigidbody(Component):
     
     @velocity.setter
     def velocity(self, value):
+        self.wake()
         self._body.setLinearVel(value)
     
     def enable(self):
-        self._body.enable()
+        self.wake()
     
     def disable(self):
         self._body.disable()
 
 
 class Collider(Component):
-    """Component used for collision detection"""
+    """
+    Component used for collision detection.
+    
+    Each collider belongs to one of 32 layers, and a symmetric layer matrix
+    tells which layers collide with each other. The layers are mapped onto
+    the category and collide bits of the ODE geoms, so the pairs of layers
+    that do not collide are rejected by the broadphase itself. For example::
+    
+        Collider.setlayercollision('bullet', 'bullet', False)
+        bullet = GameObject(Transform(), SphereCollider(layer='bullet'))
+    
+    The surface of each collider is described by a PhysicsMaterial of the
+    material table::
+    
+        Collider.setmaterial('ice', friction=.05)
+        floor = GameObject(Transform(), BoxCollider(material='ice'))
+    """
 
-    def __init__(self):
+    # Names of the layers, and bit mask of the layers that each layer
+    # collides with
+    layers = {'default': 0}
+    _masks = [0xffffffff] * 32
+    # Physics materials by name
+    materials = {'default': PhysicsEngine.defaultmaterial}
+
+    def __init__(self, layer=0, material='default'):
+        """
+        *layer* is the index of the layer of the collider, or its name. New
+        names are assigned the first free layer. *material* is the name of
+        a material of the table, or a PhysicsMaterial
+        """
         Component.__init__(self)
         self._geom = None
+        self._layer = Collider.getlayer(layer)
+        Collider.getmaterial(material)
+        self._material = material
         
     def _fixedstart(self):
         self._geom.gameobject = self.gameobject
         self._geom.setPosition(self.transform.position)
         self._geom.setQuaternion(self.transform.rotation)
+        self._updatebits()
+        self._updatematerial()
         self.transform._setgeom(self._geom)
         if self.rigidbody:
             self.rigidbody._setcollider()
         
     def _setbody(self, body):
         self._geom.setBody(body)
+        self.scene.physics.setdynamic(self._geom)
         
     def _clearbody(self):
         self._geom.setBody(None)
     
+    def _updatebits(self):
+        self._geom.setCategoryBits(1 << self._layer)
+        self._geom.setCollideBits(Collider._masks[self._layer])
+    
+    def _updatematerial(self):
+        self._geom.material = Collider.getmaterial(self._material)
+    
+    @property
+    def material(self):
+        """Name of the material of the collider, or its PhysicsMaterial"""
+        return self._material
+    
+    @material.setter
+    def material(self, value):
+        Collider.getmaterial(value)
+        self._material = value
+        if self._geom is not None:
+            self._updatematerial()
+    
+    @classmethod
+    def getmaterial(cls, material):
+        """
+        Returns a PhysicsMaterial from its name, or the material itself
+        """
+        if isinstance(material, PhysicsMaterial):
+            return material
+        try:
+            return cls.materials[material]
+        except KeyError:
+            raise ValueError("Unknown physics material: %s" % material)
+    
+    @classmethod
+    def setmaterial(cls, name, **properties):
+        """
+        Adds or replaces a material of the table, built from the keyword
+        arguments of PhysicsMaterial, and updates the geoms of the existing
+        colliders that use it
+        """
+        cls.materials[name] = PhysicsMaterial(**properties)
+        for gameobject in Scene.allgameobjects():
+            collider = gameobject.collider
+            if collider is not None and collider._geom is not None and \
+                    collider._material == name:
+                collider._updatematerial()
+    
+    @property
+    def layer(self):
+        """Index of the layer of the collider"""
+        return self._layer
+    
+    @layer.setter
+    def layer(self, value):
+        self._layer = Collider.getlayer(value)
+        if self._geom is not None:
+            self._updatebits()
+    
+    @classmethod
+    def getlayer(cls, layer):
+        """
+        Returns the index of a layer from its index or its name, adding the
+        name to the first free layer if it is new
+        """
+        if isinstance(layer, basestring):
+            if layer not in cls.layers:
+                used = set(cls.layers.itervalues())
+                free = [i for i in xrange(32) if i not in used]
+                if not free:
+                    raise ValueError("All the 32 collision layers are in use")
+                cls.layers[layer] = free[0]
+            return cls.layers[layer]
+        if not 0 <= layer < 32:
+            raise ValueError("Invalid collision layer: %s" % layer)
+        return layer
+    
+    @classmethod
+    def setlayercollision(cls, layer1, layer2, collide=True):
+        """
+        Sets whether the colliders of *layer1* and *layer2* collide with each
+        other, and updates the geoms of the existing colliders
+        """
+        i, j = cls.getlayer(layer1), cls.getlayer(layer2)
+        for a, b in ((i, j), (j, i)):
+            if collide:
+                cls._masks[a] |= 1 << b
+            else:
+                cls._masks[a] &= ~(1 << b) & 0xffffffff
+        for gameobject in Scene.allgameobjects():
+            collider = gameobject.collider
+            if collider is not None and collider._geom is not None:
+                collider._updatebits()
+    
+    @classmethod
+    def getlayercollision(cls, layer1, layer2):
+        """
+        Returns whether the colliders of *layer1* and *layer2* collide
+        """
+        i, j = cls.getlayer(layer1), cls.getlayer(layer2)
+        return bool(cls._masks[i] & (1 << j))
+    
     def disable(self):
         self._geom.disable()
     
     def enable(self):
         self._geom.enable()
+    
+    def onspawn(self):
+        # Parked colliders are not in the scene, so they miss the changes
+        # of the layer matrix and the material table
+        self._updatebits()
+        self._updatematerial()
+        self.enable()
+    
+    def ondespawn(self):
+        self.disable()
+        self.scene.physics.removecontacts(self.gameobject)
 
 
 class BoxCollider(Collider):
     """Collider with a box shape"""
     
-    def __init__(self):
-        Collider.__init__(self)
+    def __init__(self, layer=0, material='default'):
+        Collider.__init__(self, layer, material)
         
     def start(self):
         scale = self.transform.scale
-        self._geom = PhysicsEngine.creategeom("Box", (scale,))
+        self._geom = self.scene.physics.creategeom("Box", (scale,))
         self._fixedstart()
 
 
 class SphereCollider(Collider):
     """Collider with a sphere shape"""
     
-    def __init__(self):
-        Collider.__init__(self)
+    def __init__(self, layer=0, material='default'):
+        Collider.__init__(self, layer, material)
         
     def start(self):
         radius = self.transform.scale[0]/2.
-        self._geom = PhysicsEngine.creategeom("Sphere", (radius,))
+        self._geom = self.scene.physics.creategeom("Sphere", (radius,))
         self._fixedstart()
 
 
@@ -443,14 +776,36 @@ class Transform(Component):
     * Position
     * Rotation
     * Scale
+    
+    Transforms form a scene graph: each transform stores its position and
+    rotation relative to its parent, and the world state is resolved lazily,
+    top-down, only when an ancestor has changed. Scale is not inherited.
+    
+    The world position, rotation and model matrix are cached and only
+    recomputed after a setter, ``translate``, ``rotate``, a change in an
+    ancestor or a physics step has changed them, so reading the transform of
+    a static gameobject is free. Transforms driven by a rigidbody are
+    simulated in world space, so they do not follow their parent.
     """
+    # Fraction of a fixed step used to interpolate the render matrices, or
+    # None to render the current state
+    interpolation = None
 
     def __init__(self, position=(0, 0, 0), rotation=(1,0,0,0),
                  scale=(1, 1, 1)):
         Component.__init__(self)
-        self._position = position
-        self._rotation = rotation
+        self._localposition = self._position = geom.Vector3D(*position)
+        self._localrotation = self._rotation = geom.Quaternion(*rotation)
         self._scale = scale
+        self._matrix = None
+        self._version = 0
+        self._parentversion = -1
+        self._bodystep = -1
+        self._sleeping = False
+        self._previousposition = self._position
+        self._previousrotation = self._rotation
+        self._previousversion = 0
+        self._parent = None
         self._children = []
         self._geom = None
         self._body = None
@@ -472,49 +827,149 @@ class Transform(Component):
         Adds a reference to the body of the gameobject's rigidbody
         """
         self._body = body
+        self._bodystep = -1
+        if self._children:
+            self.scene._dynamic.add(self)
         
     def _clearbody(self):
         """Set the reference to the body of the gameobject's rigidbody to None
         """
         self._body = None
+        if self.gameobject is not None:
+            self.scene._dynamic.discard(self)
+    
+    def _resolve(self):
+        """
+        Brings the cached world state up to date, resolving the ancestors
+        first. The rigidbody state is read at most once per physics step,
+        and not at all while it sleeps
+        """
+        parent = self._parent
+        if parent is not None:
+            parent._resolve()
+        if self._body is not None:
+            stepcount = self.scene.physics.stepcount
+            if self._bodystep != stepcount and not self._sleeping:
+                self._bodystep = stepcount
+                self._position = geom.Vector3D(*self._body.getPosition())
+                self._rotation = geom.Quaternion(*self._body.getQuaternion())
+                self._updatelocal()
+                self._invalidate()
+            elif parent is not None and \
+                    self._parentversion != parent._version:
+                self._updatelocal()
+        elif parent is not None and self._parentversion != parent._version:
+            self._updateworld()
+    
+    def _updateworld(self):
+        """
+        Recomputes the world state from the local state and the parent
+        """
+        parent = self._parent
+        if parent is None:
+            self._position = self._localposition
+            self._rotation = self._localrotation
+        else:
+            offset = parent._rotation.rotate_point(self._localposition)
+            self._position = parent._position + offset
+            self._rotation = parent._rotation * self._localrotation
+            self._parentversion = parent._version
+        self._invalidate()
+        self._pushworld()
+    
+    def _updatelocal(self):
+        """
+        Recomputes the local state from the world state and the parent
+        """
+        parent = self._parent
+        if parent is None:
+            self._localposition = self._position
+            self._localrotation = self._rotation
+        else:
+            inverse = parent._rotation.conjugate
+            offset = self._position - parent._position
+            self._localposition = inverse.rotate_point(offset)
+            self._localrotation = inverse * self._rotation
+            self._parentversion = parent._version
+    
+    def _pushworld(self):
+        """
+        Writes the world state to the rigidbody or the collider
+        """
+        if self._body is not None:
+            if self._sleeping:
+                self.gameobject.rigidbody.wake()
+            self._body.setPosition(self._position)
+            self._body.setQuaternion(self._rotation)
+            self._bodystep = self.scene.physics.stepcount
+        elif self._geom is not None:
+            # A geom moved without a body is kinematic, not static geometry
+            if not self._geom.dynamic:
+                self.scene.physics.setdynamic(self._geom)
+            self._geom.setPosition(self._position)
+            self._geom.setQuaternion(self._rotation)
+    
+    def _invalidate(self):
+        self._version += 1
+        self._matrix = None
+        if self._children and self.gameobject is not None:
+            self.scene._changed.add(self)
+    
+    def start(self):
+        if self._children:
+            self.scene._changed.add(self)
         
     @property
     def position(self):
-        result = self._position
-        if self._body is not None:
-            result = self._body.getPosition()
-        elif self._geom is not None:
-            result = self._geom.getPosition()
-        return geom.Vector3D(*result)
+        """Position of the transform in world space"""
+        self._resolve()
+        return self._position
     
     @position.setter
     def position(self, value):
-        startposition = self.position
-        if self._body is not None:
-            self._body.setPosition(value)
-        elif self._geom is not None:
-            self._geom.setPosition(value)
-        self._position = value
-        offset = self.position - startposition
-        for child in self._children:
-            child.translate(offset)
+        self._resolve()
+        self._position = geom.Vector3D(*value)
+        self._updatelocal()
+        self._invalidate()
+        self._pushworld()
     
     @property
     def rotation(self):
-        result = self._rotation
-        if self._body is not None:
-            result = self._body.getQuaternion()
-        elif self._geom is not None:
-            result = self._geom.getQuaternion()
-        return geom.Quaternion(*result)
+        """Rotation of the transform in world space"""
+        self._resolve()
+        return self._rotation
     
     @rotation.setter
     def rotation(self, value):
-        if self._body is not None:
-            self._body.setQuaternion(value)
-        if self._geom is not None:
-            self._geom.setQuaternion(value)
-        self._rotation = value
+        self._resolve()
+        self._rotation = geom.Quaternion(*value)
+        self._updatelocal()
+        self._invalidate()
+        self._pushworld()
+
+    @property
+    def localposition(self):
+        """Position of the transform relative to its parent"""
+        self._resolve()
+        return self._localposition
+    
+    @localposition.setter
+    def localposition(self, value):
+        self._resolve()
+        self._localposition = geom.Vector3D(*value)
+        self._updateworld()
+
+    @property
+    def localrotation(self):
+        """Rotation of the transform relative to its parent"""
+        self._resolve()
+        return self._localrotation
+    
+    @localrotation.setter
+    def localrotation(self, value):
+        self._resolve()
+        self._localrotation = geom.Quaternion(*value)
+        self._updateworld()
 
     @property
     def scale(self):
@@ -523,48 +978,273 @@ class Transform(Component):
     @scale.setter
     def scale(self, value):
         self._scale = value
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        """
+        Column-major 4x4 model matrix with the world position, rotation and
+        the scale of the transform, as expected by ``glMultMatrixf``
+        """
+        self._resolve()
+        if self._matrix is None:
+            self._matrix = Transform._modelmatrix(self._position,
+                                                  self._rotation, self._scale)
+        return self._matrix
+
+    @property
+    def rendermatrix(self):
+        """
+        Model matrix used for rendering. When the game loop runs a fixed
+        timestep, it is interpolated between the world state before and after
+        the last simulation step, by the fraction ``Transform.interpolation``
+        of a step that has elapsed since then
+        """
+        alpha = Transform.interpolation
+        self._resolve()
+        if alpha is None or self._version == self._previousversion:
+            return self.matrix
+        position = self._previousposition + \
+            (self._position - self._previousposition) * alpha
+        rotation = self._previousrotation.nlerp(self._rotation, alpha)
+        return Transform._modelmatrix(position, rotation, self._scale)
+
+    def _savestate(self):
+        """
+        Stores the current world state as the start of the interpolation
+        """
+        self._resolve()
+        self._previousposition = self._position
+        self._previousrotation = self._rotation
+        self._previousversion = self._version
+
+    def _canmove(self):
+        """
+        Whether the world state may differ from the last saved one. The state
+        read from an awake body or from a parent only changes the version once
+        it is resolved, so those transforms are always saved
+        """
+        return self._version != self._previousversion or \
+            self._parent is not None or \
+            self._body is not None and not self._sleeping
+
+    @staticmethod
+    def _modelmatrix(position, rotation, scale):
+        a, b, c = position
+        w, x, y, z = rotation
+        sx, sy, sz = scale
+        x2 = x * x
+        y2 = y * y
+        z2 = z * z
+        xy = x * y
+        xz = x * z
+        yz = y * z
+        wx = w * x
+        wy = w * y
+        wz = w * z
+        return numpy.array(
+            [(1-2*(y2+z2))*sx, 2*(xy-wz)*sx, 2*(xz+wy)*sx, 0,
+             2*(xy+wz)*sy, (1-2*(x2+z2))*sy, 2*(yz-wx)*sy, 0,
+             2*(xz-wy)*sz, 2*(yz+wx)*sz, (1-2*(x2+y2))*sz, 0,
+             a, b, -c, 1], dtype=numpy.float32)
 
     @property
     def right(self):
-        q = geom.Quaternion(*self.rotation)
-        return q.rotate_vector([1, 0, 0])
+        return self.rotation.rotate_vector([1, 0, 0])
 
     @property
     def up(self):
-        q = geom.Quaternion(*self.rotation)
-        return q.rotate_vector([0, 1, 0])
+        return self.rotation.rotate_vector([0, 1, 0])
 
     @property
     def forward(self):
-        q = geom.Quaternion(*self.rotation)
-        return q.rotate_vector([0, 0, 1])
+        return self.rotation.rotate_vector([0, 0, 1])
+
+    @property
+    def parent(self):
+        """The parent transform, or None if it is a root of the scene graph"""
+        return self._parent
 
     def translate(self, movement):
         """
-        Moves the transform a certain offset
+        Moves the transform a certain offset. Its children move along with it
         """
         self.position = self.position + movement
 
     def rotate(self, axis, angle):
         """
-        Rotates the transform a certain offset
+        Rotates the transform a certain offset. Its children rotate around it
         """
         q1 = self.rotation
         q2 = geom.Quaternion.from_axis(axis, angle)
         self.rotation = q1 * q2
-        for child in self._children:
-            child.rotate(axis, angle)
     
     def addchild(self, child):
         """
-        Adds a Transform to its children
+        Adds a Transform to its children, keeping the world position and
+        rotation of the child. If the child already has a parent, it is
+        removed from it first
         """
+        node = self
+        while node is not None:
+            if node is child:
+                raise ValueError("A transform cannot be a child of "
+                                 "itself or its descendants")
+            node = node._parent
+        if child._parent is not None:
+            child._parent.removechild(child)
+        self._resolve()
+        child._resolve()
+        child._parent = self
+        child._updatelocal()
         self._children.append(child)
+        if self._body is not None:
+            self.scene._dynamic.add(self)
+    
+    def removechild(self, child):
+        """
+        Removes a Transform from its children, keeping the world position and
+        rotation of the child
+        """
+        child._resolve()
+        self._children.remove(child)
+        child._parent = None
+        child._updatelocal()
+        if not self._children and self.gameobject is not None:
+            self.scene._dynamic.discard(self)
     
     def __iter__(self):
         return self._children.__iter__()
 
 
+class EntityTransform(Transform):
+    """
+    Transform backed by the position, rotation and scale columns of an
+    entity of an EntityStore, so that systems can move many gameobjects with
+    vectorized operations. The columns hold the world state: the transform
+    reads its row again only after a system has run, and writes it back when
+    it is moved through the usual API. The columns of a transform driven by
+    a rigidbody are updated each time it reads its body
+    """
+
+    def __init__(self, store, entity=None, position=(0, 0, 0),
+                 rotation=(1, 0, 0, 0), scale=(1, 1, 1)):
+        """
+        Parameters
+        ----------
+        store : EntityStore
+            Store with the columns of the transform
+        entity : int
+            Entity whose row is used. If None, a new entity is created with
+            *position*, *rotation* and *scale*, and it is destroyed along
+            with the transform. Otherwise, they are only used if the entity
+            lacks those components
+        """
+        self.store = store
+        self._owned = entity is None
+        values = dict(position=position, rotation=rotation, scale=scale)
+        if entity is None:
+            entity = store.create(**values)
+        else:
+            missing = dict((name, value) for name, value in values.items()
+                           if not store.has(entity, name))
+            if missing:
+                store.addcomponents(entity, **missing)
+        self.entity = entity
+        self._storeversion = store.version
+        Transform.__init__(self, store.get(entity, 'position').tolist(),
+                           store.get(entity, 'rotation').tolist(),
+                           store.get(entity, 'scale').tolist())
+
+    def ondestroy(self):
+        if self._owned and self.entity in self.store:
+            self.store.destroy(self.entity)
+
+    def _resolve(self):
+        """
+        Brings the cached world state up to date, reading the columns if a
+        system may have changed them since the last time
+        """
+        bodystep = self._bodystep
+        Transform._resolve(self)
+        store = self.store
+        if self._body is not None:
+            if self._bodystep != bodystep:
+                self._writecolumns()
+        elif self._storeversion != store.version:
+            self._storeversion = store.version
+            position = geom.Vector3D(*store.get(self.entity,
+                                                'position').tolist())
+            rotation = geom.Quaternion(*store.get(self.entity,
+                                                  'rotation').tolist())
+            if position != self._position or rotation != self._rotation:
+                self._position = position
+                self._rotation = rotation
+                self._updatelocal()
+                self._invalidate()
+            else:
+                # The scale has no cached state besides the matrix
+                self._matrix = None
+
+    def _canmove(self):
+        return self._storeversion != self.store.version or \
+            Transform._canmove(self)
+
+    def _pushworld(self):
+        Transform._pushworld(self)
+        self._writecolumns()
+
+    def _writecolumns(self):
+        self.store.set(self.entity, 'position', self._position)
+        self.store.set(self.entity, 'rotation', self._rotation)
+
+    @property
+    def _scale(self):
+        return tuple(self.store.get(self.entity, 'scale').tolist())
+
+    @_scale.setter
+    def _scale(self, value):
+        self.store.set(self.entity, 'scale', value)
+
+
+class EntityRenderable(Renderable):
+    """
+    Renderable whose color is stored in the color column of an entity of an
+    EntityStore. Entities can also be drawn without any gameobject, all at
+    once, with ``EntityStore.render``
+    """
+
+    def __init__(self, store, entity, geometry, color=None):
+        """
+        Parameters
+        ----------
+        store : EntityStore
+            Store with the color column
+        entity : int
+            Entity whose row is used, usually the one of an EntityTransform
+        geometry : Geometry
+            Geometry drawn by the renderable
+        color : tuple
+            Initial RGBA color. If None, the one of the entity is kept
+        """
+        self.store = store
+        self.entity = entity
+        if not store.has(entity, 'color'):
+            store.addcomponents(entity, color=tuple(color or (1, 1, 1, 1)))
+        if color is None:
+            color = self.color
+        Renderable.__init__(self, color, geometry)
+
+    @property
+    def color(self):
+        return tuple(self.store.get(self.entity, 'color').tolist())
+
+    @color.setter
+    def color(self, value):
+        if value is not None:
+            self.store.set(self.entity, 'color', tuple(value))
+
+
 class Camera(Component):    
     def __init__(self, distance=(0, 0, 0), orientation=(0, 0, 0)):
         Component.__init__(self)
@@ -573,17 +1253,38 @@ class Camera(Component):
         
     def push(self):
         dx, dy, dz = self.distance
-        x, y, z = self.transform.position
+        x, y, z = self.transform.rendermatrix[12:15]
         a, b, c = self.orientation
         GL.glPushMatrix()
         GL.glTranslatef(-dx, -dy, -dz)
         GL.glRotatef(-a, 1, 0, 0)
         GL.glRotatef(-b, 0, 1, 0)
         GL.glRotatef(c, 0, 0, 1)
-        GL.glTranslatef(-x, -y, z)
+        GL.glTranslatef(-x, -y, -z)
 
     def pop(self):
         GL.glPopMatrix()
+    
+    def viewmatrix(self):
+        """
+        Returns the 4x4 row-major view matrix that push multiplies
+        """
+        dx, dy, dz = self.distance
+        x, y, z = self.transform.rendermatrix[12:15]
+        a, b, c = self.orientation
+        return reduce(numpy.dot, [culling.translation((-dx, -dy, -dz)),
+                                  culling.rotation(-a, (1, 0, 0)),
+                                  culling.rotation(-b, (0, 1, 0)),
+                                  culling.rotation(c, (0, 0, 1)),
+                                  culling.translation((-x, -y, -z))])
+    
+    def frustum(self):
+        """
+        Returns the Frustum seen through the camera with the projection of
+        the renderer
+        """
+        return Frustum(numpy.dot(OpenGLRenderer.projectionmatrix(),
+                                 self.viewmatrix()))
 
 
 class Light(Component):
@@ -617,13 +1318,26 @@ class Light(Component):
 
 class GameObject(object):
     
-    _gameobjects = []
-    _camera = None
-    _lights = []
+    _ids = itertools.count(1)
     
-    def __init__(self, transform=Transform(), *components):
-        self.name = ''
-        self.tag = ''
+    def __init__(self, transform=Transform(), *components, **options):
+        """
+        Creates a gameobject with a transform and other components, added to
+        the scene given with the *scene* keyword or else to the current one
+        """
+        self.scene = options.get('scene') or Scene.current or Scene()
+        #: Unique and stable identifier of the gameobject
+        self.id = next(GameObject._ids)
+        self._slot = None
+        self._name = ''
+        self._tag = ''
+        self._dormant = False
+        #: GameObjectPool that spawned the gameobject, or None
+        self.pool = None
+        # Component of each class returned by getcomponent
+        self._componentcache = {}
+        # Bound methods of the components that override each hook
+        self._handlers = dict((hook, []) for hook in _HOOKS)
         self.transform = None
         self.rigidbody = None
         self.collider = None
@@ -631,20 +1345,52 @@ class GameObject(object):
         self.components = []
         self.addcomponent(transform)
         for c in components: self.addcomponent(c)
-        GameObject._gameobjects.append(self)
+        self.scene.gameobjects.add(self)
+    
+    @property
+    def name(self):
+        return self._name
+    
+    @name.setter
+    def name(self, value):
+        old, self._name = self._name, value
+        self.scene.gameobjects._retag(self, 'name', old, value)
+    
+    @property
+    def tag(self):
+        return self._tag
+    
+    @tag.setter
+    def tag(self, value):
+        old, self._tag = self._tag, value
+        self.scene.gameobjects._retag(self, 'tag', old, value)
         
-    def getcomponentbyclass(self, cls):
+    def getcomponent(self, cls):
         """
-        Returns an attached component of a specific class
+        Returns an attached component of a specific class, or None. The
+        result is cached until a component is added or removed
         
         Parameters
         ----------
         cls : classobj
             Class of the component
         """
-        for c in self.components:
-            if isinstance(c, cls):
-                return c
+        try:
+            return self._componentcache[cls]
+        except KeyError:
+            for c in self.components:
+                if isinstance(c, cls):
+                    break
+            else:
+                c = None
+            self._componentcache[cls] = c
+            return c
+    
+    def getcomponentbyclass(self, cls):
+        """
+        Returns an attached component of a specific class, see getcomponent
+        """
+        return self.getcomponent(cls)
     
     def addcomponents(self, *components):
         for component in components:
@@ -655,7 +1401,7 @@ class GameObject(object):
         Adds a component to the gameobject
         """
         if isinstance(component, Camera):
-            GameObject._camera = component
+            self.scene.camera = component
         self._updatecomponents('append', component)
         self._checkfield('transform', component)
         self._checkfield('rigidbody', component)
@@ -669,8 +1415,9 @@ class GameObject(object):
         """
         if component is None: return
         if isinstance(component, Camera):
-            GameObject._camera = None
+            self.scene.camera = None
         self._updatecomponents('remove', component)
+        component.ondestroy()
         Component.__init__(component)
 
     def _checkfield(self, cls_string, component):
@@ -682,11 +1429,50 @@ class GameObject(object):
             
     def _updatecomponents(self, action, component):
         if isinstance(component, Light):
-            getattr(GameObject._lights, action)(component)
+            getattr(self.scene.lights, action)(component)
         if isinstance(component, Component):
             getattr(self.components, action)(component)
+            self._updatehandlers(action, component)
+            self._componentcache.clear()
+            registry = self.scene.gameobjects
+            if self in registry:
+                if action == 'append':
+                    registry._addcomponent(component)
+                else:
+                    registry._removecomponent(component)
         if isinstance(component, Renderable):
             getattr(self.renderables, action)(component)
+    
+    def _updatehandlers(self, action, component):
+        """
+        Adds or removes the overridden hooks of *component* to the handlers
+        of the gameobject and to the dispatch lists of the scene
+        """
+        for hook in _HOOKS:
+            if _overrides(component, hook):
+                method = getattr(component, hook)
+                getattr(self._handlers[hook], action)(method)
+                if hook in Scene.hooks and not self._dormant:
+                    getattr(self.scene._handlers[hook], action)(method)
+    
+    @property
+    def dormant(self):
+        """
+        Whether the rigidbody sleeps or the gameobject is in its pool, in
+        which case the scene does not update the gameobject
+        """
+        return self._dormant
+    
+    @dormant.setter
+    def dormant(self, value):
+        if value == self._dormant:
+            return
+        self._dormant = value
+        for hook in Scene.hooks:
+            handlers = self.scene._handlers[hook]
+            for method in self._handlers[hook]:
+                if value: handlers.remove(method)
+                else: handlers.append(method)
             
     def handle_message(self, string, data=None):
         for component in self.components:
@@ -698,15 +1484,15 @@ class GameObject(object):
         """
         Updates the gameobject and its children
         """
-        for component in self.components:
-            component.update()
+        for update in self._handlers['update']:
+            update()
     
     def lateupdate(self):
         """
         Called after all updates
         """
-        for component in self.components:
-            component.lateupdate()
+        for lateupdate in self._handlers['lateupdate']:
+            lateupdate()
 
     def render(self):
         """
@@ -716,23 +1502,201 @@ class GameObject(object):
             component.render()
 
     def oncollision(self, other):
-        for component in self.components:
-            component.oncollision(other)
+        for oncollision in list(self._handlers['oncollision']):
+            oncollision(other)
+
+    def _collide(self, hook, other, contacts, flip):
+        """
+        Sends a collision event to the components that override *hook*, and
+        to those that override oncollision while the gameobjects touch
+        """
+        handlers = self._handlers[hook]
+        if handlers:
+            collision = Collision(other, contacts, flip)
+            for handler in list(handlers):
+                handler(collision)
+        if hook != 'oncollisionexit':
+            self.oncollision(other)
 
     def destroy(self):
         """
-        Removes a the gameobject from the scene
+        Removes the gameobject from the scene. Destroying it again does
+        nothing. If a component fails to release its resources, the other
+        components still release theirs, and then the first error is raised
         """
         try:
-            GameObject._gameobjects.remove(self)
-            if self.rigidbody is not None:
-                self.rigidbody.disable()
-                self.rigidbody = None
-            if self.collider is not None:
-                self.collider.disable()
-                self.collider = None
-        except:
-            print("WARNING: This object is already removed")
+            self.scene.gameobjects.remove(self)
+        except ValueError:
+            return
+        error = None
+        for component in self.components:
+            try:
+                component.ondestroy()
+            except Exception:
+                if error is None:
+                    error = sys.exc_info()
+        for component in self.components:
+            self._updatehandlers('remove', component)
+        if self.rigidbody is not None:
+            self.rigidbody.disable()
+            self.rigidbody = None
+        if self.collider is not None:
+            self.collider.disable()
+            self.scene.physics.removecontacts(self)
+            self.collider = None
+        if error is not None:
+            raise error[0], error[1], error[2]
+    
+    def despawn(self):
+        """
+        Returns the gameobject to the pool that spawned it, or destroys it
+        if it was not spawned by a pool
+        """
+        if self.pool is not None:
+            self.pool.despawn(self)
+        else:
+            self.destroy()
+
+
+class Prefab(object):
+    """
+    Template of a gameobject. It holds a function for each component, called
+    each time a gameobject is instantiated, so that every instance has its
+    own components. For example::
+    
+        bullet = Prefab(lambda: Sphere(Color.green), SphereCollider,
+                        lambda: Rigidbody(1), scale=(.5, .5, .5), tag='Bullet')
+    """
+    
+    def __init__(self, *factories, **options):
+        """
+        Parameters
+        ----------
+        factories : callable
+            Functions or classes called without arguments, which return the
+            components of the gameobject besides its transform
+        options : dict
+            The *scale*, *tag* and *name* of the instances
+        """
+        self.factories = factories
+        self.scale = options.get('scale', (1, 1, 1))
+        self.tag = options.get('tag', '')
+        self.name = options.get('name', '')
+    
+    def instantiate(self, position=(0, 0, 0), rotation=(1, 0, 0, 0),
+                    scene=None):
+        """Creates a new gameobject from the template"""
+        transform = Transform(position, rotation, self.scale)
+        components = [factory() for factory in self.factories]
+        gameobject = GameObject(transform, *components, scene=scene)
+        gameobject.tag = self.tag
+        gameobject.name = self.name
+        return gameobject
+
+
+class GameObjectPool(object):
+    """
+    Pool of gameobjects built from a Prefab. Despawned gameobjects leave the
+    scene but keep their components, with their ODE bodies and geoms and
+    their OpenGL resources, and the next spawn reuses them instead of
+    allocating new ones. For example::
+    
+        bullets = GameObjectPool(bullet, size=20)
+        shot = bullets.spawn(position)
+        shot.rigidbody.addforce(force)
+        ...
+        shot.despawn()
+    """
+    
+    def __init__(self, prefab, size=0, scene=None):
+        """
+        Parameters
+        ----------
+        prefab : Prefab
+            Template of the gameobjects
+        size : int
+            Number of gameobjects created in advance, see prewarm
+        scene : Scene
+            Scene of the gameobjects, by default the current one
+        """
+        self.prefab = prefab
+        self.scene = scene or Scene.current or Scene()
+        self.scene.pools.append(self)
+        self._active = set()
+        self._free = []
+        self._created = 0
+        self._spawned = 0
+        self.prewarm(size)
+    
+    def prewarm(self, count):
+        """
+        Creates gameobjects until *count* of them are waiting in the pool
+        """
+        while len(self._free) < count:
+            gameobject = self._instantiate()
+            self._park(gameobject)
+    
+    def spawn(self, position=(0, 0, 0), rotation=(1, 0, 0, 0)):
+        """
+        Adds a gameobject of the pool to the scene at *position*, creating
+        one only if the pool is empty, and returns it
+        """
+        self._spawned += 1
+        if not self._free:
+            gameobject = self._instantiate(position, rotation)
+        else:
+            gameobject = self._free.pop()
+            gameobject.dormant = False
+            self.scene.gameobjects.add(gameobject)
+            transform = gameobject.transform
+            transform.position = position
+            transform.rotation = rotation
+            # Do not interpolate from the position of the last spawn
+            transform._savestate()
+        self._active.add(gameobject)
+        for component in list(gameobject.components):
+            component.onspawn()
+        return gameobject
+    
+    def despawn(self, gameobject):
+        """Removes a spawned gameobject from the scene and keeps it"""
+        if gameobject not in self._active:
+            raise ValueError("The gameobject is not spawned by this pool")
+        self._active.remove(gameobject)
+        self._park(gameobject)
+    
+    def stats(self):
+        """
+        Returns a dict with the number of spawned gameobjects, of those
+        waiting in the pool, of gameobjects created and of spawns
+        """
+        return {'active': len(self._active), 'free': len(self._free),
+                'created': self._created, 'spawned': self._spawned}
+    
+    def clear(self):
+        """
+        Destroys the gameobjects waiting in the pool
+        """
+        free, self._free = self._free, []
+        for gameobject in free:
+            # Back in the scene, so that destroy releases it as usual
+            self.scene.gameobjects.add(gameobject)
+            gameobject.dormant = False
+            gameobject.pool = None
+            gameobject.destroy()
+    
+    def _instantiate(self, position=(0, 0, 0), rotation=(1, 0, 0, 0)):
+        gameobject = self.prefab.instantiate(position, rotation, self.scene)
+        gameobject.pool = self
+        self._created += 1
+        return gameobject
+    
+    def _park(self, gameobject):
+        for component in list(gameobject.components):
+            component.ondespawn()
+        self.scene.gameobjects.remove(gameobject)
+        gameobject.dormant = True
+        self._free.append(gameobject)
 
 
 class CubePrimitive(GameObject):
@@ -810,19 +1774,133 @@ class Color(object):
 
 class Scene(object):
     """
-    Root gameobject of a game
+    Physics world, gameobjects, camera and lights of a level. Scenes are
+    independent of each other: several of them can be built, stepped and
+    destroyed in the same process, for example to load the next level while
+    the current one is played. New gameobjects are added to the current
+    scene, which is the last one created or activated
     """
-    def __init__(self, gravity=(0, -9.8, 0), erp=.8, cfm=1e-5):
+    
+    current = None
+    # Hooks dispatched by the scene, in this order, on every update
+    hooks = ('update', 'lateupdate')
+    _scenes = weakref.WeakSet()
+    
+    def __init__(self, gravity=(0, -9.8, 0), erp=.8, cfm=1e-5,
+                 broadphase='simple', **options):
+        """
+        Creates the physics world of the scene and makes it the current one.
+        *broadphase* and *options* select the collision space, the solver
+        and the auto-disable of resting bodies, see ``PhysicsEngine``
         """
-        Initializes the physics for the current scene
+        self.physics = PhysicsEngine(gravity, erp, cfm, broadphase, **options)
+        self.gameobjects = GameObjectRegistry()
+        self.pools = []
+        self.camera = None
+        self.lights = []
+        # Bound methods of the components that override each hook, except
+        # those of dormant gameobjects
+        self._handlers = dict((hook, []) for hook in Scene.hooks)
+        # Transforms with children whose world state changed since the last
+        # call to propagate, and transforms with children driven by a
+        # rigidbody
+        self._changed = set()
+        self._dynamic = set()
+        Scene._scenes.add(self)
+        self.activate()
+    
+    def activate(self):
+        """Makes the scene the one that new gameobjects are added to"""
+        Scene.current = self
+    
+    @classmethod
+    def allgameobjects(cls):
+        """Iterates over the gameobjects of every scene"""
+        for scene in list(cls._scenes):
+            for gameobject in scene.gameobjects:
+                yield gameobject
+    
+    def update(self):
         """
-        PhysicsEngine.start(gravity, erp, cfm)
+        Calls the update and then the lateupdate methods of the components
+        of the gameobjects that are not dormant. Only the components that
+        override them are called, from lists kept up to date as components
+        are added and removed
+        """
+        for hook in Scene.hooks:
+            for method in list(self._handlers[hook]):
+                method()
+    
+    def propagate(self):
+        """
+        Resolves the world state of the descendants of every transform that
+        has changed since the last call. The game loop calls it once per frame,
+        so the colliders of child transforms follow their parents before the
+        physics step
+        """
+        for transform in list(self._dynamic):
+            transform._resolve()
+        changed, self._changed = self._changed, set()
+        for transform in changed:
+            stack = list(transform._children)
+            while stack:
+                child = stack.pop()
+                version = child._version
+                child._resolve()
+                if child._version != version:
+                    stack.extend(child._children)
+    
+    def step(self, step):
+        """
+        Updates the gameobjects and advances the physics *step* seconds
+        """
+        self.update()
+        self.propagate()
+        self.physics.step(step)
+    
+    def destroy(self):
+        """
+        Destroys every gameobject of the scene, so that its components
+        release their resources. If some of them fail, the scene is still
+        destroyed, and then the first error is raised
+        """
+        error = None
+        teardown = [pool.clear for pool in self.pools] + \
+            [gameobject.destroy for gameobject in list(self.gameobjects)]
+        for destroy in teardown:
+            try:
+                destroy()
+            except Exception:
+                if error is None:
+                    error = sys.exc_info()
+        self.camera = None
+        self.lights = []
+        Scene._scenes.discard(self)
+        if Scene.current is self:
+            Scene.current = None
+        if error is not None:
+            raise error[0], error[1], error[2]
 
 
 class Game(object):
     
     delta = 0.
     scale = 1.
+    instancing = True
+    # Length in seconds of a simulation step. If it is None, the game is
+    # simulated once per rendered frame; otherwise, the game runs as many
+    # fixed steps per frame as the elapsed time requires
+    fixedstep = None
+    # Maximum number of fixed steps run in a single frame
+    maxsteps = 5
+    # Whether to interpolate the rendered transforms between fixed steps
+    interpolate = True
+    # Whether the game runs without a window nor OpenGL, for example to
+    # train agents or test the game logic. It must be set before the
+    # scene is built, and the game is then advanced with run
+    headless = False
+    # Whether the renderables outside the view frustum are skipped
+    culling = True
     
     def __init__(self, screen_size=(800, 600), fullscreen=False):
         """
@@ -835,6 +1913,10 @@ class Game(object):
         self.camera = None
         self.lights = []
         self.scene = Scene()
+        # Number of renderables submitted and culled in the last frame
+        self.renderstats = {'submitted': 0, 'culled': 0}
+        self.renderqueue = RenderQueue()
+        self._accumulator = 0.
         
     def mainloop(self, fps=60):
         """
@@ -843,26 +1925,174 @@ class Game(object):
         OpenGLRenderer.init(self.screen_size, self.fullscreen)
         OpenGLRenderer.set_window_title(self.title)        
         OpenGLRenderer.set_window_icon(self.icon)
-        try: self._mainloop(fps)
-        finally: OpenGLRenderer.quit()
+        self._instancing = Game.instancing and \
+            InstancedRenderer.issupported()
+        try:
+            if Game.fixedstep is None: self._mainloop(fps)
+            else: self._fixedloop(fps)
+        finally:
+            Transform.interpolation = None
+            OpenGLRenderer.quit()
             
     def _mainloop(self, fps):
         step = 1. / fps
         clock = pygame.time.Clock()
         while not Input.quitflag:
             Input.update()
-            map(GameObject.update, GameObject._gameobjects)
-            #self.scene.lateupdate()
+            AssetLoader.update()
+            self.scene.update()
+            self.scene.propagate()
             self._renderloop()
-            PhysicsEngine.step(step * Game.scale)
+            self.scene.physics.step(step * Game.scale)
             delta = clock.tick(fps)
             Game.delta = delta / 1000.
             
+    def _fixedloop(self, fps):
+        clock = pygame.time.Clock()
+        clock.tick()
+        Game.delta = Game.fixedstep
+        while not Input.quitflag:
+            Input.update()
+            AssetLoader.update()
+            self.advance(clock.tick(fps) / 1000.)
+            self.scene.propagate()
+            self._renderloop()
+    
+    def advance(self, frametime):
+        """
+        Advances the game *frametime* seconds, scaled by ``Game.scale``, in
+        steps of ``Game.fixedstep``, and returns the number of steps run. The
+        time left for a whole step is carried over to the next frame. At
+        most ``Game.maxsteps`` steps run at once, and the time beyond them is
+        dropped, so a slow frame slows the game down instead of making the
+        next frames slower too
+        """
+        step = Game.fixedstep
+        self._accumulator += frametime * Game.scale
+        steps = 0
+        while self._accumulator >= step:
+            if steps == Game.maxsteps:
+                self._accumulator %= step
+                break
+            self._fixedupdate(step)
+            self._accumulator -= step
+            steps += 1
+        if Game.interpolate:
+            Transform.interpolation = self._accumulator / step
+        return steps
+    
+    def _fixedupdate(self, step):
+        # Static and sleeping transforms keep their last saved state
+        for gameobject in self.scene.gameobjects:
+            transform = gameobject.transform
+            if transform._canmove():
+                transform._savestate()
+        self.scene.step(step)
+            
+    def run(self, ticks, script=None):
+        """
+        Simulates *ticks* fixed steps as fast as possible, without rendering
+        nor reading the input devices, and returns a dict with the number
+        of ticks run, the elapsed seconds, the ticks per second and the
+        average seconds per tick spent in each phase
+        
+        Parameters
+        ----------
+        ticks : int
+            Number of steps of ``Game.fixedstep`` seconds, or of 1/60
+            seconds if it is None. The run stops early if
+            ``Input.quitflag`` is set
+        script : dict or callable
+            Scripted input: maps each tick to a list of (key, pressed)
+            pairs applied before it, or is a function that returns the list
+            for a tick
+        """
+        step = Game.fixedstep or 1. / 60
+        if script is None:
+            script = {}
+        if isinstance(script, dict):
+            script = lambda tick, script=script: script.get(tick, ())
+        Game.delta = step
+        Transform.interpolation = None
+        phases = dict.fromkeys(('input', 'update', 'propagate', 'physics'),
+                               0.)
+        count = 0
+        start = time.time()
+        while count < ticks:
+            t0 = time.time()
+            Input.simulate(script(count))
+            if Input.quitflag:
+                break
+            AssetLoader.update()
+            t1 = time.time()
+            self.scene.update()
+            t2 = time.time()
+            self.scene.propagate()
+            t3 = time.time()
+            self.scene.physics.step(step * Game.scale)
+            t4 = time.time()
+            phases['input'] += t1 - t0
+            phases['update'] += t2 - t1
+            phases['propagate'] += t3 - t2
+            phases['physics'] += t4 - t3
+            count += 1
+        elapsed = time.time() - start
+        for phase in phases:
+            phases[phase] /= max(count, 1)
+        return {'ticks': count, 'time': elapsed,
+                'tickspersecond': count / elapsed if elapsed else 0.,
+                'phases': phases}
+    
     def _renderloop(self):
+        scene = self.scene
         OpenGLRenderer.clearscreen()
-        if GameObject._camera: GameObject._camera.push()
-        for light in GameObject._lights: light.enable()
-        map(GameObject.render, GameObject._gameobjects)
-        if GameObject._camera: GameObject._camera.pop()
+        if scene.camera: scene.camera.push()
+        for light in scene.lights: light.enable()
+        renderables, culled = self._cull(scene)
+        self.renderstats = {'submitted': len(renderables), 'culled': culled}
+        queue = self.renderqueue
+        view = scene.camera.viewmatrix() if scene.camera else numpy.identity(4)
+        queue.build(renderables, view, OpenGLRenderer._closeview,
+                    OpenGLRenderer._farview)
+        self._submit(queue.opaque)
+        # Blended renderables are tested against the depth of the opaque
+        # ones, but do not hide each other
+        GL.glDepthMask(GL.GL_FALSE)
+        self._submit(queue.transparent)
+        GL.glDepthMask(GL.GL_TRUE)
+        if scene.camera: scene.camera.pop()
         OpenGLRenderer.flip()
+    
+    def _submit(self, renderables):
+        """
+        Draws *renderables* in order. With instancing, each run of
+        renderables with the same geometry is drawn with one call
+        """
+        if not self._instancing:
+            for renderable in renderables: renderable.render()
+            return
+        run = []
+        for renderable in renderables:
+            geometry = renderable.geometry
+            if run and run[0].geometry is not geometry:
+                InstancedRenderer.render(run)
+                run = []
+            if geometry is None: renderable.render()
+            else: run.append(renderable)
+        InstancedRenderer.render(run)
+    
+    def _cull(self, scene):
+        """
+        Returns the renderables of *scene* that intersect the view frustum,
+        and the number of them that do not
+        """
+        renderables = [renderable for gameobject in scene.gameobjects
+                       for renderable in gameobject.renderables]
+        if not Game.culling:
+            return renderables, 0
+        if scene.camera is not None:
+            frustum = scene.camera.frustum()
+        else:
+            frustum = Frustum(OpenGLRenderer.projectionmatrix())
+        return frustum.cull(renderables)
 
@@ -0,0 +1,191 @@
+"""
+Batch simulation of many scenes, for parameter sweeps.
+
+Each run builds a scene with a factory, simulates it headless for a number
+of fixed ticks and sends back its results. The runs are spread over a pool
+of processes: each worker takes the next pending run as soon as it finishes
+the last one, so long and short runs keep every core busy. A run that raises
+an exception only fails itself, and its traceback is sent back instead.
+"""
+
+import multiprocessing
+import time
+import traceback
+
+import numpy
+
+import pyngine
+
+
+class BatchResult(object):
+    """
+    Outcome of one run of a batch
+    """
+
+    def __init__(self, index, params):
+        #: Position of the parameter set in the batch
+        self.index = index
+        #: Keyword arguments passed to the factory
+        self.params = params
+        #: Number of ticks simulated and seconds they took
+        self.ticks = 0
+        self.time = 0.
+        #: Value returned by the measure function, if any
+        self.result = None
+        #: List of (tick, positions, rotations, ids) tuples, with the (N, 3)
+        #: positions, (N, 4) rotations and (N,) ids of the N gameobjects of
+        #: the scene, sorted by id
+        self.snapshots = []
+        #: Formatted traceback if the run failed, or None
+        self.error = None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def __repr__(self):
+        state = 'failed' if self.failed else '%d ticks' % self.ticks
+        return "BatchResult(%d, %r, %s)" % (self.index, self.params, state)
+
+
+class BatchRunner(object):
+    """
+    Runs a scene factory once for each parameter set. For example::
+
+        def tower(height):
+            scene = Scene(solver='quickstep')
+            for i in xrange(height):
+                GameObject(Transform((0, i, 0)), BoxCollider(), Rigidbody(1))
+            return scene
+
+        runner = BatchRunner(tower, ticks=600, snapshotevery=60)
+        for result in runner.run([{'height': h} for h in xrange(1, 50)]):
+            print(result.index, result.snapshots[-1][1][:, 1].max())
+
+    The factory, the measure function and the parameters are sent to the
+    worker processes, so they must be picklable: the functions must be
+    defined at the top level of a module
+    """
+
+    def __init__(self, factory, ticks, step=1. / 60, processes=None,
+                 snapshotevery=0, measure=None):
+        """
+        Parameters
+        ----------
+        factory : callable
+            Function called with the parameters of a run as keyword
+            arguments. It builds the gameobjects of a new Scene and
+            returns it
+        ticks : int
+            Number of fixed steps simulated in each run
+        step : float
+            Length in seconds of each step
+        processes : int
+            Number of worker processes, by default one per core. With 0,
+            the runs are simulated one after another in this process
+        snapshotevery : int
+            Ticks between transform snapshots. With 0, only the final
+            state of the scene is taken
+        measure : callable
+            Function called with the scene at the end of each run, whose
+            return value is sent back as the result of the run
+        """
+        self.factory = factory
+        self.ticks = ticks
+        self.step = step
+        self.processes = processes
+        self.snapshotevery = snapshotevery
+        self.measure = measure
+
+    def run(self, paramsets):
+        """
+        Simulates one run for each dict of *paramsets*, and yields their
+        BatchResult in the order they finish
+        """
+        tasks = [(self, index, params)
+                 for index, params in enumerate(paramsets)]
+        if self.processes == 0:
+            for task in tasks:
+                yield _simulate(task)
+            return
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            # One run per task, so idle workers always take the next run
+            for result in pool.imap_unordered(_simulate, tasks, 1):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def runall(self, paramsets):
+        """
+        Returns the BatchResult of every run, in the order of *paramsets*
+        """
+        results = list(self.run(paramsets))
+        results.sort(key=lambda result: result.index)
+        return results
+
+    def _simulate(self, index, params):
+        """
+        Builds and steps one scene in the current process
+        """
+        Game = pyngine.Game
+        result = BatchResult(index, params)
+        headless, delta = Game.headless, Game.delta
+        Game.headless = True
+        Game.delta = self.step
+        scene = None
+        start = time.time()
+        try:
+            try:
+                scene = self.factory(**params)
+                for tick in xrange(self.ticks):
+                    scene.step(self.step)
+                    result.ticks = tick + 1
+                    if self.snapshotevery and \
+                            result.ticks % self.snapshotevery == 0:
+                        result.snapshots.append(snapshot(scene,
+                                                         result.ticks))
+                last = result.snapshots[-1][0] if result.snapshots else None
+                if last != result.ticks:
+                    result.snapshots.append(snapshot(scene, result.ticks))
+                if self.measure is not None:
+                    result.result = self.measure(scene)
+            except Exception:
+                result.error = traceback.format_exc()
+            result.time = time.time() - start
+            if scene is not None:
+                # Teardown errors also only fail this run
+                try:
+                    scene.destroy()
+                except Exception:
+                    result.error = (result.error or '') + \
+                        traceback.format_exc()
+        finally:
+            Game.headless, Game.delta = headless, delta
+        return result
+
+
+def snapshot(scene, tick=0):
+    """
+    Returns a (tick, positions, rotations, ids) tuple with the world
+    positions, rotations and ids of the gameobjects of *scene* as arrays.
+    The rows are sorted by id, since destroying gameobjects changes the order
+    of the scene, so the rows of different snapshots can be matched by id
+    """
+    gameobjects = sorted(scene.gameobjects,
+                         key=lambda gameobject: gameobject.id)
+    ids = numpy.array([gameobject.id for gameobject in gameobjects],
+                      dtype=numpy.int64)
+    transforms = [gameobject.transform for gameobject in gameobjects]
+    positions = numpy.array([tuple(t.position) for t in transforms],
+                            dtype=numpy.float64).reshape(-1, 3)
+    rotations = numpy.array([tuple(t.rotation) for t in transforms],
+                            dtype=numpy.float64).reshape(-1, 4)
+    return tick, positions, rotations, ids
+
+
+def _simulate(task):
+    runner, index, params = task
+    return runner._simulate(index, params)
@@ -0,0 +1,114 @@
+"""
+View-frustum culling.
+
+The frustum is built from the view matrix of the camera and the perspective
+projection of the renderer, with the same math as the GL calls that set them
+up, so it does not read the matrices back from the driver. Renderables are
+tested with the bounding sphere of their geometry, placed and scaled by their
+model matrices, all at once with NumPy.
+"""
+
+import math
+
+import numpy
+
+
+def translation(offset):
+    """Returns the 4x4 matrix of ``glTranslatef``"""
+    matrix = numpy.identity(4)
+    matrix[:3, 3] = offset
+    return matrix
+
+
+def rotation(angle, axis):
+    """Returns the 4x4 matrix of ``glRotatef``, with *angle* in degrees"""
+    x, y, z = numpy.asarray(axis, dtype=numpy.float64) / \
+        numpy.linalg.norm(axis)
+    c, s = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    t = 1 - c
+    matrix = numpy.identity(4)
+    matrix[:3, :3] = [[t*x*x + c, t*x*y - s*z, t*x*z + s*y],
+                      [t*x*y + s*z, t*y*y + c, t*y*z - s*x],
+                      [t*x*z - s*y, t*y*z + s*x, t*z*z + c]]
+    return matrix
+
+
+def perspective(fovy, aspect, near, far):
+    """Returns the 4x4 matrix of ``gluPerspective``"""
+    f = 1. / math.tan(math.radians(fovy) / 2)
+    matrix = numpy.zeros((4, 4))
+    matrix[0, 0] = f / aspect
+    matrix[1, 1] = f
+    matrix[2, 2] = (far + near) / (near - far)
+    matrix[2, 3] = 2 * far * near / (near - far)
+    matrix[3, 2] = -1
+    return matrix
+
+
+def spheres(matrices, centers, radii):
+    """
+    Returns the world centers and radii of bounding spheres
+
+    Parameters
+    ----------
+    matrices : numpy.ndarray
+        (N, 16) array of column-major model matrices
+    centers : numpy.ndarray
+        (N, 3) array of centers in model space
+    radii : numpy.ndarray
+        (N,) array of radii in model space, scaled by the largest axis of
+        each matrix
+    """
+    m = numpy.asarray(matrices, dtype=numpy.float64).reshape(-1, 4, 4)
+    centers = numpy.asarray(centers, dtype=numpy.float64)
+    # Rows of m are the columns of the model matrices
+    world = numpy.einsum('nij,ni->nj', m[:, :3, :3], centers) + m[:, 3, :3]
+    scale = numpy.sqrt((m[:, :3, :3] ** 2).sum(axis=2).max(axis=1))
+    return world, numpy.asarray(radii, dtype=numpy.float64) * scale
+
+
+class Frustum(object):
+    """
+    Six planes of a view frustum, pointing inwards
+    """
+
+    def __init__(self, matrix):
+        """
+        Parameters
+        ----------
+        matrix : numpy.ndarray
+            4x4 row-major product of the projection and view matrices
+        """
+        m = numpy.asarray(matrix, dtype=numpy.float64)
+        # Left, right, bottom, top, near and far planes
+        planes = numpy.array([m[3] + m[0], m[3] - m[0], m[3] + m[1],
+                              m[3] - m[1], m[3] + m[2], m[3] - m[2]])
+        planes /= numpy.sqrt((planes[:, :3] ** 2).sum(axis=1))[:, None]
+        self.planes = planes
+
+    def intersects(self, centers, radii):
+        """
+        Returns a boolean array telling which of the spheres are at least
+        partially inside the frustum
+        """
+        distances = numpy.dot(centers, self.planes[:, :3].T) + \
+            self.planes[:, 3]
+        return (distances >= -numpy.asarray(radii)[:, None]).all(axis=1)
+
+    def cull(self, renderables):
+        """
+        Returns the list of *renderables* that may be visible, and the number
+        of them that are not. Renderables without a geometry have no bounds,
+        so they are always kept
+        """
+        bounded = [r for r in renderables if r.geometry is not None]
+        visible = [r for r in renderables if r.geometry is None]
+        if not bounded:
+            return visible, 0
+        matrices = [r.transform.rendermatrix for r in bounded]
+        centers, radii = spheres(matrices,
+                                 [r.geometry.center for r in bounded],
+                                 [r.geometry.radius for r in bounded])
+        inside = self.intersects(centers, radii)
+        visible.extend(r for r, keep in zip(bounded, inside) if keep)
+        return visible, len(bounded) - int(inside.sum())
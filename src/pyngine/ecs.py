@@ -0,0 +1,297 @@
+"""
+Optional columnar storage of entities, alongside the GameObject API.
+
+Entities are plain integer ids, and their data-only components (position,
+velocity, color...) are stored in archetypes: tables with one NumPy column
+per component, shared by all the entities with the same set of components.
+Systems are functions that receive the columns of every archetype matching a
+query, so they update thousands of entities with a few array operations
+instead of a method call per object. For example::
+
+    store = EntityStore()
+    for i in xrange(1000):
+        store.create(position=(i, 0, 0), velocity=(0, 1, 0))
+
+    def move(position, velocity):
+        position += velocity * Game.delta
+
+    store.run(move, 'position', 'velocity')
+"""
+
+import numpy
+
+from instancing import InstancedRenderer
+
+
+class Archetype(object):
+    """
+    Table of the entities that have exactly the same components. The rows
+    of the live entities are packed at the start of the columns
+    """
+
+    def __init__(self, names, types, capacity=64):
+        self.names = frozenset(names)
+        self.types = dict((name, types[name]) for name in self.names)
+        self.entities = numpy.zeros(capacity, dtype=numpy.int64)
+        self.columns = {}
+        for name, (shape, dtype, _) in self.types.iteritems():
+            self.columns[name] = numpy.zeros((capacity,) + shape, dtype=dtype)
+        self.count = 0
+
+    @property
+    def capacity(self):
+        return len(self.entities)
+
+    def __len__(self):
+        return self.count
+
+    def column(self, name):
+        """Returns a view of the column *name* with the live rows"""
+        return self.columns[name][:self.count]
+
+    def _append(self, entity, values):
+        """
+        Adds a row for *entity* and returns its index. The components
+        missing from *values* get their default value
+        """
+        if self.count == self.capacity:
+            self._grow()
+        row = self.count
+        self.entities[row] = entity
+        for name, (_, _, default) in self.types.iteritems():
+            self.columns[name][row] = values.get(name, default)
+        self.count += 1
+        return row
+
+    def _remove(self, row):
+        """
+        Removes a row by moving the last one into its place. Returns the
+        entity that has been moved, or None
+        """
+        last = self.count - 1
+        moved = None
+        if row != last:
+            self.entities[row] = moved = int(self.entities[last])
+            for column in self.columns.itervalues():
+                column[row] = column[last]
+        self.count = last
+        return moved
+
+    def _row(self, row):
+        return dict((name, column[row].copy())
+                    for name, column in self.columns.iteritems())
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        entities = numpy.zeros(capacity, dtype=self.entities.dtype)
+        entities[:self.count] = self.entities[:self.count]
+        self.entities = entities
+        for name, column in self.columns.items():
+            grown = numpy.zeros((capacity,) + column.shape[1:],
+                                dtype=column.dtype)
+            grown[:self.count] = column[:self.count]
+            self.columns[name] = grown
+
+    def __repr__(self):
+        return "Archetype(%s, count=%d)" % (sorted(self.names), self.count)
+
+
+class EntityStore(object):
+    """
+    Entities and their components, stored in archetypes. The component types
+    position, rotation, scale, velocity and color are defined by default
+    """
+
+    def __init__(self):
+        # Shape, dtype and default value of each component type
+        self.types = {}
+        self._archetypes = {}
+        # Archetype and row of each entity
+        self._locations = {}
+        self._next = 0
+        #: Incremented each time a system runs, so that adapters know that
+        #: the columns may have changed
+        self.version = 0
+        self.define('position', (3,), numpy.float64)
+        self.define('rotation', (4,), numpy.float64, (1, 0, 0, 0))
+        self.define('scale', (3,), numpy.float64, (1, 1, 1))
+        self.define('velocity', (3,), numpy.float64)
+        self.define('color', (4,), numpy.float32, (1, 1, 1, 1))
+
+    def define(self, name, shape=(), dtype=numpy.float32, default=0):
+        """
+        Defines a component type
+
+        Parameters
+        ----------
+        name : str
+            Name of the component, used as keyword argument and column name
+        shape : tuple
+            Shape of the value of each entity, () for scalars
+        dtype : numpy.dtype
+            Type of the column
+        default : object
+            Value of the entities created without the component
+        """
+        self.types[name] = (tuple(shape), numpy.dtype(dtype), default)
+
+    def create(self, **components):
+        """
+        Creates an entity with the given component values, and returns its id
+        """
+        entity = self._next
+        self._next += 1
+        self._place(entity, components)
+        return entity
+
+    def destroy(self, entity):
+        """Removes an entity and all its components"""
+        archetype, row = self._locations.pop(entity)
+        moved = archetype._remove(row)
+        if moved is not None:
+            self._locations[moved] = (archetype, row)
+
+    def __contains__(self, entity):
+        return entity in self._locations
+
+    def __len__(self):
+        return len(self._locations)
+
+    def has(self, entity, name):
+        """Returns whether *entity* has the component *name*"""
+        return name in self._locations[entity][0].names
+
+    def get(self, entity, name):
+        """
+        Returns the value of a component of an entity, as a view of its row
+        """
+        archetype, row = self._locations[entity]
+        return archetype.columns[name][row]
+
+    def set(self, entity, name, value):
+        """Sets the value of a component of an entity"""
+        archetype, row = self._locations[entity]
+        archetype.columns[name][row] = value
+
+    def addcomponents(self, entity, **components):
+        """
+        Adds components to an entity, or sets them if it already has them.
+        Adding new components moves the entity to another archetype
+        """
+        archetype, row = self._locations[entity]
+        if archetype.names.issuperset(components):
+            for name, value in components.iteritems():
+                archetype.columns[name][row] = value
+            return
+        values = archetype._row(row)
+        values.update(components)
+        self.destroy(entity)
+        self._place(entity, values)
+
+    def removecomponents(self, entity, *names):
+        """Removes components from an entity"""
+        archetype, row = self._locations[entity]
+        values = archetype._row(row)
+        for name in names:
+            values.pop(name, None)
+        self.destroy(entity)
+        self._place(entity, values)
+
+    def archetype(self, names):
+        """
+        Returns the archetype of the entities with the components *names*
+        """
+        key = frozenset(names)
+        try:
+            return self._archetypes[key]
+        except KeyError:
+            for name in key:
+                if name not in self.types:
+                    raise ValueError("Undefined component type: %s" % name)
+            archetype = self._archetypes[key] = Archetype(key, self.types)
+            return archetype
+
+    def query(self, *names):
+        """
+        Returns the non-empty archetypes whose entities have all the
+        components *names*
+        """
+        names = frozenset(names)
+        return [archetype for archetype in self._archetypes.itervalues()
+                if archetype.count and names <= archetype.names]
+
+    def run(self, system, *names):
+        """
+        Calls *system* once for each archetype with the components *names*,
+        passing it the views of their columns, in that order. The system
+        updates them in place, with vectorized operations
+        """
+        for archetype in self.query(*names):
+            system(*[archetype.column(name) for name in names])
+        self.version += 1
+
+    def locate(self, entity):
+        """Returns the archetype and the row of an entity"""
+        return self._locations[entity]
+
+    def pack(self, *names):
+        """
+        Returns the per-instance data of the entities with a position and
+        the components *names*, with the layout of ``InstancedRenderer.pack``.
+        The rotation, scale and color of the entities without them are the
+        defaults
+        """
+        blocks = [_pack(archetype)
+                  for archetype in self.query('position', *names)]
+        if not blocks:
+            return numpy.zeros((0, 20), dtype=numpy.float32)
+        return numpy.concatenate(blocks)
+
+    def render(self, geometry, *names):
+        """
+        Draws *geometry* once for each entity with a position and the
+        components *names*, with a single instanced call
+        """
+        InstancedRenderer.drawinstances(geometry, self.pack(*names))
+
+    def _place(self, entity, values):
+        archetype = self.archetype(values)
+        self._locations[entity] = (archetype, archetype._append(entity, values))
+
+
+def _pack(archetype):
+    """
+    Vectorized version of ``Transform._modelmatrix`` for the rows of an
+    archetype, followed by their colors
+    """
+    n = archetype.count
+    names = archetype.names
+    a, b, c = archetype.column('position').T
+    if 'rotation' in names:
+        w, x, y, z = archetype.column('rotation').T
+    else:
+        w, x, y, z = numpy.ones(n), numpy.zeros(n), numpy.zeros(n), \
+            numpy.zeros(n)
+    if 'scale' in names:
+        sx, sy, sz = archetype.column('scale').T
+    else:
+        sx = sy = sz = numpy.ones(n)
+    data = numpy.zeros((n, 20), dtype=numpy.float32)
+    data[:, 0] = (1 - 2 * (y * y + z * z)) * sx
+    data[:, 1] = 2 * (x * y - w * z) * sx
+    data[:, 2] = 2 * (x * z + w * y) * sx
+    data[:, 4] = 2 * (x * y + w * z) * sy
+    data[:, 5] = (1 - 2 * (x * x + z * z)) * sy
+    data[:, 6] = 2 * (y * z - w * x) * sy
+    data[:, 8] = 2 * (x * z - w * y) * sz
+    data[:, 9] = 2 * (y * z + w * x) * sz
+    data[:, 10] = (1 - 2 * (x * x + y * y)) * sz
+    data[:, 12] = a
+    data[:, 13] = b
+    data[:, 14] = -c
+    data[:, 15] = 1
+    if 'color' in names:
+        data[:, 16:] = archetype.column('color')
+    else:
+        data[:, 16:] = 1
+    return data
@@ -1,5 +1,7 @@
 import math
 
+import numpy
+
 
 class MetaVector3D(type):
     @property
@@ -33,10 +35,14 @@ class Vector3D(tuple):
         return self[2]
     
     def __add__(self, other):
+        if isinstance(other, Vector3Array):
+            return NotImplemented
         return Vector3D(*[a+b for a,b in zip(self, other)])
     
     
     def __sub__(self, other):
+        if isinstance(other, Vector3Array):
+            return NotImplemented
         return Vector3D(*[a-b for a,b in zip(self, other)])
     
     def __mul__(self, factor):
@@ -84,6 +90,8 @@ class Quaternion(tuple):
         return "Quaternion(%s, %s, %s, %s)" % (self.w, self.x, self.y, self.z)
 
     def __mul__(self, rq):
+        if isinstance(rq, QuaternionArray):
+            return NotImplemented
         w, x, y, z = self
         rw, rx, ry, rz = rq
         return Quaternion(w*rw - x*rx - y*ry - z*rz,
@@ -99,6 +107,31 @@ class Quaternion(tuple):
         resquat = self * resquat
         return Vector3D(resquat.x, resquat.y, resquat.z)
 
+    def rotate_point(self, v):
+        """
+        Returns *v* rotated by the quaternion. Unlike rotate_vector, *v* is not
+        normalized, so it can be used to rotate positions and offsets
+        """
+        w, x, y, z = self
+        vx, vy, vz = v
+        tx = 2 * (y*vz - z*vy)
+        ty = 2 * (z*vx - x*vz)
+        tz = 2 * (x*vy - y*vx)
+        return Vector3D(vx + w*tx + y*tz - z*ty,
+                        vy + w*ty + z*tx - x*tz,
+                        vz + w*tz + x*ty - y*tx)
+
+    def nlerp(self, other, t):
+        """
+        Returns the normalized linear interpolation between the quaternion
+        and *other*, along the shortest arc. *t* goes from 0 to 1
+        """
+        if sum(a*b for a, b in zip(self, other)) < 0:
+            other = Quaternion(*[-n for n in other])
+        q = [a + (b - a) * t for a, b in zip(self, other)]
+        length = math.sqrt(sum(n*n for n in q))
+        return Quaternion(*[n / length for n in q])
+
     @staticmethod
     def from_axis(axis, angle):
         """
@@ -111,3 +144,245 @@ class Quaternion(tuple):
         cos = math.cos(angle)
         return Quaternion(cos, axis[0] * sin, axis[1] * sin, axis[2] * sin)
 
+
+
+class Vector3Array(object):
+    """
+    Batch of 3-dimensional vectors stored in a contiguous (N, 3) array of
+    float64, so that the same operation can be applied to all of them at once
+    """
+
+    def __init__(self, data):
+        """
+        *data* is any sequence that can be converted into a (N, 3) array, such
+        as a list of Vector3D or another array
+        """
+        data = numpy.array(data, dtype=numpy.float64)
+        self.data = numpy.ascontiguousarray(data.reshape(-1, 3))
+
+    @classmethod
+    def zeros(cls, n):
+        """
+        Returns a batch of *n* null vectors
+        """
+        return cls(numpy.zeros((n, 3)))
+
+    @classmethod
+    def from_vectors(cls, vectors):
+        """
+        Returns a batch built from an iterable of Vector3D or 3-tuples
+        """
+        return cls(list(vectors))
+
+    @property
+    def x(self):
+        return self.data[:, 0]
+
+    @property
+    def y(self):
+        return self.data[:, 1]
+
+    @property
+    def z(self):
+        return self.data[:, 2]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, long, numpy.integer)):
+            return Vector3D(*self.data[index].tolist())
+        return Vector3Array(self.data[index])
+
+    def __setitem__(self, index, value):
+        self.data[index] = _asarray(value)
+
+    def __iter__(self):
+        for row in self.data.tolist():
+            yield Vector3D(*row)
+
+    def __eq__(self, other):
+        return numpy.array_equal(self.data, _asarray(other).reshape(-1, 3))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Vector3Array(%s)" % self.data.tolist()
+
+    def __add__(self, other):
+        return Vector3Array(self.data + _asarray(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Vector3Array(self.data - _asarray(other))
+
+    def __rsub__(self, other):
+        return Vector3Array(_asarray(other) - self.data)
+
+    def __mul__(self, factor):
+        """
+        Scales the vectors by *factor*, which is either a number or a
+        sequence of N numbers with one factor per vector
+        """
+        return Vector3Array(self.data * _asfactor(factor))
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Vector3Array(-self.data)
+
+    def __iadd__(self, other):
+        self.data += _asarray(other)
+        return self
+
+    def __isub__(self, other):
+        self.data -= _asarray(other)
+        return self
+
+    def __imul__(self, factor):
+        self.data *= _asfactor(factor)
+        return self
+
+
+class QuaternionArray(object):
+    """
+    Batch of rotations stored in a contiguous (N, 4) array of float64, with
+    the same (w, x, y, z) layout as Quaternion
+    """
+
+    def __init__(self, data):
+        """
+        *data* is any sequence that can be converted into a (N, 4) array, such
+        as a list of Quaternion or another array
+        """
+        data = numpy.array(data, dtype=numpy.float64)
+        self.data = numpy.ascontiguousarray(data.reshape(-1, 4))
+
+    @classmethod
+    def identity(cls, n):
+        """
+        Returns a batch of *n* identity quaternions
+        """
+        data = numpy.zeros((n, 4))
+        data[:, 0] = 1
+        return cls(data)
+
+    @classmethod
+    def from_quaternions(cls, quaternions):
+        """
+        Returns a batch built from an iterable of Quaternion or 4-tuples
+        """
+        return cls(list(quaternions))
+
+    @staticmethod
+    def from_axis(axes, angles):
+        """
+        Returns a batch of quaternions from the rotation of each axis by its
+        angle. *axes* is either one axis shared by the whole batch or N axes,
+        and *angles* is a number or a sequence of N numbers
+        """
+        axes = numpy.array(axes, dtype=numpy.float64).reshape(-1, 3)
+        angles = numpy.array(angles, dtype=numpy.float64).reshape(-1) * .5
+        axes = axes / axes.sum(axis=1)[:, numpy.newaxis]
+        n = max(len(axes), len(angles))
+        data = numpy.empty((n, 4))
+        data[:, 0] = numpy.cos(angles)
+        data[:, 1:] = axes * numpy.sin(angles)[:, numpy.newaxis]
+        return QuaternionArray(data)
+
+    @property
+    def w(self):
+        return self.data[:, 0]
+
+    @property
+    def x(self):
+        return self.data[:, 1]
+
+    @property
+    def y(self):
+        return self.data[:, 2]
+
+    @property
+    def z(self):
+        return self.data[:, 3]
+
+    @property
+    def conjugate(self):
+        data = self.data.copy()
+        data[:, 1:] *= -1
+        return QuaternionArray(data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, long, numpy.integer)):
+            return Quaternion(*self.data[index].tolist())
+        return QuaternionArray(self.data[index])
+
+    def __setitem__(self, index, value):
+        self.data[index] = _asarray(value)
+
+    def __iter__(self):
+        for row in self.data.tolist():
+            yield Quaternion(*row)
+
+    def __eq__(self, other):
+        return numpy.array_equal(self.data, _asarray(other).reshape(-1, 4))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "QuaternionArray(%s)" % self.data.tolist()
+
+    def __mul__(self, rq):
+        """
+        Hamilton product of each quaternion of the batch with *rq*, which is
+        either a single Quaternion or a batch of the same length
+        """
+        return QuaternionArray(_hamilton(self.data, _asarray(rq)))
+
+    def __rmul__(self, lq):
+        return QuaternionArray(_hamilton(_asarray(lq), self.data))
+
+    def rotate_vector(self, v):
+        """
+        Rotates *v* by each quaternion of the batch, with the same semantics
+        as Quaternion.rotate_vector. *v* is either a single vector or a batch
+        of the same length, and the result is a Vector3Array
+        """
+        v = _asarray(v).reshape(-1, 3)
+        vquat = numpy.zeros((len(v), 4))
+        vquat[:, 1:] = v / v.sum(axis=1)[:, numpy.newaxis]
+        resquat = _hamilton(vquat, self.conjugate.data)
+        resquat = _hamilton(self.data, resquat)
+        return Vector3Array(resquat[:, 1:])
+
+
+def _asarray(value):
+    if isinstance(value, (Vector3Array, QuaternionArray)):
+        return value.data
+    return numpy.asarray(value, dtype=numpy.float64)
+
+
+def _asfactor(factor):
+    factor = numpy.asarray(factor, dtype=numpy.float64)
+    if factor.ndim == 1:
+        return factor[:, numpy.newaxis]
+    return factor
+
+
+def _hamilton(lq, rq):
+    lq = lq.reshape(-1, 4)
+    rq = rq.reshape(-1, 4)
+    w, x, y, z = lq[:, 0], lq[:, 1], lq[:, 2], lq[:, 3]
+    rw, rx, ry, rz = rq[:, 0], rq[:, 1], rq[:, 2], rq[:, 3]
+    result = numpy.empty((max(len(lq), len(rq)), 4))
+    result[:, 0] = w*rw - x*rx - y*ry - z*rz
+    result[:, 1] = w*rx + x*rw + y*rz - z*ry
+    result[:, 2] = w*ry + y*rw + z*rx - x*rz
+    result[:, 3] = w*rz + z*rw + x*ry - y*rx
+    return result
@@ -26,7 +26,25 @@ class Input(object):
                 cls.keys[event.key] = False
             if event.type == pygame.KEYDOWN:
                 cls.keys[event.key] = True
-                
+
+    @classmethod
+    def simulate(cls, changes):
+        """
+        Updates the keys from a scripted source instead of the input events,
+        as headless games do
+
+        Parameters
+        ----------
+        changes : list
+            List of (key, pressed) pairs, where key is a Pygame key
+            constant, or the string 'quit' to set the quit flag
+        """
+        for key, pressed in changes:
+            if key == 'quit':
+                cls.quitflag = pressed
+            else:
+                cls.keys[key] = pressed
+
     @classmethod
     def getkey(cls, key):
         """
@@ -0,0 +1,413 @@
+import ctypes
+
+import numpy
+from OpenGL.GL import * # @UnusedWildImport
+from OpenGL.GL import shaders
+
+from openglrenderer import OpenGLRenderer
+
+
+# Attribute locations shared by Geometry and InstancedRenderer
+POSITION, NORMAL, TEXCOORD, MODEL, COLOR = 0, 1, 2, 3, 7
+
+_VERTEX_SHADER = """
+#version 120
+attribute vec3 position;
+attribute vec3 normal;
+attribute vec2 texcoord;
+attribute vec4 model0;
+attribute vec4 model1;
+attribute vec4 model2;
+attribute vec4 model3;
+attribute vec4 color;
+uniform vec4 materialcolor;
+uniform float lighting;
+uniform float lights[8];
+varying vec4 frontcolor;
+varying vec2 uv;
+
+void main() {
+    mat4 model = mat4(model0, model1, model2, model3);
+    vec4 eye = gl_ModelViewMatrix * model * vec4(position, 1.0);
+    // Inverse transpose of the rotation and scale part of the model matrix
+    vec3 scale2 = vec3(dot(model0.xyz, model0.xyz),
+                       dot(model1.xyz, model1.xyz),
+                       dot(model2.xyz, model2.xyz));
+    vec3 n = mat3(model0.xyz, model1.xyz, model2.xyz) * (normal / scale2);
+    n = normalize(gl_NormalMatrix * n);
+    vec4 base = color * materialcolor;
+    vec4 lit = gl_LightModel.ambient * base;
+    for (int i = 0; i < 8; i++) {
+        vec4 lp = gl_LightSource[i].position;
+        vec3 l = normalize(lp.xyz - eye.xyz * lp.w);
+        lit += lights[i] * (gl_LightSource[i].ambient * base +
+                            max(dot(n, l), 0.0) *
+                            gl_LightSource[i].diffuse * base);
+    }
+    frontcolor = mix(base, vec4(lit.rgb, base.a), lighting);
+    uv = texcoord;
+    gl_Position = gl_ProjectionMatrix * eye;
+}
+"""
+
+_FRAGMENT_SHADER = """
+#version 120
+uniform sampler2D diffusemap;
+uniform float usetexture;
+varying vec4 frontcolor;
+varying vec2 uv;
+
+void main() {
+    vec4 color = frontcolor;
+    if (usetexture > 0.5) {
+        color *= texture2D(diffusemap, uv);
+    }
+    gl_FragColor = color;
+}
+"""
+
+
+class Geometry(object):
+    """
+    Vertex and index data of a shape, shared by all the renderables that
+    display it. The buffers and the display list are created the first time
+    they are drawn, and deleted when the last renderable releases the
+    geometry
+    """
+
+    _cache = {}
+    # Bytes of the vertex and index buffers and display lists in video memory
+    _memory = 0
+
+    def __init__(self, vertices, indices, parts=None):
+        """
+        Parameters
+        ----------
+        vertices : numpy.ndarray
+            (N, 8) float32 array of positions, normals and texture coordinates
+        indices : numpy.ndarray
+            Flat uint32 array of triangle indices
+        parts : list
+            List of (first, count, color, texture) tuples, one for each range
+            of indices drawn with a different material. *color* is an RGBA
+            tuple and *texture* a shared Texture handle, and both can be None
+        """
+        self.vertices = numpy.ascontiguousarray(vertices, dtype=numpy.float32)
+        self.indices = numpy.ascontiguousarray(indices, dtype=numpy.uint32)
+        if parts is None:
+            parts = [(0, len(self.indices), None, None)]
+        self.parts = parts
+        # Whether any part sets its own texture or color when it is drawn
+        self.textured = any(part[3] is not None for part in parts)
+        self.colored = any(part[2] is not None for part in parts)
+        # Bounding box and sphere of the positions, in model space
+        positions = self.vertices[:, :3]
+        if len(positions):
+            self.lower = positions.min(axis=0)
+            self.upper = positions.max(axis=0)
+        else:
+            self.lower = self.upper = numpy.zeros(3, dtype=numpy.float32)
+        self.center = (self.lower + self.upper) / 2
+        self.radius = float(numpy.sqrt(((positions - self.center) ** 2)
+                                       .sum(axis=1).max())) \
+            if len(positions) else 0.
+        self.key = None
+        self.refcount = 0
+        self._vbo = None
+        self._ibo = None
+        self._list = None
+
+    @property
+    def nbytes(self):
+        """Size in bytes of the vertex and index data"""
+        return self.vertices.nbytes + self.indices.nbytes
+
+    @classmethod
+    def get(cls, key, factory):
+        """
+        Returns the geometry stored under *key*, calling *factory* to create
+        it the first time. The key is made of the type of primitive and its
+        parameters, such as ``('sphere', slices, stacks)``
+        """
+        try:
+            return cls._cache[key]
+        except KeyError:
+            geometry = cls._cache[key] = factory()
+            geometry.key = key
+            return geometry
+
+    @classmethod
+    def memory(cls):
+        """
+        Returns the bytes of video memory taken by the geometries. A display
+        list is counted as a copy of the vertex and index data
+        """
+        return cls._memory
+
+    @classmethod
+    def stats(cls):
+        """
+        Returns a dict with the number of cached geometries, the number of
+        them with buffers and display lists, and their total size in bytes
+        """
+        geometries = cls._cache.values()
+        return {'cached': len(geometries),
+                'buffers': sum(g._vbo is not None for g in geometries),
+                'lists': sum(g._list is not None for g in geometries),
+                'memory': cls._memory}
+
+    def acquire(self):
+        """Adds a user of the geometry"""
+        self.refcount += 1
+        return self
+
+    def release(self):
+        """
+        Removes a user of the geometry. When it has no users left, it is
+        removed from the cache and its buffers and display list are deleted
+        """
+        if self.refcount == 0:
+            raise ValueError("Geometry released more times than acquired: %s"
+                             % (self.key,))
+        self.refcount -= 1
+        if self.refcount == 0:
+            if self.key is not None and \
+                    Geometry._cache.get(self.key) is self:
+                del Geometry._cache[self.key]
+            self.free()
+
+    def free(self):
+        """Deletes the buffers and the display list of the geometry"""
+        if self._vbo is not None:
+            glDeleteBuffers(2, [self._vbo, self._ibo])
+            self._vbo = self._ibo = None
+            Geometry._memory -= self.nbytes
+        if self._list is not None:
+            glDeleteLists(self._list, 1)
+            self._list = None
+            Geometry._memory -= self.nbytes
+
+    def upload(self):
+        """
+        Uploads the vertex and index buffers, if they are not uploaded yet
+        """
+        if self._vbo is None:
+            self._vbo, self._ibo = glGenBuffers(2)
+            glBindBuffer(GL_ARRAY_BUFFER, self._vbo)
+            glBufferData(GL_ARRAY_BUFFER, self.vertices, GL_STATIC_DRAW)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._ibo)
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.indices, GL_STATIC_DRAW)
+            Geometry._memory += self.nbytes
+
+    def bind(self):
+        """
+        Binds the vertex and index buffers and enables the vertex attributes
+        """
+        self.upload()
+        glBindBuffer(GL_ARRAY_BUFFER, self._vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._ibo)
+        for location, size, offset in ((POSITION, 3, 0), (NORMAL, 3, 12),
+                                        (TEXCOORD, 2, 24)):
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, 32,
+                                  ctypes.c_void_p(offset))
+
+    def unbind(self):
+        for location in (POSITION, NORMAL, TEXCOORD):
+            glDisableVertexAttribArray(location)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def displaylist(self):
+        """
+        Returns the display list of the geometry, shared by all its users,
+        compiling it the first time
+        """
+        if self._list is None:
+            self._list = self.compile()
+            Geometry._memory += self.nbytes
+        return self._list
+
+    def compile(self):
+        """
+        Compiles the geometry into a new display list for the fixed-function
+        path and returns its id
+        """
+        gl_list = glGenLists(1)
+        glNewList(gl_list, GL_COMPILE)
+        # The arrays are dereferenced while compiling, so raw pointers into
+        # the interleaved vertices are safe here
+        self._drawparts(self.vertices.ctypes.data, self.indices.ctypes.data)
+        glEndList()
+        return gl_list
+
+    def draw(self):
+        """
+        Draws the geometry with the fixed-function pipeline straight from its
+        vertex buffers
+        """
+        self.upload()
+        glBindBuffer(GL_ARRAY_BUFFER, self._vbo)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._ibo)
+        self._drawparts(0, 0, True)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def _drawparts(self, vertices, indices, immediate=False):
+        """
+        Draws every part with client-side arrays. *vertices* and *indices*
+        are addresses in client memory, or offsets in the bound buffers.
+        When the parts are drawn *immediate*ly rather than compiled, the
+        textures are bound through OpenGLRenderer, which skips the binds of
+        the texture that is bound already, and left bound
+        """
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 32, ctypes.c_void_p(vertices))
+        glNormalPointer(GL_FLOAT, 32, ctypes.c_void_p(vertices + 12))
+        glTexCoordPointer(2, GL_FLOAT, 32, ctypes.c_void_p(vertices + 24))
+        for first, count, color, texture in self.parts:
+            if texture is not None:
+                if immediate:
+                    OpenGLRenderer.bindtexture(texture.id)
+                else:
+                    glBindTexture(GL_TEXTURE_2D, texture.id)
+            else:
+                if immediate:
+                    OpenGLRenderer.bindtexture(0)
+                if color is not None:
+                    glColor(*color)
+            glDrawElements(GL_TRIANGLES, count, GL_UNSIGNED_INT,
+                           ctypes.c_void_p(indices + 4 * first))
+            if texture is not None and not immediate:
+                glBindTexture(GL_TEXTURE_2D, 0)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+
+class InstancedRenderer(object):
+    """
+    Draws all the renderables that share a geometry with a single instanced
+    draw call per geometry part. The model matrix and color of each renderable
+    are packed into one per-instance buffer
+    """
+
+    _program = None
+    _buffer = None
+    _uniforms = {}
+
+    @classmethod
+    def issupported(cls):
+        """
+        Returns whether the current GL context supports instanced rendering
+        """
+        return bool(glDrawElementsInstanced) and \
+            bool(glVertexAttribDivisor) and bool(glCreateProgram)
+
+    @classmethod
+    def _init(cls):
+        program = glCreateProgram()
+        glAttachShader(program, shaders.compileShader(_VERTEX_SHADER,
+                                                      GL_VERTEX_SHADER))
+        glAttachShader(program, shaders.compileShader(_FRAGMENT_SHADER,
+                                                      GL_FRAGMENT_SHADER))
+        for name, location in (('position', POSITION), ('normal', NORMAL),
+                               ('texcoord', TEXCOORD), ('color', COLOR)):
+            glBindAttribLocation(program, location, name)
+        for i in xrange(4):
+            glBindAttribLocation(program, MODEL + i, 'model%d' % i)
+        glLinkProgram(program)
+        if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+            raise RuntimeError(glGetProgramInfoLog(program))
+        cls._program = program
+        cls._buffer = glGenBuffers(1)
+        for name in ('materialcolor', 'lighting', 'lights', 'diffusemap',
+                     'usetexture'):
+            cls._uniforms[name] = glGetUniformLocation(program, name)
+
+    @classmethod
+    def pack(cls, renderables):
+        """
+        Returns a (N, 20) float32 array with the column-major model matrix and
+        the RGBA color of each renderable
+        """
+        data = numpy.empty((len(renderables), 20), dtype=numpy.float32)
+        data[:, :16] = [r.transform.rendermatrix for r in renderables]
+        data[:, 16:] = [_WHITE if r.color is None else tuple(r.color)
+                        for r in renderables]
+        return data
+
+    @classmethod
+    def render(cls, renderables):
+        """
+        Renders *renderables*, grouped by geometry
+        """
+        batches = {}
+        for renderable in renderables:
+            geometry = renderable.geometry
+            try:
+                batches[geometry].append(renderable)
+            except KeyError:
+                batches[geometry] = [renderable]
+        if not batches:
+            return
+        cls._begin()
+        for geometry, batch in batches.iteritems():
+            cls._draw(geometry, cls.pack(batch))
+        glUseProgram(0)
+
+    @classmethod
+    def drawinstances(cls, geometry, data):
+        """
+        Draws *geometry* once for each row of *data*, a (N, 20) float32 array
+        with the same layout as the one returned by pack
+        """
+        if len(data) == 0:
+            return
+        cls._begin()
+        cls._draw(geometry, data)
+        glUseProgram(0)
+
+    @classmethod
+    def _begin(cls):
+        if cls._program is None:
+            cls._init()
+        # The parts unbind their textures, so that nothing is left bound
+        OpenGLRenderer.bindtexture(0)
+        glUseProgram(cls._program)
+        uniforms = cls._uniforms
+        glUniform1f(uniforms['lighting'], float(glIsEnabled(GL_LIGHTING)))
+        glUniform1fv(uniforms['lights'], 8, OpenGLRenderer.getlightmask())
+        glUniform1i(uniforms['diffusemap'], 0)
+
+    @classmethod
+    def _draw(cls, geometry, data):
+        uniforms = cls._uniforms
+        geometry.bind()
+        glBindBuffer(GL_ARRAY_BUFFER, cls._buffer)
+        glBufferData(GL_ARRAY_BUFFER, data, GL_STREAM_DRAW)
+        # Four columns of the model matrix followed by the color
+        for i in xrange(5):
+            glEnableVertexAttribArray(MODEL + i)
+            glVertexAttribPointer(MODEL + i, 4, GL_FLOAT, GL_FALSE, 80,
+                                  ctypes.c_void_p(16 * i))
+            glVertexAttribDivisor(MODEL + i, 1)
+        for first, count, color, texture in geometry.parts:
+            glUniform4f(uniforms['materialcolor'],
+                        *(_WHITE if color is None else color))
+            glUniform1f(uniforms['usetexture'], float(texture is not None))
+            if texture is not None:
+                glBindTexture(GL_TEXTURE_2D, texture.id)
+            glDrawElementsInstanced(GL_TRIANGLES, count, GL_UNSIGNED_INT,
+                                    ctypes.c_void_p(4 * first), len(data))
+            if texture is not None:
+                glBindTexture(GL_TEXTURE_2D, 0)
+        for i in xrange(5):
+            glVertexAttribDivisor(MODEL + i, 0)
+            glDisableVertexAttribArray(MODEL + i)
+        geometry.unbind()
+
+
+_WHITE = (1., 1., 1., 1.)
@@ -0,0 +1,197 @@
+"""
+Background loading of assets.
+
+The slow part of loading an asset (reading the file, decoding an image or
+parsing a mesh) runs on a pool of worker threads, while the OpenGL uploads,
+which must happen on the thread that owns the context, are queued and run on
+the main thread by ``AssetLoader.update``. The game loop calls it once per
+frame, and it stops running uploads when the per-frame time budget is spent,
+so spawning content mid-game does not stall a frame.
+"""
+
+import collections
+import Queue
+import sys
+import threading
+import time
+
+
+class Future(object):
+    """
+    Result of an asset loaded in the background. Its callbacks run on the
+    main thread once the asset is ready to use
+    """
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    @classmethod
+    def fromresult(cls, result):
+        """Returns a future that has already finished with *result*"""
+        future = cls()
+        future._setresult(result)
+        return future
+
+    def done(self):
+        """Returns whether the asset has finished loading"""
+        return self._done
+
+    def result(self):
+        """
+        Returns the loaded asset. It raises the loading error if it failed, or
+        a ``RuntimeError`` if it has not finished yet
+        """
+        if not self._done:
+            raise RuntimeError("The asset has not finished loading")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        """Returns the loading error, or None if it has not failed"""
+        return self._exception
+
+    def adddonecallback(self, callback):
+        """
+        Adds a function called with the future when the asset has finished
+        loading. If it already has, the function is called immediately
+        """
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _setresult(self, result):
+        self._result = result
+        self._finish()
+
+    def _setexception(self, exception):
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class AssetLoader(object):
+    """
+    Class used as a facade to load assets in the background
+    """
+
+    # Number of worker threads, started with the first request
+    workers = 2
+    # Seconds per frame that update may spend uploading assets
+    budget = .004
+
+    _requests = Queue.Queue()
+    _loaded = Queue.Queue()
+    _uploads = collections.deque()
+    _pending = {}
+    _count = 0
+    _threads = []
+
+    @classmethod
+    def submit(cls, load, upload=None, key=None):
+        """
+        Loads an asset in the background and returns its Future
+
+        Parameters
+        ----------
+        load : callable
+            Function without arguments run on a worker thread. It must not
+            call OpenGL
+        upload : callable
+            Function called on the main thread with the result of *load*. Its
+            return value is the result of the future
+        key : hashable
+            Identifies the asset, so that a request for an asset that is still
+            loading returns the same future
+        """
+        if key is not None and key in cls._pending:
+            return cls._pending[key]
+        future = Future()
+        if key is not None:
+            cls._pending[key] = future
+        cls._count += 1
+        cls._start()
+        cls._requests.put((load, upload, key, future))
+        return future
+
+    @classmethod
+    def update(cls, budget=None):
+        """
+        Runs the uploads of the assets loaded since the last call and their
+        callbacks, until *budget* seconds (by default, the class budget) have
+        passed. At least one upload runs on each call, so loading always
+        makes progress
+        """
+        if budget is None:
+            budget = cls.budget
+        cls._collect()
+        deadline = time.time() + budget
+        while cls._uploads:
+            cls._upload(*cls._uploads.popleft())
+            if time.time() >= deadline:
+                break
+
+    @classmethod
+    def waitall(cls):
+        """
+        Blocks until every requested asset has been loaded and uploaded, for
+        example behind a loading screen
+        """
+        while cls._count:
+            if not cls._uploads:
+                cls._uploads.append(cls._loaded.get())
+            cls.update(float('inf'))
+
+    @classmethod
+    def pending(cls):
+        """Returns the number of assets that have not finished loading"""
+        return cls._count
+
+    @classmethod
+    def _start(cls):
+        while len(cls._threads) < cls.workers:
+            thread = threading.Thread(target=cls._work)
+            thread.daemon = True
+            thread.start()
+            cls._threads.append(thread)
+
+    @classmethod
+    def _work(cls):
+        while True:
+            load, upload, key, future = cls._requests.get()
+            try:
+                cls._loaded.put((upload, load(), None, key, future))
+            except Exception:
+                cls._loaded.put((upload, None, sys.exc_info()[1], key, future))
+
+    @classmethod
+    def _collect(cls):
+        while True:
+            try:
+                cls._uploads.append(cls._loaded.get_nowait())
+            except Queue.Empty:
+                return
+
+    @classmethod
+    def _upload(cls, upload, result, exception, key, future):
+        if exception is None and upload is not None:
+            try:
+                result = upload(result)
+            except Exception as e:
+                exception = e
+        if key is not None:
+            cls._pending.pop(key, None)
+        cls._count -= 1
+        if exception is None:
+            future._setresult(result)
+        else:
+            future._setexception(exception)
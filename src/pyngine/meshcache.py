@@ -0,0 +1,214 @@
+"""
+On-disk cache of compiled meshes.
+
+The first time an OBJ file is loaded, its vertices, indices and materials are
+written to a binary file in the cache folder. Later loads map that file into
+memory, so the vertex and index arrays are views over the mapped pages that go
+straight to the GPU upload, without any parsing.
+
+A compiled mesh file contains:
+
+* A header with the magic string, the number of vertices and indices and the
+  length of the metadata block
+* The metadata block, a JSON object with the source file stamp, the stamps of
+  its MTL files, the material ranges and the materials
+* The (N, 8) float32 vertex block and the uint32 index block, each aligned to
+  16 bytes
+
+The cache entry of a source file is invalidated when the path, modification
+time or size of the OBJ file or of any of its MTL files changes.
+
+Whole asset folders can be compiled ahead of time with the
+``pyngine-compile-meshes`` command.
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import numpy
+
+import objloader
+
+
+# Version 2 stores absolute texture paths; version 1 entries stored them
+# relative to the working directory of the compilation
+MAGIC = 'PYNGMSH2'
+HEADER = struct.Struct('<8sQQQ')
+ALIGNMENT = 16
+
+# Folder where the compiled meshes are stored. Set it to None to disable the
+# cache
+folder = os.path.join(os.path.expanduser('~'), '.pyngine', 'meshcache')
+
+
+def load(filename):
+    """
+    Returns the same tuple as objloader.loadobj, from the cache if it has a
+    valid entry for *filename* or by compiling the OBJ file otherwise. If the
+    cache entry cannot be written, the parsed mesh is still returned
+    """
+    if folder is None:
+        return objloader.loadobj(filename)
+    path = cachepath(filename)
+    try:
+        return read(path, filename)
+    except (IOError, OSError, ValueError):
+        pass
+    vertices, indices, parts, materials, libraries = \
+        objloader._loadobj(filename)
+    try:
+        write(path, filename, vertices, indices, parts, materials, libraries)
+    except (IOError, OSError):
+        pass
+    return vertices, indices, parts, materials
+
+
+def compilemesh(filename, force=False):
+    """
+    Compiles *filename* into the cache and returns the loaded mesh, with a
+    flag indicating whether it was compiled (False if the cache entry was
+    already valid and *force* is not set). It raises an ``IOError`` or
+    ``OSError`` if the cache entry cannot be written
+    """
+    path = cachepath(filename)
+    if not force:
+        try:
+            return read(path, filename) + (False,)
+        except (IOError, OSError, ValueError):
+            pass
+    vertices, indices, parts, materials, libraries = \
+        objloader._loadobj(filename)
+    write(path, filename, vertices, indices, parts, materials, libraries)
+    return vertices, indices, parts, materials, True
+
+
+def cachepath(filename):
+    """
+    Returns the path of the cache entry for the OBJ file *filename*
+    """
+    key = hashlib.sha1(os.path.abspath(filename)).hexdigest()
+    return os.path.join(folder, key + '.mesh')
+
+
+def write(path, filename, vertices, indices, parts, materials, libraries):
+    """
+    Writes a compiled mesh file to *path*. The file is replaced atomically,
+    so a concurrent reader never sees a partial entry
+    """
+    metadata = json.dumps({
+        'source': _stamp(filename),
+        'libraries': [_stamp(library) for library in libraries],
+        'parts': parts,
+        'materials': materials,
+    })
+    metadata += ' ' * (_align(HEADER.size + len(metadata)) -
+                       HEADER.size - len(metadata))
+    vertices = numpy.ascontiguousarray(vertices, dtype=numpy.float32)
+    indices = numpy.ascontiguousarray(indices, dtype=numpy.uint32)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    handle, temppath = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(vertices), len(indices),
+                                len(metadata)))
+            f.write(metadata)
+            f.write(vertices.tostring())
+            f.write('\0' * (_align(vertices.nbytes) - vertices.nbytes))
+            f.write(indices.tostring())
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temppath, path)
+    except:
+        os.remove(temppath)
+        raise
+
+
+def read(path, filename=None):
+    """
+    Maps a compiled mesh file into memory and returns the same tuple as
+    objloader.loadobj. The arrays are read-only views of the mapped file.
+    It raises a ``ValueError`` if the file is not a compiled mesh or if it
+    is out of date with respect to *filename*
+    """
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated compiled mesh: %s" % path)
+    magic, nvertices, nindices, length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a compiled mesh: %s" % path)
+    metadata = json.loads(data[HEADER.size:HEADER.size + length])
+    if filename is not None:
+        stamps = [metadata['source']] + metadata['libraries']
+        for stamp in stamps:
+            if _stamp(stamp[0]) != stamp:
+                raise ValueError("Compiled mesh is out of date: %s" % path)
+    offset = HEADER.size + length
+    vertices = numpy.frombuffer(data, numpy.float32, nvertices * 8, offset)
+    offset += _align(vertices.nbytes)
+    indices = numpy.frombuffer(data, numpy.uint32, nindices, offset)
+    parts = [(first, count, material)
+             for first, count, material in metadata['parts']]
+    materials = {}
+    for name, mtl in metadata['materials'].iteritems():
+        materials[name] = dict((key, tuple(value) if isinstance(value, list)
+                                else value) for key, value in mtl.iteritems())
+    return vertices.reshape(-1, 8), indices, parts, materials
+
+
+def main(args=None):
+    """
+    Entry point of the ``pyngine-compile-meshes`` command, which compiles all
+    the OBJ files found in the given folders into the mesh cache
+    """
+    global folder
+    parser = argparse.ArgumentParser(
+        description="Precompile the OBJ files of asset folders into the "
+                    "PyNgine mesh cache")
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help="OBJ file or folder searched recursively")
+    parser.add_argument('--cache', default=folder,
+                        help="cache folder (default: %(default)s)")
+    parser.add_argument('--force', action='store_true',
+                        help="recompile meshes with a valid cache entry")
+    options = parser.parse_args(args)
+    folder = options.cache
+    status = 0
+    for filename in _findobjs(options.paths):
+        try:
+            compiled = compilemesh(filename, options.force)[-1]
+        except (IOError, OSError, ValueError) as e:
+            sys.stderr.write("error: %s: %s\n" % (filename, e))
+            status = 1
+            continue
+        print("%s %s" % ('compiled' if compiled else 'up to date', filename))
+    return status
+
+
+def _findobjs(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if name.lower().endswith('.obj'):
+                    yield os.path.join(root, name)
+
+
+def _stamp(filename):
+    filename = os.path.abspath(filename)
+    info = os.stat(filename)
+    return [filename, info.st_mtime, info.st_size]
+
+
+def _align(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -0,0 +1,274 @@
+"""
+Streaming loader for Wavefront OBJ and MTL files.
+
+The OBJ file is read in chunks of lines whose numbers are parsed in bulk with
+NumPy, so loading time and memory grow linearly with the size of the asset.
+Polygons are triangulated as fans, and the separate position, texture and
+normal indices of the faces are merged into a single index buffer over
+interleaved vertices.
+"""
+
+import os
+
+import numpy
+
+
+# Approximate number of bytes parsed at once
+CHUNK_SIZE = 1 << 21
+
+
+def loadobj(filename):
+    """
+    Loads an OBJ file and returns a tuple with:
+
+    * A (N, 8) float32 array of interleaved vertices: position, normal and
+      texture coordinates. Missing normals are smoothed from the faces
+    * A flat uint32 array of triangle indices
+    * A list of (first, count, material) tuples with the range of indices of
+      each material. *material* is None for faces without ``usemtl``
+    * A dict with the materials of the ``mtllib`` files, see loadmtl
+    """
+    return _loadobj(filename)[:4]
+
+
+def _loadobj(filename):
+    """
+    Same as loadobj, with the absolute paths of the MTL files appended to the
+    result
+    """
+    folder = os.path.dirname(os.path.abspath(filename))
+    reader = _ObjReader()
+    materials = {}
+    libraries = []
+    with open(filename, 'r') as objfile:
+        while True:
+            lines = objfile.readlines(CHUNK_SIZE)
+            if not lines:
+                break
+            for name in reader.read(lines):
+                path = os.path.join(folder, name)
+                materials.update(loadmtl(path))
+                libraries.append(path)
+    return reader.build() + (materials, libraries)
+
+
+def loadmtl(filename):
+    """
+    Loads a MTL file and returns a dict from material name to a dict of its
+    statements. Numeric statements such as ``Kd`` are stored as tuples of
+    floats, and texture maps as absolute paths, so that they do not depend on
+    the working directory
+    """
+    folder = os.path.dirname(os.path.abspath(filename))
+    contents = {}
+    mtl = None
+    for line in open(filename, 'r'):
+        values = line.split()
+        if not values or values[0].startswith('#'):
+            continue
+        elif values[0] == 'newmtl':
+            mtl = contents[values[1]] = {}
+        elif mtl is None:
+            raise ValueError("MTL file does not start with newmtl stmt")
+        elif values[0].startswith('map_'):
+            mtl[values[0]] = os.path.join(folder, values[-1])
+        else:
+            try:
+                mtl[values[0]] = tuple(map(float, values[1:]))
+            except ValueError:
+                mtl[values[0]] = ' '.join(values[1:])
+    return contents
+
+
+class _ObjReader(object):
+    """
+    Accumulates the parsed chunks of an OBJ file
+    """
+
+    def __init__(self):
+        self.positions = []
+        self.normals = []
+        self.texcoords = []
+        self.counts = [0, 0, 0]
+        self.corners = []
+        self.sizes = []
+        self.offsets = []
+        self.material = None
+        self.materialids = {None: 0}
+        self.facematerials = []
+
+    def read(self, lines):
+        """
+        Parses a chunk of lines and returns the names of the referenced MTL
+        files
+        """
+        positions, normals, texcoords = [], [], []
+        tokens, sizes, offsets, facematerials = [], [], [], []
+        libraries = []
+        materialid = self.materialids[self.material]
+        for line in lines:
+            key = line[:2]
+            if key == 'v ':
+                positions.append(line[2:])
+            elif key == 'vn':
+                normals.append(line[3:])
+            elif key == 'vt':
+                texcoords.append(line[3:])
+            elif key == 'f ':
+                values = line.split()
+                if len(values) < 4:
+                    continue
+                tokens.extend(values[1:])
+                sizes.append(len(values) - 1)
+                offsets.append((self.counts[0] + len(positions),
+                                self.counts[1] + len(texcoords),
+                                self.counts[2] + len(normals)))
+                facematerials.append(materialid)
+            else:
+                values = line.split()
+                if not values:
+                    continue
+                elif values[0] in ('usemtl', 'usemat'):
+                    self.material = values[1]
+                    if self.material not in self.materialids:
+                        self.materialids[self.material] = \
+                            len(self.materialids)
+                    materialid = self.materialids[self.material]
+                elif values[0] == 'mtllib':
+                    libraries.extend(values[1:])
+        for lines, columns, store, i in ((positions, 3, self.positions, 0),
+                                         (texcoords, 2, self.texcoords, 1),
+                                         (normals, 3, self.normals, 2)):
+            if lines:
+                store.append(_parsefloats(lines, columns))
+                self.counts[i] += len(lines)
+        if tokens:
+            self.corners.append(_parseindices(tokens))
+            self.sizes.append(numpy.array(sizes, dtype=numpy.int64))
+            self.offsets.append(numpy.array(offsets, dtype=numpy.int64))
+            self.facematerials.append(numpy.array(facematerials,
+                                                  dtype=numpy.int64))
+        return libraries
+
+    def build(self):
+        """
+        Returns the vertices, indices and material ranges of the whole file
+        """
+        positions = _concatenate(self.positions, 3)
+        texcoords = _concatenate(self.texcoords, 2)
+        normals = _concatenate(self.normals, 3)
+        corners = _concatenate(self.corners, 3).astype(numpy.int64)
+        sizes = _concatenate(self.sizes, 0).astype(numpy.int64)
+        offsets = _concatenate(self.offsets, 3).astype(numpy.int64)
+        facematerials = _concatenate(self.facematerials, 0)
+        # Resolve relative (negative) indices against the counts at each face
+        offsets = numpy.repeat(offsets, sizes, axis=0)
+        corners = numpy.where(corners < 0, corners + offsets + 1, corners)
+        # Triangulate every polygon as a fan around its first corner
+        starts = numpy.cumsum(sizes) - sizes
+        triangles = sizes - 2
+        first = numpy.repeat(starts, triangles)
+        step = numpy.arange(triangles.sum()) - \
+            numpy.repeat(numpy.cumsum(triangles) - triangles, triangles)
+        triangles = numpy.column_stack((first, first + step + 1,
+                                        first + step + 2))
+        # Group the triangles by material, keeping the order within each one
+        trimaterials = numpy.repeat(facematerials, sizes - 2)
+        order = numpy.argsort(trimaterials, kind='mergesort')
+        triangles = triangles[order]
+        trimaterials = trimaterials[order]
+        # Merge the (position, texcoord, normal) triplets into vertices
+        firsts, inverse = _uniquerows(corners, self.counts)
+        unique = corners[firsts]
+        indices = inverse[triangles]
+        vertices = numpy.zeros((len(unique), 8), dtype=numpy.float32)
+        vertices[:, 0:3] = positions[unique[:, 0] - 1]
+        hasnormal = unique[:, 2] > 0
+        vertices[hasnormal, 3:6] = normals[unique[hasnormal, 2] - 1]
+        hastexcoord = unique[:, 1] > 0
+        vertices[hastexcoord, 6:8] = texcoords[unique[hastexcoord, 1] - 1]
+        if not hasnormal.all():
+            smooth = _smoothnormals(positions, corners[triangles])
+            missing = ~hasnormal
+            vertices[missing, 3:6] = smooth[unique[missing, 0] - 1]
+        names = dict((i, name) for name, i in self.materialids.iteritems())
+        ids, firsts, counts = numpy.unique(trimaterials, return_index=True,
+                                           return_counts=True)
+        parts = [(int(f) * 3, int(c) * 3, names[i])
+                 for i, f, c in zip(ids, firsts, counts)]
+        return vertices, indices.astype(numpy.uint32).ravel(), parts
+
+
+def _parsefloats(lines, columns):
+    """
+    Parses the first *columns* numbers of each line
+    """
+    values = numpy.fromstring(' '.join(lines), sep=' ')
+    if len(values) == len(lines) * columns:
+        return values.reshape(-1, columns)
+    # Some lines have extra values, such as vertex colors or weights
+    values = [line.split()[:columns] for line in lines]
+    values = [v + ['0'] * (columns - len(v)) for v in values]
+    return numpy.array(values, dtype=numpy.float64)
+
+
+def _parseindices(tokens):
+    """
+    Parses face corners such as ``1``, ``1/2``, ``1//3`` or ``1/2/3`` into
+    a (N, 3) array of (position, texcoord, normal) indices, 0 meaning missing
+    """
+    text = ' '.join(tokens).replace('//', '/0/')
+    columns = tokens[0].replace('//', '/0/').count('/') + 1
+    values = numpy.fromstring(text.replace('/', ' '), dtype=numpy.int64,
+                              sep=' ')
+    if len(values) == len(tokens) * columns:
+        values = values.reshape(-1, columns)
+    else:
+        # The corners mix several formats
+        values = [token.replace('//', '/0/').split('/') for token in tokens]
+        values = numpy.array([v + ['0'] * (3 - len(v)) for v in values],
+                             dtype=numpy.int64)
+    if columns < 3:
+        padding = numpy.zeros((len(values), 3 - values.shape[1]),
+                              dtype=numpy.int64)
+        values = numpy.hstack((values, padding))
+    return values
+
+
+def _uniquerows(corners, counts):
+    """
+    Returns the index of the first occurrence of each distinct corner and the
+    index of the distinct corner for every corner
+    """
+    v, t, n = [c + 1 for c in counts]
+    if v * t * n < 1 << 62:
+        # Pack the triplets into integers, which sort much faster than rows
+        keys = (corners[:, 0] * t + corners[:, 1]) * n + corners[:, 2]
+        _, firsts, inverse = numpy.unique(keys, return_index=True,
+                                          return_inverse=True)
+    else:
+        _, firsts, inverse = numpy.unique(corners, axis=0, return_index=True,
+                                          return_inverse=True)
+    return firsts, inverse
+
+
+def _concatenate(arrays, columns):
+    if arrays:
+        return numpy.concatenate(arrays)
+    if columns:
+        return numpy.zeros((0, columns))
+    return numpy.zeros(0, dtype=numpy.int64)
+
+
+def _smoothnormals(positions, triangles):
+    """
+    Returns the normal of each position averaged from the faces around it
+    """
+    ids = triangles[..., 0] - 1
+    p = positions[ids]
+    facenormals = numpy.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    normals = numpy.zeros_like(positions)
+    for i in xrange(3):
+        numpy.add.at(normals, ids[:, i], facenormals)
+    lengths = numpy.sqrt((normals ** 2).sum(axis=1))[:, numpy.newaxis]
+    return normals / numpy.where(lengths > 0, lengths, 1)
@@ -3,6 +3,9 @@ import pygame
 from OpenGL.GL import * # @UnusedWildImport
 from OpenGL.GLU import * # @UnusedWildImport
 
+import culling
+from textures import TextureManager
+
 
 
 class OpenGLRenderer(object):
@@ -14,8 +17,14 @@ class OpenGLRenderer(object):
     _viewangle = 45
     _closeview = 0.1
     _farview = 100.0
+    _aspect = 1.
     _clear_color = (.5, .5, .5, 1)
     _gl_lights = range(GL_LIGHT0, GL_LIGHT7 + 1)
+    _enabled_lights = set()
+    _egl = None
+    # Current color and bound texture, or None if they are unknown
+    _color = None
+    _texture = None
     
     @classmethod
     def init(cls, screen_size, fullscreen):
@@ -37,6 +46,45 @@ class OpenGLRenderer(object):
         cls.enable()
         cls.define_settings()
     
+    @classmethod
+    def initheadless(cls, screen_size):
+        """
+        Initializes an offscreen OpenGL context through EGL, which works
+        without a display server (for example, with Mesa's software
+        rasterizer). PyOpenGL must be loaded with PYOPENGL_PLATFORM=egl
+        
+        Parameters
+        ----------
+        screen_size : tuple
+            2-tuple indicating width and height of the offscreen surface
+        """
+        from OpenGL import EGL
+        import ctypes
+        display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        EGL.eglInitialize(display, None, None)
+        attributes = (EGL.EGLint * 13)(
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8,
+            EGL.EGL_BLUE_SIZE, 8, EGL.EGL_DEPTH_SIZE, 24,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_NONE)
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1,
+                            ctypes.pointer(count))
+        if count.value == 0:
+            raise RuntimeError("No EGL configuration supports OpenGL")
+        width, height = screen_size
+        surface = EGL.eglCreatePbufferSurface(display, config, (EGL.EGLint * 5)(
+            EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE))
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        context = EGL.eglCreateContext(display, config,
+                                       EGL.EGL_NO_CONTEXT, None)
+        EGL.eglMakeCurrent(display, surface, surface, context)
+        cls._egl = display
+        cls.resize(width, height)
+        cls.enable()
+        cls.define_settings()
+    
     @classmethod
     def resize(cls, width, height):
         """
@@ -47,14 +95,23 @@ class OpenGLRenderer(object):
         width : int
         height : int
         """
+        cls._aspect = float(width)/height
         glViewport(0, 0, width, height)
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
-        gluPerspective(cls._viewangle, float(width)/height,
+        gluPerspective(cls._viewangle, cls._aspect,
                        cls._closeview, cls._farview)
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
     
+    @classmethod
+    def projectionmatrix(cls):
+        """
+        Returns the 4x4 row-major projection matrix set up by resize
+        """
+        return culling.perspective(cls._viewangle, cls._aspect,
+                                   cls._closeview, cls._farview)
+    
     @classmethod
     def enable(cls):
         """Enables the GL capabilities needed
@@ -112,14 +169,48 @@ class OpenGLRenderer(object):
     @classmethod
     def clearscreen(cls):
         glClear(GL_DEPTH_BUFFER_BIT | GL_COLOR_BUFFER_BIT)
+        cls.resetstate()
+
+    @classmethod
+    def resetstate(cls):
+        """
+        Forgets the current color and texture, so that the next calls to
+        setcolor and bindtexture set them again
+        """
+        cls._color = None
+        cls._texture = None
+
+    @classmethod
+    def setcolor(cls, color):
+        """Sets the current color, unless it is set already"""
+        color = tuple(color)
+        if color != cls._color:
+            glColor(*color)
+            cls._color = color
+
+    @classmethod
+    def bindtexture(cls, texture_id):
+        """Binds a 2D texture, unless it is bound already"""
+        if texture_id != cls._texture:
+            glBindTexture(GL_TEXTURE_2D, texture_id)
+            cls._texture = texture_id
 
     @classmethod
     def flip(cls):
-        pygame.display.flip()
+        if cls._egl is not None:
+            glFinish()
+        else:
+            pygame.display.flip()
         
     @classmethod
     def quit(cls):
-        pygame.quit()
+        TextureManager.clear()
+        if cls._egl is not None:
+            from OpenGL import EGL
+            EGL.eglTerminate(cls._egl)
+            cls._egl = None
+        else:
+            pygame.quit()
     
     @classmethod
     def getnextlight(cls):
@@ -135,36 +226,42 @@ class OpenGLRenderer(object):
         glLightfv(gl_light, GL_SPOT_DIRECTION, spot_direction)
         glLightfv(gl_light, GL_POSITION, gl_position)
         glEnable(gl_light)
+        cls._enabled_lights.add(gl_light)
     
     @classmethod
     def disable(cls, foo):
         glDisable(foo)
+        cls._enabled_lights.discard(foo)
+    
+    @classmethod
+    def getlightmask(cls):
+        """
+        Returns a list with 1 for each enabled GL light and 0 for the others,
+        ordered from GL_LIGHT0 to GL_LIGHT7
+        """
+        return [float(GL_LIGHT0 + i in cls._enabled_lights) for i in xrange(8)]
     
     @classmethod
     def render(cls, renderable):
-        transform = renderable.transform
-        a, b, c = transform.position
-        w, x, y, z = transform.rotation
-        x2 = x * x
-        y2 = y * y
-        z2 = z * z
-        xy = x * y
-        xz = x * z
-        yz = y * z
-        wx = w * x
-        wy = w * y
-        wz = w * z
-        matrix = [1-2*(y2+z2), 2*(xy-wz), 2*(xz+wy), 0,
-                  2*(xy+wz), 1-2*(x2+z2), 2*(yz-wx), 0,
-                  2*(xz-wy), 2*(yz+wx), 1-2*(x2+y2), 0,
-                  a, b, -c, 1]
         glPushMatrix()
-        glMultMatrixf(matrix)
-        if transform.scale != (1, 1, 1):
-            glScalef(*transform.scale)
+        glMultMatrixf(renderable.transform.rendermatrix)
         if renderable.color is not None:
-            glColor(*renderable.color)
-        glCallList(renderable.gl_list)
+            cls.setcolor(renderable.color)
+        geometry = renderable.geometry
+        if geometry is None:
+            glCallList(renderable.gl_list)
+            cls.resetstate()
+        elif renderable.gl_list is not None:
+            if not geometry.textured:
+                cls.bindtexture(0)
+            glCallList(renderable.gl_list)
+            # Display lists unbind their textures after each part
+            if geometry.textured:
+                cls._texture = 0
+        else:
+            geometry.draw()
+        if geometry is not None and geometry.colored:
+            cls._color = None
         glPopMatrix()
     
     @classmethod
@@ -182,21 +279,19 @@ class OpenGLRenderer(object):
     
     @classmethod
     def load_texture(cls, filename):
-        texture_surface = pygame.image.load(filename)
-        width, height = texture_surface.get_rect().size
-        texture_data = pygame.image.tostring(texture_surface, 'RGB', True)
-        texture_id = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, texture_id)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
-        glTexImage2D(GL_TEXTURE_2D, 0, 3, width, height, 0,
-                     GL_RGB, GL_UNSIGNED_BYTE, texture_data)
-        return texture_id
+        """
+        Returns the id of the shared texture loaded from *filename*. Each call
+        must be matched by a call to delete_texture
+        """
+        return TextureManager.load(filename).id
     
     @classmethod
     def delete_texture(cls, texture_id):
-        glDeleteTextures(texture_id)
+        """
+        Releases a texture returned by load_texture. It stays cached until the
+        TextureManager budget is exceeded
+        """
+        TextureManager.byid(texture_id).release()
     
     @classmethod
     def do_2d_stuff(cls):
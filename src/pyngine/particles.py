@@ -0,0 +1,132 @@
+import ctypes
+
+import numpy
+from OpenGL.GL import * # @UnusedWildImport
+
+from instancing import InstancedRenderer
+
+
+class ParticleSystem(object):
+    """
+    Particles stored as a structure of preallocated arrays. The live
+    particles are kept packed at the start of the arrays: dead ones are
+    removed by moving the survivors down, so updating and drawing never touch
+    a dead particle and need no Python loop
+    """
+
+    def __init__(self, capacity=1024, decay=.01):
+        """
+        Parameters
+        ----------
+        capacity : int
+            Number of particles preallocated. The arrays double their size
+            when more particles are alive at once
+        decay : float
+            Life lost by each particle on every update. Particles are born
+            with a life of 1 and die when it reaches 0
+        """
+        self.position = numpy.zeros((capacity, 3), dtype=numpy.float32)
+        self.velocity = numpy.zeros((capacity, 3), dtype=numpy.float32)
+        self.color = numpy.zeros((capacity, 4), dtype=numpy.float32)
+        self.size = numpy.zeros(capacity, dtype=numpy.float32)
+        self.life = numpy.zeros(capacity, dtype=numpy.float32)
+        self.decay = decay
+        self.count = 0
+
+    @property
+    def capacity(self):
+        return len(self.life)
+
+    def __len__(self):
+        return self.count
+
+    def emit(self, position, velocity, color=(0, 0, 0, 1), size=.5, life=1.):
+        """
+        Spawns one particle for each row of *velocity*, a (N, 3) array. The
+        other arguments are either a value shared by all of them or an array
+        with one value for each particle
+        """
+        velocity = numpy.asarray(velocity, dtype=numpy.float32).reshape(-1, 3)
+        start, end = self.count, self.count + len(velocity)
+        if end > self.capacity:
+            self._grow(end)
+        color = numpy.asarray(color, dtype=numpy.float32)
+        if color.shape[-1] == 3:
+            color = numpy.concatenate(
+                (color, numpy.ones(color.shape[:-1] + (1,))), axis=-1)
+        self.position[start:end] = position
+        self.velocity[start:end] = velocity
+        self.color[start:end] = color
+        self.size[start:end] = size
+        self.life[start:end] = life
+        self.count = end
+
+    def update(self):
+        """
+        Moves the particles, ages them and removes the dead ones
+        """
+        n = self.count
+        self.position[:n] += self.velocity[:n]
+        self.life[:n] -= self.decay
+        alive = self.life[:n] > 0
+        if not alive.all():
+            self.count = int(alive.sum())
+            for array in (self.position, self.velocity, self.color,
+                          self.size, self.life):
+                array[:self.count] = array[:n][alive]
+
+    def clear(self):
+        """Removes all the particles"""
+        self.count = 0
+
+    def pack(self):
+        """
+        Returns the per-instance data of the live particles, with the same
+        layout as ``InstancedRenderer.pack``. Particles shrink and fade out
+        as they lose life
+        """
+        n = self.count
+        life = self.life[:n]
+        scale = self.size[:n] * life
+        data = numpy.zeros((n, 20), dtype=numpy.float32)
+        data[:, 0] = data[:, 5] = data[:, 10] = scale
+        data[:, 12:14] = self.position[:n, :2]
+        data[:, 14] = -self.position[:n, 2]
+        data[:, 15] = 1
+        data[:, 16:19] = self.color[:n, :3]
+        data[:, 19] = self.color[:n, 3] * life
+        return data
+
+    def render(self, geometry=None):
+        """
+        Draws all the particles with a single call: instances of *geometry*
+        if it is given, or points otherwise
+        """
+        if self.count == 0:
+            return
+        if geometry is not None:
+            InstancedRenderer.drawinstances(geometry, self.pack())
+            return
+        n = self.count
+        positions = self.position[:n] * _FLIPZ
+        colors = self.color[:n].copy()
+        colors[:, 3] *= self.life[:n]
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(positions.ctypes.data))
+        glColorPointer(4, GL_FLOAT, 0, ctypes.c_void_p(colors.ctypes.data))
+        glDrawArrays(GL_POINTS, 0, n)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+    def _grow(self, size):
+        capacity = max(size, self.capacity * 2)
+        for name in ('position', 'velocity', 'color', 'size', 'life'):
+            array = getattr(self, name)
+            grown = numpy.zeros((capacity,) + array.shape[1:],
+                                dtype=array.dtype)
+            grown[:self.count] = array[:self.count]
+            setattr(self, name, grown)
+
+
+_FLIPZ = numpy.array((1, 1, -1), dtype=numpy.float32)
@@ -1,3 +1,5 @@
+import math
+
 import ode
 
 
@@ -8,53 +10,410 @@ class PhysicsEngineError(Exception):
     def __init__(self, msg):
         Exception.__init__(self, msg)
 
-#TODO: Document class
+class Collision(object):
+    """
+    Collision event passed to the oncollisionenter, oncollisionstay and
+    oncollisionexit hooks of the components
+    """
+    def __init__(self, gameobject, contacts, flip=False):
+        #: The other gameobject of the collision
+        self.gameobject = gameobject
+        #: List of (position, normal, depth) tuples of the contact points
+        #: found in the last step, empty for exit events. The normals are
+        #: flipped for each side, so that both gameobjects see them as if
+        #: they were the first geom of the contact
+        self.contacts = _flip(contacts) if flip else contacts
+
+
+class PhysicsMaterial(object):
+    """
+    Surface properties of a collider. The contacts between two colliders use
+    the geometric mean of their frictions, and the highest bounce and
+    softness of both. Materials are shared by many geoms and cached in
+    pairs, so they must not be modified once in use: replace them instead
+    """
+    def __init__(self, friction=10000., bounce=0., bouncevelocity=.1,
+                 softerp=None, softcfm=None):
+        """
+        Parameters
+        ----------
+        friction : float
+            Coulomb friction coefficient, or ode.Infinity
+        bounce, bouncevelocity : float
+            Restitution from 0 to 1, and minimum incoming speed to bounce
+        softerp, softcfm : float
+            ERP and CFM of the contacts, to make the surface soft. If they
+            are None, the ERP and CFM of the world are used
+        """
+        self.friction = friction
+        self.bounce = bounce
+        self.bouncevelocity = bouncevelocity
+        self.softerp = softerp
+        self.softcfm = softcfm
+    
+    @staticmethod
+    def combine(material1, material2):
+        """
+        Returns the (mode, mu, bounce, bouncevelocity, softerp, softcfm)
+        surface parameters of the contacts between two materials
+        """
+        mode = 0
+        friction = ode.Infinity
+        if ode.Infinity not in (material1.friction, material2.friction):
+            friction = math.sqrt(material1.friction * material2.friction)
+        bounce = max(material1.bounce, material2.bounce)
+        bouncevelocity = min(material1.bouncevelocity,
+                             material2.bouncevelocity)
+        if bounce > 0:
+            mode |= ode.ContactBounce
+        erps = [m.softerp for m in (material1, material2)
+                if m.softerp is not None]
+        cfms = [m.softcfm for m in (material1, material2)
+                if m.softcfm is not None]
+        softerp = min(erps) if erps else None
+        softcfm = max(cfms) if cfms else None
+        if softerp is not None:
+            mode |= ode.ContactSoftERP
+        if softcfm is not None:
+            mode |= ode.ContactSoftCFM
+        return mode, friction, bounce, bouncevelocity, softerp, softcfm
+
+
+def _alive(gameobject):
+    """Whether a gameobject is still in its scene"""
+    return gameobject in gameobject.scene.gameobjects
+
+
+def _flip(contacts):
+    return [(position, tuple(-n for n in normal), depth)
+            for position, normal, depth in contacts]
+
+
 class PhysicsEngine(object):
+    """
+    Physics world and collision spaces of a scene. Each Scene owns its own
+    engine, so several scenes can be simulated in the same process
+    """
     
-    world = ode.World()
-    space = ode.Space()
-    contactgroup = ode.JointGroup()
-    
-    @classmethod
-    def start(cls, gravity=(0, -9.8, 0), erp=.8, cfm=1e-5):
-        cls.world = ode.World()
-        cls.world.setGravity(gravity)
-        cls.world.setERP(erp)
-        cls.world.setCFM(cfm)
-        cls.space = ode.Space()
-        cls.contactgroup = ode.JointGroup()
+    broadphases = ('simple', 'hash', 'quadtree')
+    solvers = ('step', 'quickstep')
+    defaultmaterial = PhysicsMaterial()
+    
+    def __init__(self, gravity=(0, -9.8, 0), erp=.8, cfm=1e-5,
+                 broadphase='simple', levels=None, center=(0, 0, 0),
+                 extents=(200, 200, 200), depth=8, autodisable=False,
+                 linearthreshold=.01, angularthreshold=.01,
+                 autodisablesteps=10, autodisabletime=0., solver='step',
+                 iterations=20, substeps=1, maxcontacts=4):
+        """
+        Creates the world and collision spaces
+        
+        Geoms without a body that have never been moved are kept in a static
+        space, separate from the space of the dynamic geoms, so static level
+        geometry is only tested against dynamic geoms and never against
+        itself
         
-    @classmethod
-    def step(cls, step):
-        cls.space.collide(None, cls._collidecallback)
-        cls.world.step(step)
-        cls.contactgroup.empty()
+        Parameters
+        ----------
+        broadphase : str
+            Collision space used by the broadphase: 'simple' tests every
+            pair, 'hash' uses a multi-resolution hash grid and 'quadtree' a
+            quadtree of fixed extents
+        levels : tuple
+            (minlevel, maxlevel) cell sizes of the hash grid as powers of 2.
+            If it is None, they are tuned from the sizes of the geoms
+        center, extents, depth : tuple, tuple, int
+            Center, size and depth of the quadtree, which must enclose the
+            whole world
+        autodisable : bool
+            Whether bodies that have been resting for a while are disabled.
+            Sleeping bodies are not simulated and their gameobjects are not
+            updated until a contact or a force wakes them
+        linearthreshold, angularthreshold : float
+            Linear and angular speeds below which a body is resting
+        autodisablesteps, autodisabletime : int, float
+            Steps and seconds a body must be resting before it is disabled
+        solver : str
+            'step' uses the exact solver, whose cost grows with the cube of
+            the number of constraints, and 'quickstep' the iterative one,
+            which is linear and stable for large stacks
+        iterations : int
+            Iterations of the 'quickstep' solver per step
+        substeps : int
+            Number of world steps each call to step is divided into
+        maxcontacts : int
+            Maximum number of contact joints created for a pair of geoms
+        """
+        if broadphase not in self.broadphases:
+            raise PhysicsEngineError("Invalid broadphase: %s" % broadphase)
+        if solver not in self.solvers:
+            raise PhysicsEngineError("Invalid solver: %s" % solver)
+        self.world = ode.World()
+        self.world.setGravity(gravity)
+        self.world.setERP(erp)
+        self.world.setCFM(cfm)
+        self.world.setAutoDisableFlag(autodisable)
+        self.world.setAutoDisableLinearThreshold(linearthreshold)
+        self.world.setAutoDisableAngularThreshold(angularthreshold)
+        self.world.setAutoDisableSteps(autodisablesteps)
+        self.world.setAutoDisableTime(autodisabletime)
+        self.autodisable = autodisable
+        self.world.setQuickStepNumIterations(iterations)
+        self._solver = solver
+        self.substeps = substeps
+        self.maxcontacts = maxcontacts
+        #: Number of world steps run by the engine. Transforms compare it
+        #: with the step in which they last read their body
+        self.stepcount = 0
+        self._surfaces = {}
+        self.space = self._createspace(broadphase, center, extents, depth)
+        self.staticspace = self._createspace(broadphase, center, extents,
+                                             depth)
+        self._broadphase = broadphase
+        self._levels = levels
+        self._tunedcount = 0
+        self._colliding = False
+        self._moves = []
+        # Pairs of gameobjects in contact in the current and the last step
+        self._contacts = {}
+        self._touching = {}
+        # Touching pairs skipped because none of their bodies is awake
+        self._asleep = {}
+        # Rigidbodies awake and sleeping when autodisable is set
+        self._awake = set()
+        self._sleeping = set()
+        if broadphase == 'hash' and levels is not None:
+            self.space.setLevels(*levels)
+            self.staticspace.setLevels(*levels)
+        self.contactgroup = ode.JointGroup()
+    
+    @staticmethod
+    def _createspace(broadphase, center, extents, depth):
+        if broadphase == 'hash':
+            return ode.HashSpace()
+        elif broadphase == 'quadtree':
+            return ode.QuadTreeSpace(center, extents, depth)
+        return ode.SimpleSpace()
         
-    @classmethod
-    def _collidecallback(cls, args, geom1, geom2):
-        go1 = geom1.gameobject
-        go2 = geom2.gameobject
-        go1.oncollision(go2)
-        go2.oncollision(go1)
-        for contact in ode.collide(geom1, geom2):
-            contact.setBounce(0)
-            contact.setMu(10000)
-            j = ode.ContactJoint(cls.world, cls.contactgroup, contact)
-            j.attach(geom1.getBody(), geom2.getBody())
-            
-    @classmethod
-    def createbody(cls):
-        return ode.Body(cls.world)
-    
-    @classmethod
-    def createmass(cls):
+    def step(self, step):
+        """
+        Advances the world *step* seconds in ``substeps`` world steps, and
+        then sends the collision events found in any of them
+        """
+        if self._broadphase == 'hash' and self._levels is None:
+            self._autotune()
+        worldstep = self.world.quickStep if self._solver == 'quickstep' \
+            else self.world.step
+        step = float(step) / self.substeps
+        for _ in xrange(self.substeps):
+            self._colliding = True
+            try:
+                ode.collide2(self.staticspace, self.space, None,
+                             self._collidecallback)
+                self.space.collide(None, self._collidecallback)
+            finally:
+                self._colliding = False
+            for geom, dynamic in self._moves:
+                self.setdynamic(geom, dynamic)
+            self._moves = []
+            worldstep(step)
+            self.contactgroup.empty()
+            self.stepcount += 1
+        if self.autodisable:
+            for rigidbody in [rigidbody for rigidbody in self._awake
+                              if not rigidbody._body.isEnabled()]:
+                rigidbody._sleep()
+        self._dispatch()
+    
+    def _autotune(self):
+        """
+        Sets the levels of the hash spaces from the smallest and largest
+        geom, each time the number of geoms has doubled or halved
+        """
+        count = self.space.getNumGeoms() + self.staticspace.getNumGeoms()
+        if count == 0 or self._tunedcount / 2 < count <= self._tunedcount * 2:
+            return
+        self._tunedcount = count
+        sizes = []
+        for space in (self.space, self.staticspace):
+            for i in xrange(space.getNumGeoms()):
+                aabb = space.getGeom(i).getAABB()
+                sizes.append(max(aabb[1] - aabb[0], aabb[3] - aabb[2],
+                                 aabb[5] - aabb[4]))
+        sizes = [size for size in sizes if size > 0] or [1.]
+        levels = (int(math.floor(math.log(min(sizes), 2))),
+                  int(math.ceil(math.log(max(sizes), 2))))
+        self.space.setLevels(*levels)
+        self.staticspace.setLevels(*levels)
+    
+    def setdynamic(self, geom, dynamic=True):
+        """
+        Moves *geom* to the space of dynamic geoms, or back to the static one.
+        The spaces cannot change during the broadphase, so a move requested
+        from a collision callback is applied after it
+        """
+        if geom.dynamic == dynamic:
+            return
+        if self._colliding:
+            self._moves.append((geom, dynamic))
+            return
+        source, target = self.staticspace, self.space
+        if not dynamic:
+            source, target = target, source
+        source.remove(geom)
+        target.add(geom)
+        geom.dynamic = dynamic
+    
+    def addbody(self, rigidbody):
+        """Registers a started rigidbody as awake"""
+        self._sleeping.discard(rigidbody)
+        self._awake.add(rigidbody)
+    
+    def removebody(self, rigidbody):
+        self._awake.discard(rigidbody)
+        self._sleeping.discard(rigidbody)
+    
+    def sleepbody(self, rigidbody):
+        """Moves a rigidbody to the dormant set"""
+        self._awake.discard(rigidbody)
+        self._sleeping.add(rigidbody)
+    
+    def removecontacts(self, gameobject):
+        """
+        Forgets the pairs in contact with a gameobject that leaves the scene,
+        so neither it nor the gameobjects it touched get an exit event
+        """
+        key = id(gameobject)
+        for pairs in (self._contacts, self._touching, self._asleep):
+            for pair in [pair for pair in pairs if key in pair]:
+                del pairs[pair]
+    
+    def bodystats(self):
+        """
+        Returns a dict with the number of awake and sleeping rigidbodies
+        """
+        return {'awake': len(self._awake), 'sleeping': len(self._sleeping)}
+    
+    @staticmethod
+    def _isawake(geom, body):
+        # Geoms moved by their transform count as awake, since they can
+        # push a sleeping body
+        if body is None:
+            return geom.dynamic
+        return body.isEnabled()
+    
+    def _collidecallback(self, args, geom1, geom2):
+        body1, body2 = geom1.getBody(), geom2.getBody()
+        awake1 = self._isawake(geom1, body1)
+        awake2 = self._isawake(geom2, body2)
+        if not (awake1 or awake2) and (body1 is not None or
+                                       body2 is not None):
+            self._keep(geom1.gameobject, geom2.gameobject)
+            return
+        contacts = ode.collide(geom1, geom2)
+        if not contacts:
+            return
+        # ODE enables a disabled body touched by an enabled one in the
+        # step, so it leaves the dormant set now
+        if body1 is not None and not awake1:
+            geom1.gameobject.rigidbody._wake()
+        if body2 is not None and not awake2:
+            geom2.gameobject.rigidbody._wake()
+        contacts = contacts[:self.maxcontacts]
+        points = [contact.getContactGeomParams()[:3] for contact in contacts]
+        if body1 is not None or body2 is not None:
+            surface = self._surface(geom1.material, geom2.material)
+            mode, mu, bounce, bouncevelocity, softerp, softcfm = surface
+            for contact in contacts:
+                contact.setMode(mode)
+                contact.setMu(mu)
+                if mode & ode.ContactBounce:
+                    contact.setBounce(bounce)
+                    contact.setBounceVel(bouncevelocity)
+                if mode & ode.ContactSoftERP:
+                    contact.setSoftERP(softerp)
+                if mode & ode.ContactSoftCFM:
+                    contact.setSoftCFM(softcfm)
+                j = ode.ContactJoint(self.world, self.contactgroup, contact)
+                j.attach(body1, body2)
+        self._record(geom1.gameobject, geom2.gameobject, points)
+    
+    def _surface(self, material1, material2):
+        """
+        Returns the surface parameters of a pair of materials, computed once
+        for each pair
+        """
+        try:
+            return self._surfaces[material1, material2]
+        except KeyError:
+            surface = PhysicsMaterial.combine(material1, material2)
+            self._surfaces[material1, material2] = \
+                self._surfaces[material2, material1] = surface
+            return surface
+    
+    def _record(self, go1, go2, points):
+        """
+        Adds the contact points of a pair of gameobjects to the events of the
+        current step. A pair reported by several callbacks gets a single
+        event with all their points
+        """
+        if id(go1) > id(go2):
+            go1, go2 = go2, go1
+            points = _flip(points)
+        key = (id(go1), id(go2))
+        try:
+            self._contacts[key][2].extend(points)
+        except KeyError:
+            self._contacts[key] = (go1, go2, list(points))
+    
+    def _keep(self, go1, go2):
+        """
+        Keeps a pair of sleeping gameobjects touching without sending
+        events, since none of them has moved
+        """
+        if id(go1) > id(go2):
+            go1, go2 = go2, go1
+        key = (id(go1), id(go2))
+        if key in self._touching:
+            self._asleep[key] = self._touching[key]
+    
+    def _dispatch(self):
+        """
+        Sends the collision events of the step once the world has been
+        stepped, so the components can change the scene safely
+        """
+        contacts, self._contacts = self._contacts, {}
+        asleep, self._asleep = self._asleep, {}
+        touching, self._touching = self._touching, contacts
+        # The handlers may remove gameobjects from the scene, which also
+        # removes their pairs from contacts
+        for key, (go1, go2, points) in contacts.items():
+            if key not in contacts or not (_alive(go1) and _alive(go2)):
+                continue
+            hook = 'oncollisionstay' if key in touching else 'oncollisionenter'
+            go1._collide(hook, go2, points, False)
+            go2._collide(hook, go1, points, True)
+        for key, (go1, go2, _) in touching.iteritems():
+            if key not in contacts and key not in asleep and \
+                    _alive(go1) and _alive(go2):
+                go1._collide('oncollisionexit', go2, [], False)
+                go2._collide('oncollisionexit', go1, [], True)
+        contacts.update(asleep)
+    
+    def createbody(self):
+        return ode.Body(self.world)
+    
+    @staticmethod
+    def createmass():
         return ode.Mass()
     
-    @classmethod
-    def creategeom(cls, geomtype, args):
+    def creategeom(self, geomtype, args):
         geomtype = "Geom" + geomtype
         try:
-            return ode.__dict__[geomtype](cls.space, *args)
+            geom = ode.__dict__[geomtype](self.staticspace, *args)
         except:
             raise PhysicsEngineError("Invalid Geom type: %s "
                                      "is not defined in `ode'" % geomtype)
+        geom.dynamic = False
+        geom.material = self.defaultmaterial
+        return geom
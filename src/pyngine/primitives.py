@@ -0,0 +1,92 @@
+"""
+Vertex data of the built-in shapes. Each function returns a tuple with:
+
+* A (N, 8) float32 array of interleaved vertices: position, normal and
+  texture coordinates
+* A flat uint32 array of triangle indices, counter-clockwise when seen from
+  the outside
+
+The shapes have the same size and orientation as their GLUT counterparts.
+"""
+
+import math
+
+import numpy
+
+
+def cube(size=1.):
+    """
+    Returns the vertex data of a cube centered at the origin
+    """
+    h = size / 2.
+    # Normal and the two axes of each face, with cross(u, v) == normal
+    faces = [((1, 0, 0), (0, 1, 0), (0, 0, 1)),
+             ((-1, 0, 0), (0, 0, 1), (0, 1, 0)),
+             ((0, 1, 0), (0, 0, 1), (1, 0, 0)),
+             ((0, -1, 0), (1, 0, 0), (0, 0, 1)),
+             ((0, 0, 1), (1, 0, 0), (0, 1, 0)),
+             ((0, 0, -1), (0, 1, 0), (1, 0, 0))]
+    vertices = []
+    for normal, u, v in faces:
+        n, u, v = numpy.array(normal), numpy.array(u), numpy.array(v)
+        for s, t in ((-1, -1), (1, -1), (1, 1), (-1, 1)):
+            position = (n + s * u + t * v) * h
+            vertices.append(tuple(position) + normal + ((s+1)/2, (t+1)/2))
+    indices = []
+    for i in xrange(0, 24, 4):
+        indices.extend((i, i+1, i+2, i, i+2, i+3))
+    return (numpy.array(vertices, dtype=numpy.float32),
+            numpy.array(indices, dtype=numpy.uint32))
+
+
+def sphere(radius=.5, slices=18, stacks=18):
+    """
+    Returns the vertex data of a sphere centered at the origin, with its poles
+    along the z axis
+    """
+    theta = numpy.linspace(0, math.pi, stacks + 1)[:, numpy.newaxis]
+    phi = numpy.linspace(0, 2 * math.pi, slices + 1)[numpy.newaxis, :]
+    normals = numpy.empty((stacks + 1, slices + 1, 3))
+    normals[..., 0] = numpy.sin(theta) * numpy.cos(phi)
+    normals[..., 1] = numpy.sin(theta) * numpy.sin(phi)
+    normals[..., 2] = numpy.cos(theta) * numpy.ones_like(phi)
+    texcoords = numpy.empty((stacks + 1, slices + 1, 2))
+    texcoords[..., 0] = phi / (2 * math.pi)
+    texcoords[..., 1] = 1 - theta / math.pi
+    return _surface(normals * radius, normals, texcoords)
+
+
+def torus(inner=.25, outer=.5, sides=15, rings=15):
+    """
+    Returns the vertex data of a torus centered at the origin and lying on the
+    xy plane. *inner* is the radius of the tube and *outer* the distance from
+    the origin to the center of the tube
+    """
+    u = numpy.linspace(0, 2 * math.pi, rings + 1)[:, numpy.newaxis]
+    v = numpy.linspace(0, 2 * math.pi, sides + 1)[numpy.newaxis, :]
+    normals = numpy.empty((rings + 1, sides + 1, 3))
+    normals[..., 0] = numpy.cos(v) * numpy.cos(u)
+    normals[..., 1] = numpy.cos(v) * numpy.sin(u)
+    normals[..., 2] = numpy.sin(v) * numpy.ones_like(u)
+    positions = normals * inner
+    positions[..., 0] += outer * numpy.cos(u)
+    positions[..., 1] += outer * numpy.sin(u)
+    texcoords = numpy.empty((rings + 1, sides + 1, 2))
+    texcoords[..., 0] = u / (2 * math.pi)
+    texcoords[..., 1] = v / (2 * math.pi)
+    return _surface(positions, normals, texcoords)
+
+
+def _surface(positions, normals, texcoords):
+    """
+    Builds the vertex data of a parametric surface sampled on a grid of
+    (rows + 1, cols + 1) points
+    """
+    rows, cols = positions.shape[0] - 1, positions.shape[1] - 1
+    vertices = numpy.concatenate((positions, normals, texcoords), axis=2)
+    a = numpy.arange(rows * (cols + 1)).reshape(rows, cols + 1)[:, :cols]
+    b = a + cols + 1
+    quads = numpy.dstack((a, b, a + 1, b, b + 1, a + 1))
+    return (numpy.ascontiguousarray(vertices.reshape(-1, 8),
+                                    dtype=numpy.float32),
+            quads.astype(numpy.uint32).ravel())
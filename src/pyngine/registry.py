@@ -0,0 +1,128 @@
+"""
+Registry of the gameobjects of a scene.
+
+Gameobjects are stored in a packed list and removed by moving the last one
+into their slot, so adding and destroying them takes constant time. The
+registry also keeps indexes by id, tag, name and component class, updated as
+gameobjects are added, removed, renamed and retagged, and as components are
+attached and detached, so lookups do not scan the scene.
+"""
+
+
+class GameObjectRegistry(object):
+    """
+    Gameobjects of a scene, iterable like a list. The order of iteration
+    changes when a gameobject is removed
+    """
+
+    def __init__(self):
+        self._gameobjects = []
+        self._byid = {}
+        # Dicts of id to gameobject for each tag and name
+        self._bytag = {}
+        self._byname = {}
+        # Dicts of id(component) to component for each component class
+        self._bytype = {}
+
+    def __len__(self):
+        return len(self._gameobjects)
+
+    def __iter__(self):
+        return iter(self._gameobjects)
+
+    def __getitem__(self, index):
+        return self._gameobjects[index]
+
+    def __contains__(self, gameobject):
+        return self._byid.get(gameobject.id) is gameobject
+
+    def __repr__(self):
+        return "GameObjectRegistry(%r)" % self._gameobjects
+
+    def add(self, gameobject):
+        """Adds a gameobject and indexes it with its components"""
+        if gameobject in self:
+            raise ValueError("The gameobject is already registered")
+        gameobject._slot = len(self._gameobjects)
+        self._gameobjects.append(gameobject)
+        self._byid[gameobject.id] = gameobject
+        _add(self._bytag, gameobject.tag, gameobject.id, gameobject)
+        _add(self._byname, gameobject.name, gameobject.id, gameobject)
+        for component in gameobject.components:
+            self._addcomponent(component)
+
+    def remove(self, gameobject):
+        """
+        Removes a gameobject, moving the last one into its slot. Raises a
+        ``ValueError`` if it is not registered
+        """
+        if gameobject not in self:
+            raise ValueError("The gameobject is not registered")
+        slot = gameobject._slot
+        last = self._gameobjects.pop()
+        if last is not gameobject:
+            self._gameobjects[slot] = last
+            last._slot = slot
+        gameobject._slot = None
+        del self._byid[gameobject.id]
+        _discard(self._bytag, gameobject.tag, gameobject.id)
+        _discard(self._byname, gameobject.name, gameobject.id)
+        for component in gameobject.components:
+            self._removecomponent(component)
+
+    def get(self, id):
+        """Returns the gameobject with the given id, or None"""
+        return self._byid.get(id)
+
+    def findbytag(self, tag):
+        """Returns a gameobject with the given tag, or None"""
+        for gameobject in self._bytag.get(tag, {}).itervalues():
+            return gameobject
+
+    def findallbytag(self, tag):
+        """Returns the list of gameobjects with the given tag"""
+        return self._bytag.get(tag, {}).values()
+
+    def findbyname(self, name):
+        """Returns a gameobject with the given name, or None"""
+        for gameobject in self._byname.get(name, {}).itervalues():
+            return gameobject
+
+    def findall(self, cls):
+        """
+        Returns the list of components attached to the gameobjects that are
+        instances of *cls*
+        """
+        result = []
+        for type_, components in self._bytype.iteritems():
+            if issubclass(type_, cls):
+                result.extend(components.itervalues())
+        return result
+
+    def _retag(self, gameobject, attribute, old, new):
+        """Moves a gameobject from the *old* tag or name to the *new* one"""
+        if gameobject in self:
+            index = self._bytag if attribute == 'tag' else self._byname
+            _discard(index, old, gameobject.id)
+            _add(index, new, gameobject.id, gameobject)
+
+    def _addcomponent(self, component):
+        _add(self._bytype, type(component), id(component), component)
+
+    def _removecomponent(self, component):
+        _discard(self._bytype, type(component), id(component))
+
+
+def _add(index, key, id, value):
+    try:
+        index[key][id] = value
+    except KeyError:
+        index[key] = {id: value}
+
+
+def _discard(index, key, id):
+    entries = index.get(key)
+    if entries is not None:
+        entries.pop(id, None)
+        if not entries:
+            del index[key]
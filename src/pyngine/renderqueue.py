@@ -0,0 +1,118 @@
+"""
+Render queue that orders the draws of a frame.
+
+Renderables are split into an opaque and a transparent pass, and each of
+them gets an integer sort key made of its texture, material (its color) and
+geometry, plus its quantized distance to the camera. Opaque renderables are
+grouped by state and drawn front to back within each group, so the depth
+test rejects the hidden fragments early. Transparent renderables are drawn
+after them, back to front, so that blending is correct. The keys are sorted
+with a least-significant-digit radix sort.
+"""
+
+import numpy
+
+
+# Bits of each field of the sort keys
+_STATEBITS = 12
+_DEPTHBITS = 16
+_STATEMASK = (1 << _STATEBITS) - 1
+_DEPTHMAX = (1 << _DEPTHBITS) - 1
+
+
+def radixsort(keys, bits=64):
+    """
+    Returns the indices that sort *keys*, an array of unsigned integers.
+    Each pass of the least-significant-digit radix sort is a stable sort of
+    a 16-bit digit, which NumPy 1.17 and later run as a radix sort, and the
+    passes over digits that are equal in every key are skipped
+    """
+    keys = numpy.asarray(keys, dtype=numpy.uint64)
+    order = numpy.arange(len(keys))
+    for shift in xrange(0, bits, 16):
+        digits = ((keys[order] >> numpy.uint64(shift)) &
+                  numpy.uint64(0xffff)).astype(numpy.uint16)
+        if len(digits) and (digits == digits[0]).all():
+            continue
+        order = order[numpy.argsort(digits, kind='stable')]
+    return order
+
+
+class RenderQueue(object):
+    """
+    Draw items of the last frame, split into an opaque and a transparent
+    pass and sorted to minimize state changes
+    """
+
+    def __init__(self):
+        #: Opaque renderables, grouped by texture, material and geometry,
+        #: and front to back within each group
+        self.opaque = []
+        #: Transparent renderables, back to front
+        self.transparent = []
+
+    def build(self, renderables, view, near, far):
+        """
+        Sorts *renderables* into the two passes
+
+        Parameters
+        ----------
+        renderables : list
+            Renderables to draw in the frame
+        view : numpy.ndarray
+            4x4 row-major view matrix of the camera
+        near, far : float
+            Distances of the clipping planes, used to quantize the depth
+        """
+        opaque = [r for r in renderables if not r.transparent]
+        transparent = [r for r in renderables if r.transparent]
+        self.opaque = self._sort(opaque, view, near, far, False)
+        self.transparent = self._sort(transparent, view, near, far, True)
+
+    def _sort(self, renderables, view, near, far, backtofront):
+        if len(renderables) < 2:
+            return renderables
+        tables = {}, {}, {}
+        textures, materials, geometries = [], [], []
+        for renderable in renderables:
+            geometry = renderable.geometry
+            texture = None
+            if geometry is not None:
+                texture = geometry.parts[0][3]
+            color = renderable.color
+            if color is not None:
+                color = tuple(color)
+            textures.append(_intern(tables[0], texture))
+            materials.append(_intern(tables[1], color))
+            geometries.append(_intern(tables[2], id(geometry)))
+        matrices = numpy.array([r.transform.rendermatrix
+                                for r in renderables], dtype=numpy.float64)
+        # Distance along the view direction, from the z row of the view
+        distance = -(numpy.dot(matrices[:, 12:15], view[2, :3]) + view[2, 3])
+        depth = numpy.clip((distance - near) / (far - near), 0, 1)
+        depth = (depth * _DEPTHMAX).astype(numpy.uint64)
+        state = (numpy.array(textures, dtype=numpy.uint64) <<
+                 numpy.uint64(2 * _STATEBITS)) | \
+            (numpy.array(materials, dtype=numpy.uint64) <<
+             numpy.uint64(_STATEBITS)) | \
+            numpy.array(geometries, dtype=numpy.uint64)
+        if backtofront:
+            keys = ((numpy.uint64(_DEPTHMAX) - depth) <<
+                    numpy.uint64(3 * _STATEBITS)) | state
+        else:
+            keys = (state << numpy.uint64(_DEPTHBITS)) | depth
+        order = radixsort(keys, 3 * _STATEBITS + _DEPTHBITS)
+        return [renderables[i] for i in order]
+
+
+def _intern(table, key):
+    """
+    Returns a small integer for *key*, in the order of first appearance. Past
+    the capacity of the field, the keys share the last value, which only
+    weakens their grouping
+    """
+    try:
+        return table[key]
+    except KeyError:
+        value = table[key] = min(len(table), _STATEMASK)
+        return value
@@ -0,0 +1,220 @@
+import os
+from collections import OrderedDict
+
+import pygame
+from OpenGL.GL import * # @UnusedWildImport
+
+from loader import AssetLoader
+
+
+class Texture(object):
+    """
+    Handle of a texture shared through the TextureManager. The GL texture is
+    uploaded when the first user acquires it, and can be evicted from video
+    memory once nobody uses it
+    """
+
+    def __init__(self, path, filter, wrap, mipmap):
+        self.path = path
+        self.filter = filter
+        self.wrap = wrap
+        self.mipmap = mipmap
+        self.id = None
+        self.width = 0
+        self.height = 0
+        self.nbytes = 0
+        self.refcount = 0
+
+    @property
+    def key(self):
+        return (self.path, self.filter, self.wrap, self.mipmap)
+
+    def acquire(self, image=None):
+        """
+        Adds a user of the texture, uploading it if it is not resident.
+        *image* is the decoded image returned by ``TextureManager.decode``,
+        uploaded instead of reading the file again
+        """
+        TextureManager._acquire(self, image)
+        return self
+
+    def release(self):
+        """
+        Removes a user of the texture. When it has no users left, it is kept
+        in video memory until the TextureManager budget is exceeded
+        """
+        TextureManager._release(self)
+
+    def __repr__(self):
+        return "Texture(%r, refcount=%d)" % (self.path, self.refcount)
+
+
+class TextureManager(object):
+    """
+    Cache of the textures loaded by the engine, keyed by path and sampling
+    parameters. Each texture is decoded and uploaded once, however many
+    components use it
+    """
+
+    # Video memory in bytes that the resident textures may take before the
+    # unused ones are evicted, least recently used first
+    budget = 256 << 20
+
+    _textures = {}
+    _byid = {}
+    _unused = OrderedDict()
+    _memory = 0
+
+    @classmethod
+    def get(cls, path, filter=GL_LINEAR, wrap=GL_REPEAT, mipmap=True):
+        """
+        Returns the shared handle of a texture without acquiring it
+
+        Parameters
+        ----------
+        path : str
+            Path to the image file
+        filter : int
+            GL_LINEAR or GL_NEAREST
+        wrap : int
+            Wrap mode for both texture coordinates, such as GL_REPEAT
+        mipmap : bool
+            Whether to generate mipmaps and sample them when minifying
+        """
+        key = (os.path.abspath(path), filter, wrap, mipmap)
+        try:
+            return cls._textures[key]
+        except KeyError:
+            texture = cls._textures[key] = Texture(*key)
+            return texture
+
+    @classmethod
+    def load(cls, path, filter=GL_LINEAR, wrap=GL_REPEAT, mipmap=True):
+        """
+        Returns the shared handle of a texture, acquired by the caller, who
+        must call its ``release`` method when it no longer needs it
+        """
+        return cls.get(path, filter, wrap, mipmap).acquire()
+
+    @classmethod
+    def loadasync(cls, path, filter=GL_LINEAR, wrap=GL_REPEAT, mipmap=True):
+        """
+        Same as load, but the image is decoded in the background. Returns a
+        Future whose result is the acquired handle
+        """
+        texture = cls.get(path, filter, wrap, mipmap)
+        if texture.id is not None:
+            load = lambda: None
+        else:
+            load = lambda: cls.decode(texture.path)
+        return AssetLoader.submit(load, texture.acquire)
+
+    @staticmethod
+    def decode(path):
+        """
+        Reads an image file and returns a tuple with its RGBA pixels, flipped
+        for OpenGL, and its width and height. It does not need a GL context,
+        so it can run on any thread
+        """
+        surface = pygame.image.load(path)
+        width, height = surface.get_rect().size
+        return pygame.image.tostring(surface, 'RGBA', True), width, height
+
+    @classmethod
+    def byid(cls, texture_id):
+        """
+        Returns the handle of a resident texture from its GL id
+        """
+        return cls._byid[texture_id]
+
+    @classmethod
+    def memory(cls):
+        """
+        Returns the bytes of video memory taken by the resident textures
+        """
+        return cls._memory
+
+    @classmethod
+    def stats(cls):
+        """
+        Returns a dict with the number of resident textures, the number of
+        them without users and their total size in bytes
+        """
+        return {'resident': len(cls._byid), 'unused': len(cls._unused),
+                'memory': cls._memory}
+
+    @classmethod
+    def evict(cls, budget=None):
+        """
+        Deletes unused textures, least recently released first, until the
+        resident textures fit in *budget* (by default, the class budget)
+        """
+        if budget is None:
+            budget = cls.budget
+        while cls._memory > budget and cls._unused:
+            _, texture = cls._unused.popitem(last=False)
+            cls._delete(texture)
+
+    @classmethod
+    def clear(cls):
+        """
+        Deletes every resident texture, for example before the GL context
+        is destroyed
+        """
+        for texture in cls._byid.values():
+            cls._delete(texture)
+        cls._unused.clear()
+
+    @classmethod
+    def _acquire(cls, texture, image=None):
+        texture.refcount += 1
+        if texture.refcount == 1:
+            cls._unused.pop(texture.key, None)
+        if texture.id is None:
+            cls._upload(texture, image or cls.decode(texture.path))
+            cls.evict()
+
+    @classmethod
+    def _release(cls, texture):
+        if texture.refcount == 0:
+            raise ValueError("Texture released more times than acquired: %s"
+                             % texture.path)
+        texture.refcount -= 1
+        if texture.refcount == 0 and texture.id is not None:
+            cls._unused[texture.key] = texture
+            cls.evict()
+
+    @classmethod
+    def _upload(cls, texture, image):
+        data, width, height = image
+        texture.id = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture.id)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, texture.wrap)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, texture.wrap)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, texture.filter)
+        minfilter = texture.filter
+        if texture.mipmap:
+            minfilter = GL_LINEAR_MIPMAP_LINEAR \
+                if texture.filter == GL_LINEAR else GL_NEAREST_MIPMAP_NEAREST
+            if not bool(glGenerateMipmap):
+                glTexParameteri(GL_TEXTURE_2D, GL_GENERATE_MIPMAP, GL_TRUE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, minfilter)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA,
+                     GL_UNSIGNED_BYTE, data)
+        if texture.mipmap and bool(glGenerateMipmap):
+            glGenerateMipmap(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        texture.width, texture.height = width, height
+        texture.nbytes = width * height * 4
+        if texture.mipmap:
+            texture.nbytes = texture.nbytes * 4 // 3
+        cls._byid[texture.id] = texture
+        cls._memory += texture.nbytes
+
+    @classmethod
+    def _delete(cls, texture):
+        glDeleteTextures([texture.id])
+        del cls._byid[texture.id]
+        cls._memory -= texture.nbytes
+        texture.id = None
@@ -1,5 +1,14 @@
+import imp
+import os
+import shutil
+import tempfile
 import unittest
+import numpy
+import ode
 from pyngine import * # @UnusedWildImport
+from pyngine import meshcache, objloader
+from pyngine.renderqueue import radixsort
+import OpenGL.GL
 
 
 # ==============================
@@ -13,7 +22,73 @@ class PhysicsSimulator(object):
     @classmethod
     def step(cls, time):
         for _ in xrange(time):
-            PhysicsEngine.step(1./time)
+            Scene.current.physics.step(1./time)
+
+
+def tower(height, fail=False):
+    """Scene factory of the batch tests"""
+    if fail:
+        raise ValueError("Invalid tower")
+    scene = Scene()
+    GameObject(Transform((0, -1, 0)), BoxCollider())
+    for i in xrange(height):
+        GameObject(Transform((0, i, 0)), BoxCollider(), Rigidbody(1))
+    return scene
+
+
+class Fragile(Component):
+    """Component that fails when it is destroyed"""
+    def ondestroy(self):
+        raise ValueError("Fragile teardown")
+
+
+def fragiletower(height):
+    """Scene factory of the batch tests whose teardown fails"""
+    scene = tower(height)
+    GameObject(Transform(), Fragile())
+    return scene
+
+
+class Collapse(Component):
+    """Component that destroys its gameobject after a few updates"""
+    def __init__(self):
+        Component.__init__(self)
+        self.updates = 0
+    def update(self):
+        self.updates += 1
+        if self.updates == 7:
+            self.gameobject.destroy()
+
+
+def collapsingtower(height):
+    """Scene factory of the batch tests whose floor is destroyed mid-run"""
+    scene = tower(height)
+    scene.gameobjects[0].addcomponent(Collapse())
+    return scene
+
+
+def positionsbyid(scene):
+    return dict((gameobject.id, tuple(gameobject.transform.position))
+                for gameobject in scene.gameobjects)
+
+
+def countbodies(scene):
+    return scene.physics.bodystats()['awake']
+
+
+def realcollisions():
+    """
+    Whether the ode module finds the contacts of overlapping geoms, and only
+    those, so the broadphase can be tested with real collisions
+    """
+    try:
+        box, sphere = ode.GeomBox(None, (1, 1, 1)), ode.GeomSphere(None, 1)
+        far = ode.GeomSphere(None, 1)
+        far.setPosition((10, 0, 0))
+        return bool(ode.collide(box, sphere)) and \
+            not ode.collide(sphere, far)
+    except AttributeError:
+        return False
 
 
 class ExampleComponent(Component):
@@ -63,6 +138,57 @@ class TestQuaternion(unittest.TestCase):
         assert conjugate == (1, 0, -1, 0)
 
 
+class TestVector3Array(unittest.TestCase):
+    
+    def setUp(self):
+        self.vectors = geom.Vector3Array([(1, 1, 1), (1, 2, 3)])
+    
+    def testAdd(self):
+        other = geom.Vector3Array([(1, 2, 3), (0, 0, 0)])
+        assert self.vectors + other == [(2, 3, 4), (1, 2, 3)]
+    
+    def testAddVector(self):
+        assert Vector3D(1, 0, 0) + self.vectors == [(2, 1, 1), (2, 2, 3)]
+    
+    def testSub(self):
+        assert self.vectors - (.5, .5, .5) == [(.5, .5, .5), (.5, 1.5, 2.5)]
+    
+    def testMul(self):
+        assert self.vectors * 5 == [(5, 5, 5), (5, 10, 15)]
+    
+    def testMulPerVector(self):
+        assert self.vectors * (2, 0) == [(2, 2, 2), (0, 0, 0)]
+    
+    def testGetItem(self):
+        assert self.vectors[1] == Vector3D(1, 2, 3)
+
+
+class TestQuaternionArray(unittest.TestCase):
+    
+    def setUp(self):
+        self.quaternions = geom.QuaternionArray([(1, 0, 1, 0),
+                                                 (0, 1, 0, 0)])
+    
+    def testConjugate(self):
+        conjugate = self.quaternions.conjugate
+        assert conjugate == [(1, 0, -1, 0), (0, -1, 0, 0)]
+    
+    def testMul(self):
+        other = Quaternion.from_axis(Vector3D.up, math.pi / 3)
+        result = self.quaternions * other
+        for q, r in zip(self.quaternions, result):
+            assert numpy.allclose(q * other, r)
+    
+    def testFromAxis(self):
+        result = geom.QuaternionArray.from_axis(Vector3D.up, (0, math.pi))
+        assert numpy.allclose(result.data, [(1, 0, 0, 0), (0, 0, 1, 0)])
+    
+    def testRotateVector(self):
+        result = self.quaternions.rotate_vector((1, 2, 3))
+        for q, v in zip(self.quaternions, result):
+            assert numpy.allclose(q.rotate_vector((1, 2, 3)), v)
+
+
 class TestComponent(unittest.TestCase):
     
     def setUp(self):
@@ -102,9 +228,47 @@ class TestTransform(unittest.TestCase):
         self.transform.rotate(Vector3D.up, math.pi)
         assert self.transform.rotation.round == (0, 0, 1, 0)
     
+    def testRotate2(self):
+        self.transform.addchild(self.child)
+        self.transform.rotate(Vector3D.forward, math.pi / 2)
+        assert numpy.allclose(self.child.position, (-1, 0, 0))
+        assert numpy.allclose(self.child.localposition, (0, 1, 0))
+    
+    def testLocalPosition(self):
+        self.transform.position = (1, 1, 1)
+        self.transform.addchild(self.child)
+        self.child.localposition = (0, 0, 2)
+        assert self.child.position == (1, 1, 3)
+    
     def testAddChild(self):
         self.transform.addchild(self.child)
         assert self.child in self.transform
+    
+    def testAddChild2(self):
+        self.transform.addchild(self.child)
+        self.assertRaises(ValueError, self.child.addchild, self.transform)
+    
+    def testRemoveChild(self):
+        self.transform.addchild(self.child)
+        self.transform.translate(movement=(1, 1, 1))
+        self.transform.removechild(self.child)
+        self.transform.translate(movement=(1, 1, 1))
+        assert self.child.position == (1, 2, 1)
+        assert self.child.parent is None
+    
+    def testMatrix1(self):
+        matrix = self.transform.matrix
+        assert self.transform.matrix is matrix
+    
+    def testMatrix2(self):
+        matrix = self.transform.matrix
+        self.transform.translate(movement=(1, 2, 3))
+        assert self.transform.matrix is not matrix
+        assert tuple(self.transform.matrix[12:15]) == (1, 2, -3)
+    
+    def testMatrix3(self):
+        self.transform.scale = (2, 3, 4)
+        assert tuple(self.transform.matrix[0:12:5]) == (2, 3, 4)
 
 
 class TestCollider(unittest.TestCase):
@@ -114,7 +278,7 @@ class TestCollider(unittest.TestCase):
         self.gameobject = GameObject(Transform((0,0,0)))
         
     def tearDown(self):
-        PhysicsEngine.start()
+        Scene()
         
     def testStart1(self):
         self.gameobject.addcomponent(self.collider)
@@ -167,6 +331,481 @@ class TestCollider(unittest.TestCase):
         assert self.gameobject.transform.position == position_pre
 
 
+class TestBroadphase(unittest.TestCase):
+    
+    def setUp(self):
+        Scene(broadphase='hash')
+        self.gameobject = GameObject(Transform(), BoxCollider())
+    
+    def tearDown(self):
+        Scene()
+    
+    def testStatic(self):
+        assert self.gameobject.collider._geom.dynamic == False
+    
+    def testRigidbody(self):
+        self.gameobject.addcomponent(Rigidbody(1))
+        assert self.gameobject.collider._geom.dynamic == True
+    
+    def testKinematic(self):
+        self.gameobject.transform.translate((1, 0, 0))
+        assert self.gameobject.collider._geom.dynamic == True
+    
+    def testInvalid(self):
+        self.assertRaises(PhysicsEngineError, Scene, broadphase='octree')
+
+
+class TestCollisionLayers(unittest.TestCase):
+    
+    def setUp(self):
+        self.layers = dict(Collider.layers)
+        self.masks = list(Collider._masks)
+        self.gameobject = GameObject(Transform(), BoxCollider('test'))
+    
+    def tearDown(self):
+        Collider.layers = self.layers
+        Collider._masks = self.masks
+        Scene()
+    
+    def testLayer(self):
+        layer = self.gameobject.collider.layer
+        assert layer == Collider.layers['test'] != 0
+        assert self.gameobject.collider._geom.getCategoryBits() == 1 << layer
+    
+    def testIgnore(self):
+        Collider.setlayercollision('test', 'test', False)
+        assert not Collider.getlayercollision('test', 'test')
+        assert Collider.getlayercollision('test', 'default')
+        layer = self.gameobject.collider.layer
+        bits = self.gameobject.collider._geom.getCollideBits()
+        assert bits == 0xffffffff & ~(1 << layer)
+    
+    def testSymmetric(self):
+        Collider.setlayercollision('default', 'test', False)
+        assert not Collider.getlayercollision('test', 'default')
+        assert Collider.getlayercollision('default', 'default')
+    
+    def testInvalid(self):
+        self.assertRaises(ValueError, Collider.getlayer, 32)
+
+
+class TestSolver(unittest.TestCase):
+    
+    def tearDown(self):
+        Scene()
+        Collider.materials.pop('ice', None)
+    
+    def testInvalidSolver(self):
+        self.assertRaises(PhysicsEngineError, Scene, solver='exact')
+    
+    def testSubsteps(self):
+        scene = Scene(solver='quickstep', iterations=10, substeps=4)
+        scene.physics.step(.04)
+        assert scene.physics.stepcount == 4
+    
+    def testCombine(self):
+        rubber = PhysicsMaterial(friction=4., bounce=.8, softcfm=.01)
+        ice = PhysicsMaterial(friction=.25)
+        mode, mu, bounce, _, softerp, softcfm = \
+            PhysicsMaterial.combine(rubber, ice)
+        assert mu == 1. and bounce == .8
+        assert softerp is None and softcfm == .01
+        assert mode & ode.ContactBounce and mode & ode.ContactSoftCFM
+        assert not mode & ode.ContactSoftERP
+    
+    def testSurfaceCache(self):
+        ice = PhysicsMaterial(friction=.25)
+        physics = Scene().physics
+        surface = physics._surface(ice, PhysicsEngine.defaultmaterial)
+        assert physics._surface(PhysicsEngine.defaultmaterial,
+                                ice) is surface
+    
+    def testSetMaterial(self):
+        Collider.setmaterial('ice', friction=.05)
+        collider = BoxCollider(material='ice')
+        GameObject(Transform(), collider)
+        assert collider._geom.material.friction == .05
+        Collider.setmaterial('ice', friction=.1)
+        assert collider._geom.material.friction == .1
+    
+    def testUnknownMaterial(self):
+        self.assertRaises(ValueError, SphereCollider, material='lava')
+
+
+class TestCollisionEvents(unittest.TestCase):
+    
+    class Recorder(Component):
+        def __init__(self):
+            Component.__init__(self)
+            self.events = []
+            self.others = []
+        def oncollision(self, other):
+            self.others.append(other)
+        def oncollisionenter(self, collision):
+            self.events.append(('enter', collision))
+        def oncollisionstay(self, collision):
+            self.events.append(('stay', collision))
+        def oncollisionexit(self, collision):
+            self.events.append(('exit', collision))
+    
+    contact = ((0, 0, 0), (0, 1, 0), .1)
+    
+    def setUp(self):
+        self.physics = Scene().physics
+        self.recorder1 = TestCollisionEvents.Recorder()
+        self.recorder2 = TestCollisionEvents.Recorder()
+        self.go1 = GameObject(Transform(), self.recorder1)
+        self.go2 = GameObject(Transform(), self.recorder2)
+    
+    def tearDown(self):
+        Scene()
+    
+    def testDeferred(self):
+        self.physics._record(self.go1, self.go2, [self.contact])
+        assert self.recorder1.events == []
+        self.physics.step(.01)
+        hook, collision = self.recorder1.events[0]
+        assert hook == 'enter' and collision.gameobject is self.go2
+    
+    def testDeduplicate(self):
+        self.physics._record(self.go1, self.go2, [self.contact])
+        self.physics._record(self.go2, self.go1, [self.contact])
+        self.physics.step(.01)
+        assert len(self.recorder1.events) == 1
+        assert len(self.recorder1.events[0][1].contacts) == 2
+        assert self.recorder1.others == [self.go2]
+    
+    def testNormals(self):
+        self.physics._record(self.go1, self.go2, [self.contact])
+        self.physics.step(.01)
+        assert self.recorder1.events[0][1].contacts[0][1] == (0, 1, 0)
+        assert self.recorder2.events[0][1].contacts[0][1] == (0, -1, 0)
+    
+    def testStayExit(self):
+        for _ in xrange(2):
+            self.physics._record(self.go1, self.go2, [self.contact])
+            self.physics.step(.01)
+        self.physics.step(.01)
+        self.physics.step(.01)
+        hooks = [hook for hook, _ in self.recorder2.events]
+        assert hooks == ['enter', 'stay', 'exit']
+        assert len(self.recorder2.others) == 2
+    
+    def testDestroyed(self):
+        self.physics._record(self.go1, self.go2, [self.contact])
+        self.physics.step(.01)
+        self.go1.destroy()
+        self.physics.step(.01)
+        assert [hook for hook, _ in self.recorder1.events] == ['enter']
+        assert [hook for hook, _ in self.recorder2.events] == ['enter']
+    
+    def testDespawned(self):
+        pool = GameObjectPool(Prefab(SphereCollider,
+                                     TestCollisionEvents.Recorder))
+        go3 = pool.spawn()
+        recorder3 = go3.getcomponent(TestCollisionEvents.Recorder)
+        self.physics._record(go3, self.go2, [self.contact])
+        self.physics.step(.01)
+        go3.despawn()
+        self.physics.step(.01)
+        assert pool.spawn() is go3
+        self.physics._record(go3, self.go2, [self.contact])
+        self.physics.step(.01)
+        assert [hook for hook, _ in recorder3.events] == ['enter', 'enter']
+        assert [hook for hook, _ in self.recorder2.events] == ['enter',
+                                                                'enter']
+
+
+@unittest.skipUnless(realcollisions(), "requires PyODE collision detection")
+class TestBroadphaseCollisions(unittest.TestCase):
+    
+    def tearDown(self):
+        Scene()
+    
+    def collide(self, broadphase, **options):
+        Scene(gravity=(0, 0, 0), broadphase=broadphase, **options)
+        recorders = [TestCollisionEvents.Recorder() for _ in xrange(4)]
+        floor = GameObject(Transform((0, -1, 0), scale=(20, 1, 20)),
+                           BoxCollider(), recorders[0])
+        wall = GameObject(Transform((0, -1, 0), scale=(1, 4, 1)),
+                          BoxCollider(), recorders[1])
+        ball1 = GameObject(Transform((0, -.2, 0)), SphereCollider(),
+                           Rigidbody(1), recorders[2])
+        ball2 = GameObject(Transform((5, 5, 5)), SphereCollider(),
+                           Rigidbody(1), recorders[3])
+        ball3 = GameObject(Transform((5, 5.5, 5)), SphereCollider(),
+                           Rigidbody(1))
+        Scene.current.physics.step(.01)
+        others = [set(recorder.others) for recorder in recorders]
+        # Static geoms only collide with the dynamic ones
+        assert others[0] == others[1] == set([ball1])
+        assert others[2] == set([floor, wall])
+        assert others[3] == set([ball3])
+    
+    def testSimple(self):
+        self.collide('simple')
+    
+    def testHash(self):
+        self.collide('hash')
+    
+    def testQuadtree(self):
+        self.collide('quadtree', extents=(40, 40, 40))
+
+
+class TestSleeping(unittest.TestCase):
+    
+    class Counter(Component):
+        def __init__(self):
+            Component.__init__(self)
+            self.updates = 0
+        def update(self):
+            self.updates += 1
+    
+    def setUp(self):
+        self.scene = Scene(autodisable=True)
+        self.physics = self.scene.physics
+        self.counter = TestSleeping.Counter()
+        self.rigidbody = Rigidbody(1)
+        self.gameobject = GameObject(Transform(), SphereCollider(),
+                                     self.rigidbody, self.counter)
+    
+    def tearDown(self):
+        Scene()
+    
+    def testSleep(self):
+        self.rigidbody._body.disable()
+        self.physics.step(.01)
+        assert self.rigidbody.sleeping and self.gameobject.dormant
+        assert self.physics.bodystats() == {'awake': 0, 'sleeping': 1}
+        self.scene.update()
+        assert self.counter.updates == 0
+    
+    def testWakeByForce(self):
+        self.rigidbody._body.disable()
+        self.physics.step(.01)
+        self.rigidbody.addforce((0, 10, 0))
+        assert self.rigidbody.isenabled() and not self.gameobject.dormant
+        assert self.physics.bodystats() == {'awake': 1, 'sleeping': 0}
+        self.scene.update()
+        assert self.counter.updates == 1
+    
+    def testWakeByContact(self):
+        self.rigidbody._body.disable()
+        self.physics.step(.01)
+        other = GameObject(Transform(), SphereCollider(), Rigidbody(1))
+        geom1, geom2 = self.gameobject.collider._geom, other.collider._geom
+        self.physics._collidecallback(None, geom1, geom2)
+        assert not self.rigidbody.sleeping
+    
+    def testKeepTouching(self):
+        recorder = TestCollisionEvents.Recorder()
+        floor = GameObject(Transform(), BoxCollider(), recorder)
+        self.physics._record(floor, self.gameobject, [])
+        self.physics.step(.01)
+        self.rigidbody._body.disable()
+        geom1, geom2 = floor.collider._geom, self.gameobject.collider._geom
+        for _ in xrange(2):
+            self.physics._collidecallback(None, geom1, geom2)
+            self.physics.step(.01)
+        assert self.rigidbody.sleeping
+        assert [hook for hook, _ in recorder.events] == ['enter']
+    
+    def testDisabledScene(self):
+        scene = Scene()
+        gameobject = GameObject(Transform(), SphereCollider(), Rigidbody(1))
+        gameobject.rigidbody._body.disable()
+        scene.physics.step(.01)
+        assert not gameobject.dormant
+
+
+class TestHeadless(unittest.TestCase):
+    
+    def setUp(self):
+        Game.headless = True
+        path = os.path.join(os.path.dirname(__file__), '..', 'examples',
+                            'pong.py')
+        self.pong = imp.load_source('pong', path)
+        self.game = self.pong.Pong()
+    
+    def tearDown(self):
+        Game.headless = False
+        Input.quitflag = False
+        Input.keys = {}
+    
+    def testInert(self):
+        renderable = Renderable((1, 1, 1, 1))
+        assert renderable.gl_list is None
+        renderable.render()
+    
+    def testRun(self):
+        paddle = [go for go in self.game.scene.gameobjects
+                  if go.getcomponentbyclass(self.pong.ArrowMovement)][0]
+        stats = self.game.run(30, {0: [(pygame.K_UP, True)]})
+        assert stats['ticks'] == 30
+        assert set(stats['phases']) == set(['input', 'update', 'propagate',
+                                            'physics'])
+        assert paddle.transform.position[2] > 5
+    
+    def testQuit(self):
+        stats = self.game.run(30, lambda tick: [('quit', tick == 10)])
+        assert stats['ticks'] == 10
+
+
+class TestScene(unittest.TestCase):
+    
+    def setUp(self):
+        self.scene1 = Scene()
+        self.body1 = GameObject(Transform(), BoxCollider(), Rigidbody(1))
+        self.scene2 = Scene()
+        self.body2 = GameObject(Transform(), BoxCollider(), Rigidbody(1))
+    
+    def tearDown(self):
+        Scene()
+    
+    def testRegistry(self):
+        assert self.body1.scene is self.scene1
+        assert list(self.scene1.gameobjects) == [self.body1]
+        assert list(self.scene2.gameobjects) == [self.body2]
+        assert Scene.current is self.scene2
+    
+    def testExplicitScene(self):
+        camera = Camera()
+        gameobject = GameObject(Transform(), camera, scene=self.scene1)
+        assert gameobject in self.scene1.gameobjects
+        assert self.scene1.camera is camera and self.scene2.camera is None
+    
+    def testIndependentWorlds(self):
+        for _ in xrange(10):
+            self.scene1.step(.1)
+        assert self.body1.transform.position.y < 0
+        assert self.body2.transform.position.y == 0
+    
+    def testIndependentStepCounts(self):
+        self.scene1.step(.1)
+        transform = self.body1.transform
+        transform.position
+        bodystep = transform._bodystep
+        assert bodystep == self.scene1.physics.stepcount
+        self.scene2.step(.1)
+        PhysicsEngine()
+        transform.position
+        assert transform._bodystep == bodystep
+        assert self.scene2.physics.stepcount == 1
+    
+    def testDestroy(self):
+        self.scene2.destroy()
+        assert len(self.scene2.gameobjects) == 0
+        assert Scene.current is None
+        assert self.body1 in self.scene1.gameobjects
+
+
+class TestBatchRunner(unittest.TestCase):
+    
+    def tearDown(self):
+        Scene()
+    
+    def testSerial(self):
+        runner = BatchRunner(tower, 10, processes=0, snapshotevery=5,
+                             measure=countbodies)
+        results = runner.runall([{'height': 2}, {'height': 3}])
+        assert [result.result for result in results] == [2, 3]
+        ticks = [tick for tick, _, _, _ in results[1].snapshots]
+        assert ticks == [5, 10]
+        _, positions, rotations, ids = results[1].snapshots[-1]
+        assert positions.shape == (4, 3) and rotations.shape == (4, 4)
+        assert positions[1, 1] < 0 and list(ids) == sorted(ids)
+    
+    def testSnapshotIds(self):
+        runner = BatchRunner(collapsingtower, 10, processes=0,
+                             snapshotevery=5, measure=positionsbyid)
+        result = runner.runall([{'height': 3}])[0]
+        first, last = result.snapshots
+        assert len(first[3]) == 4 and len(last[3]) == 3
+        assert set(last[3]) < set(first[3])
+        assert list(last[3]) == sorted(last[3])
+        # The floor left the scene, so the rows are matched by id
+        for row, id in enumerate(last[3]):
+            assert tuple(last[1][row]) == result.result[id]
+    
+    def testFailure(self):
+        runner = BatchRunner(tower, 5, processes=0)
+        results = runner.runall([{'height': 1, 'fail': True}, {'height': 1}])
+        assert results[0].failed and 'Invalid tower' in results[0].error
+        assert not results[1].failed and results[1].ticks == 5
+    
+    def testTeardownFailure(self):
+        headless, delta = Game.headless, Game.delta
+        runner = BatchRunner(fragiletower, 5, processes=0,
+                             measure=countbodies)
+        results = runner.runall([{'height': 1}, {'height': 2}])
+        assert [result.result for result in results] == [1, 2]
+        assert all('Fragile teardown' in result.error for result in results)
+        assert results[1].ticks == 5
+        assert Game.headless == headless and Game.delta == delta
+    
+    def testDestroyFailure(self):
+        scene = fragiletower(2)
+        self.assertRaises(ValueError, scene.destroy)
+        assert len(scene.gameobjects) == 0 and Scene.current is None
+    
+    def testPool(self):
+        runner = BatchRunner(tower, 5, processes=2, measure=countbodies)
+        paramsets = [{'height': height} for height in xrange(1, 5)]
+        results = runner.runall(paramsets)
+        assert [result.result for result in results] == [1, 2, 3, 4]
+        assert [len(result.snapshots) for result in results] == [1] * 4
+
+
+class TestDispatch(unittest.TestCase):
+    
+    class Late(Component):
+        def __init__(self, log):
+            Component.__init__(self)
+            self.log = log
+        def update(self):
+            self.log.append('update')
+        def lateupdate(self):
+            self.log.append('lateupdate')
+    
+    def setUp(self):
+        self.scene = Scene()
+        self.component = ExampleComponent()
+        self.gameobject = GameObject(Transform(), BoxCollider(), Cube(),
+                                     self.component)
+    
+    def tearDown(self):
+        Scene()
+    
+    def testOverridden(self):
+        assert self.scene._handlers['update'] == [self.component.update]
+        assert self.scene._handlers['lateupdate'] == []
+        assert self.gameobject._handlers['oncollision'] == []
+    
+    def testRemove(self):
+        self.gameobject.removecomponent(self.component)
+        assert self.scene._handlers['update'] == []
+        self.scene.update()
+        assert self.component.updates == 0
+    
+    def testDormant(self):
+        self.gameobject.dormant = True
+        self.scene.update()
+        self.gameobject.dormant = False
+        self.scene.update()
+        assert self.component.updates == 1
+    
+    def testDestroy(self):
+        self.gameobject.destroy()
+        assert self.scene._handlers['update'] == []
+    
+    def testLateUpdate(self):
+        log = []
+        GameObject(Transform(), TestDispatch.Late(log))
+        GameObject(Transform(), TestDispatch.Late(log))
+        self.scene.update()
+        assert log == ['update', 'update', 'lateupdate', 'lateupdate']
+
+
 class TestGameObject(unittest.TestCase):
     
     def setUp(self):
@@ -192,6 +831,724 @@ class TestGameObject(unittest.TestCase):
         component = ExampleComponent()
         self.gameobject.addcomponent(component)
         assert self.transform is component.transform
+    
+    def testDestroyTwice(self):
+        self.gameobject.destroy()
+        self.gameobject.destroy()
+        assert self.gameobject not in self.gameobject.scene.gameobjects
+    
+    def testDestroyError(self):
+        class Failing(Component):
+            def ondestroy(self):
+                raise RuntimeError("release failed")
+        log = []
+        class Logging(Component):
+            def ondestroy(self):
+                log.append(self)
+        gameobject = GameObject(Transform(), Failing(), Logging())
+        self.assertRaises(RuntimeError, gameobject.destroy)
+        assert log == gameobject.components[2:]
+        assert gameobject not in gameobject.scene.gameobjects
+
+
+class TestGameObjectRegistry(unittest.TestCase):
+    
+    def setUp(self):
+        self.scene = Scene()
+        self.player = GameObject(Transform(), BoxCollider(), ExampleComponent())
+        self.player.tag = 'Player'
+        self.player.name = 'player'
+        self.walls = [GameObject(Transform(), BoxCollider()) for _ in xrange(3)]
+        for wall in self.walls:
+            wall.tag = 'Wall'
+    
+    def tearDown(self):
+        Scene()
+    
+    def testFind(self):
+        registry = self.scene.gameobjects
+        assert registry.findbytag('Player') is self.player
+        assert registry.findbyname('player') is self.player
+        assert sorted(registry.findallbytag('Wall')) == sorted(self.walls)
+        assert registry.get(self.player.id) is self.player
+        assert registry.findbytag('Enemy') is None
+    
+    def testRetag(self):
+        self.player.tag = 'Enemy'
+        registry = self.scene.gameobjects
+        assert registry.findbytag('Player') is None
+        assert registry.findbytag('Enemy') is self.player
+    
+    def testFindAll(self):
+        registry = self.scene.gameobjects
+        assert len(registry.findall(Collider)) == 4
+        assert len(registry.findall(BoxCollider)) == 4
+        component = ExampleComponent()
+        self.walls[0].addcomponent(component)
+        assert len(registry.findall(ExampleComponent)) == 2
+        self.walls[0].removecomponent(component)
+        assert len(registry.findall(ExampleComponent)) == 1
+    
+    def testSwapRemove(self):
+        registry = self.scene.gameobjects
+        self.player.destroy()
+        assert len(registry) == 3 and registry[0] is self.walls[-1]
+        assert self.player not in registry
+        assert registry.findbytag('Player') is None
+        assert len(registry.findall(ExampleComponent)) == 0
+        self.walls[1].destroy()
+        assert sorted(registry) == sorted([self.walls[0], self.walls[2]])
+    
+    def testGetComponent(self):
+        assert self.player.getcomponent(Collider) is self.player.collider
+        assert self.player.getcomponent(Rigidbody) is None
+        rigidbody = Rigidbody(1)
+        self.player.addcomponent(rigidbody)
+        assert self.player.getcomponent(Rigidbody) is rigidbody
+
+
+class TestGameObjectPool(unittest.TestCase):
+    
+    class Counter(Component):
+        def onspawn(self):
+            self.spawns = getattr(self, 'spawns', 0) + 1
+    
+    def setUp(self):
+        self.scene = Scene()
+        self.prefab = Prefab(SphereCollider, lambda: Rigidbody(1),
+                             TestGameObjectPool.Counter, tag='Bullet')
+        self.pool = GameObjectPool(self.prefab, size=2)
+    
+    def tearDown(self):
+        Scene()
+    
+    def testPrewarm(self):
+        assert self.pool.stats() == {'active': 0, 'free': 2, 'created': 2,
+                                     'spawned': 0}
+        assert len(self.scene.gameobjects) == 0
+        assert countbodies(self.scene) == 0
+    
+    def testReuse(self):
+        bullet = self.pool.spawn((1, 2, 3))
+        body = bullet.rigidbody._body
+        geom = bullet.collider._geom
+        assert bullet in self.scene.gameobjects and bullet.tag == 'Bullet'
+        assert body.isEnabled() and geom.isEnabled()
+        bullet.rigidbody.velocity = (5, 0, 0)
+        bullet.despawn()
+        assert bullet not in self.scene.gameobjects and bullet.dormant
+        assert not body.isEnabled() and not geom.isEnabled()
+        again = self.pool.spawn((0, 0, 0))
+        assert again is bullet and again.rigidbody._body is body
+        assert again.rigidbody._body.getLinearVel() == (0, 0, 0)
+        assert tuple(again.transform.position) == (0, 0, 0)
+        assert again.getcomponent(TestGameObjectPool.Counter).spawns == 2
+        assert self.pool.stats()['created'] == 2
+    
+    def testParkedLayerChange(self):
+        Collider.setmaterial('pooled', friction=1.)
+        bullet = self.pool.spawn()
+        bullet.collider.layer = 'pooled'
+        bullet.collider.material = 'pooled'
+        bullet.despawn()
+        try:
+            Collider.setlayercollision('pooled', 'pooled', False)
+            Collider.setmaterial('pooled', friction=2.)
+            again = self.pool.spawn()
+            geom = again.collider._geom
+            assert again is bullet
+            assert geom.getCollideBits() == Collider._masks[again.collider.layer]
+            assert not geom.getCollideBits() & geom.getCategoryBits()
+            assert geom.material.friction == 2.
+        finally:
+            Collider.setlayercollision('pooled', 'pooled', True)
+            del Collider.layers['pooled']
+            del Collider.materials['pooled']
+    
+    def testGrow(self):
+        bullets = [self.pool.spawn() for _ in xrange(3)]
+        assert self.pool.stats() == {'active': 3, 'free': 0, 'created': 3,
+                                     'spawned': 3}
+        self.assertRaises(ValueError, self.pool.despawn, GameObject())
+        for bullet in bullets:
+            bullet.despawn()
+        assert self.pool.stats()['free'] == 3
+    
+    def testDestroyScene(self):
+        self.pool.spawn()
+        self.scene.destroy()
+        assert self.pool.stats()['free'] == 0
+
+
+class TestFixedTimestep(unittest.TestCase):
+    
+    class Mover(Component):
+        def update(self):
+            self.transform.translate((1, 0, 0))
+    
+    def setUp(self):
+        Game.fixedstep = .25
+        self.game = Game()
+        self.component = ExampleComponent()
+        self.gameobject = GameObject(Transform(), self.component,
+                                     TestFixedTimestep.Mover())
+    
+    def tearDown(self):
+        self.gameobject.destroy()
+        Game.fixedstep = None
+        Game.maxsteps = 5
+        Transform.interpolation = None
+    
+    def testAdvance(self):
+        assert self.game.advance(.625) == 2
+        assert self.component.updates == 2
+        assert Transform.interpolation == .5
+        assert self.game.advance(.125) == 1
+        assert Transform.interpolation == 0
+    
+    def testMaxSteps(self):
+        Game.maxsteps = 2
+        assert self.game.advance(10.125) == 2
+        assert Transform.interpolation == .5
+    
+    def testInterpolation(self):
+        self.game.advance(.375)
+        transform = self.gameobject.transform
+        assert transform.matrix[12] == 1
+        assert transform.rendermatrix[12] == .5
+    
+    def testSaveMoving(self):
+        static = GameObject(Transform((0, 5, 0))).transform
+        body = GameObject(Transform(), SphereCollider(), Rigidbody(1))
+        saved = []
+        savestate = Transform._savestate
+        def record(transform):
+            saved.append(transform)
+            savestate(transform)
+        Transform._savestate = record
+        try:
+            self.game.advance(.5)
+        finally:
+            Transform._savestate = savestate
+            body.destroy()
+            static.gameobject.destroy()
+        assert static not in saved
+        assert saved.count(body.transform) == 2
+        # The mover is only saved once it has moved in the first tick
+        assert saved.count(self.gameobject.transform) == 1
+
+
+class TestObjLoader(unittest.TestCase):
+    
+    obj = '''mtllib test.mtl
+v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+vt 0 0
+vn 0 0 1
+usemtl red
+f 1/1/1 2/1/1 3/1/1 4/1/1
+usemtl blue
+f -4//1 -3//1 -1//1
+'''
+    mtl = '''newmtl red
+Kd 1 0 0
+newmtl blue
+Kd 0 0 1
+map_Kd blue.png
+'''
+    
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for name, contents in (('test.obj', self.obj), ('test.mtl', self.mtl)):
+            with open(os.path.join(self.folder, name), 'w') as f:
+                f.write(contents)
+        path = os.path.join(self.folder, 'test.obj')
+        self.vertices, self.indices, self.parts, self.materials = \
+            objloader.loadobj(path)
+    
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+    
+    def testTriangulate(self):
+        assert len(self.indices) == 9
+    
+    def testVertices(self):
+        assert self.vertices.shape == (7, 8)
+        assert self.vertices.dtype == numpy.float32
+    
+    def testIndices(self):
+        triangles = self.vertices[self.indices, :3].reshape(-1, 3, 3)
+        assert numpy.allclose(triangles[2], [(0, 0, 0), (1, 0, 0), (0, 1, 0)])
+    
+    def testParts(self):
+        assert self.parts == [(0, 6, 'red'), (6, 3, 'blue')]
+    
+    def testMaterials(self):
+        assert self.materials['red']['Kd'] == (1, 0, 0)
+        texture = os.path.join(self.folder, 'blue.png')
+        assert self.materials['blue']['map_Kd'] == texture
+
+
+class TestMeshCache(TestObjLoader):
+    
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for name, contents in (('test.obj', self.obj), ('test.mtl', self.mtl)):
+            with open(os.path.join(self.folder, name), 'w') as f:
+                f.write(contents)
+        self.path = os.path.join(self.folder, 'test.obj')
+        self.cachefolder, meshcache.folder = meshcache.folder, self.folder
+        meshcache.load(self.path)
+        self.vertices, self.indices, self.parts, self.materials = \
+            meshcache.load(self.path)
+    
+    def tearDown(self):
+        meshcache.folder = self.cachefolder
+        TestObjLoader.tearDown(self)
+    
+    def testMapped(self):
+        assert not self.vertices.flags.writeable
+    
+    def testUpToDate(self):
+        assert meshcache.compilemesh(self.path)[-1] == False
+    
+    def testOutOfDate(self):
+        with open(self.path, 'a') as f:
+            f.write('f 1 2 3\n')
+        assert meshcache.compilemesh(self.path)[-1] == True
+        assert len(meshcache.load(self.path)[1]) == 12
+    
+    def testOtherDirectory(self):
+        cwd = os.getcwd()
+        try:
+            os.chdir(self.folder)
+            meshcache.compilemesh('test.obj', force=True)
+            os.chdir(tempfile.gettempdir())
+            materials = meshcache.load(self.path)[3]
+        finally:
+            os.chdir(cwd)
+        texture = os.path.join(self.folder, 'blue.png')
+        assert materials['blue']['map_Kd'] == texture
+    
+    def testUnwritable(self):
+        # A regular file cannot be used as the cache folder
+        meshcache.folder = self.path
+        self.assertRaises((IOError, OSError), meshcache.compilemesh,
+                          self.path, True)
+        assert len(meshcache.load(self.path)[1]) == 9
+        assert meshcache.main([self.path]) == 1
+
+
+class TestAssetLoader(unittest.TestCase):
+    
+    def testSubmit(self):
+        future = AssetLoader.submit(lambda: 2, lambda value: value * 3)
+        assert not future.done()
+        AssetLoader.waitall()
+        assert future.done() and future.result() == 6
+        assert AssetLoader.pending() == 0
+    
+    def testCallback(self):
+        results = []
+        future = AssetLoader.submit(lambda: 'asset')
+        future.adddonecallback(lambda f: results.append(f.result()))
+        AssetLoader.waitall()
+        future.adddonecallback(lambda f: results.append(f.result()))
+        assert results == ['asset', 'asset']
+    
+    def testException(self):
+        future = AssetLoader.submit(lambda: open('does-not-exist'))
+        self.assertRaises(RuntimeError, future.result)
+        AssetLoader.waitall()
+        assert isinstance(future.exception(), IOError)
+        self.assertRaises(IOError, future.result)
+    
+    def testSharedKey(self):
+        future1 = AssetLoader.submit(lambda: 1, key='asset')
+        future2 = AssetLoader.submit(lambda: 2, key='asset')
+        assert future1 is future2
+        AssetLoader.waitall()
+        assert AssetLoader.submit(lambda: 3, key='asset') is not future1
+        AssetLoader.waitall()
+
+
+class TestParticleSystem(unittest.TestCase):
+    
+    def setUp(self):
+        self.particles = ParticleSystem(capacity=4, decay=.5)
+        self.particles.emit((0, 0, 0), [(1, 0, 0), (0, 1, 0)], size=2)
+    
+    def testEmit(self):
+        assert len(self.particles) == 2
+        assert tuple(self.particles.color[1]) == (0, 0, 0, 1)
+    
+    def testUpdate(self):
+        self.particles.update()
+        assert tuple(self.particles.position[1]) == (0, 1, 0)
+        assert tuple(self.particles.life[:2]) == (.5, .5)
+    
+    def testRemoveDead(self):
+        self.particles.emit((0, 0, 0), [(0, 0, 1)], life=2)
+        self.particles.update()
+        self.particles.update()
+        assert len(self.particles) == 1
+        assert tuple(self.particles.position[0]) == (0, 0, 2)
+    
+    def testGrow(self):
+        self.particles.emit((1, 1, 1), numpy.zeros((5, 3)))
+        assert len(self.particles) == 7 and self.particles.capacity == 8
+        assert tuple(self.particles.velocity[0]) == (1, 0, 0)
+    
+    def testPack(self):
+        self.particles.update()
+        data = self.particles.pack()
+        assert data.shape == (2, 20)
+        assert tuple(data[0, [0, 5, 10, 19]]) == (1, 1, 1, .5)
+        assert tuple(data[0, 12:15]) == (1, 0, 0)
+
+
+class TestInstancing(unittest.TestCase):
+    
+    def setUp(self):
+        self.red = GameObject(Transform((-1, 0, 5)), Cube(Color.red))
+        self.green = GameObject(Transform((1, 0, 5), scale=(2, 2, 2)),
+                                Cube(Color.green))
+        self.renderables = self.red.renderables + self.green.renderables
+    
+    def tearDown(self):
+        self.red.destroy()
+        self.green.destroy()
+    
+    def testSharedGeometry(self):
+        assert self.red.renderables[0].geometry is \
+            self.green.renderables[0].geometry
+    
+    def testPack(self):
+        data = InstancedRenderer.pack(self.renderables)
+        assert data.shape == (2, 20)
+        assert tuple(data[1, 12:16]) == (1, 0, -5, 1)
+        assert tuple(data[1, 16:]) == (0, 1, 0, 1)
+    
+    def testRefcount(self):
+        geometry = self.red.renderables[0].geometry
+        count = geometry.refcount
+        cube = GameObject(Transform(), Cube())
+        assert geometry.refcount == count + 1
+        cube.destroy()
+        assert geometry.refcount == count
+        assert Geometry._cache[('cube',)] is geometry
+        self.assertRaises(ValueError, Geometry(*primitives.cube()).release)
+
+
+class TestCulling(unittest.TestCase):
+    
+    def setUp(self):
+        self.game = Game()
+        self.camera = Camera()
+        GameObject(Transform(), self.camera)
+        positions = [(0, 0, 5), (0, 0, -5), (0, 0, 200), (50, 0, 5)]
+        self.cubes = [GameObject(Transform(p), Cube()) for p in positions]
+    
+    def tearDown(self):
+        Scene()
+    
+    def testBounds(self):
+        geometry = self.cubes[0].renderables[0].geometry
+        assert numpy.allclose(geometry.center, 0)
+        assert numpy.isclose(geometry.radius, 3 ** .5 / 2)
+        cube = GameObject(Transform((1, 2, 3), scale=(2, 1, 1)), Cube())
+        center, radius = cube.renderables[0].bounds
+        assert numpy.allclose(center, (1, 2, -3))
+        assert numpy.isclose(radius, 3 ** .5)
+    
+    def testCull(self):
+        renderables, culled = self.game._cull(self.game.scene)
+        assert renderables == self.cubes[0].renderables and culled == 3
+        self.camera.orientation = (0, 180, 0)
+        renderables, culled = self.game._cull(self.game.scene)
+        assert renderables == self.cubes[1].renderables and culled == 3
+    
+    def testPartiallyVisible(self):
+        cube = GameObject(Transform((0, 0, .5), scale=(.1, .1, 1)), Cube())
+        renderables, _ = self.game._cull(self.game.scene)
+        assert cube.renderables[0] in renderables
+    
+    def testDisabled(self):
+        Game.culling = False
+        try:
+            renderables, culled = self.game._cull(self.game.scene)
+        finally:
+            Game.culling = True
+        assert len(renderables) == 4 and culled == 0
+
+
+class TestRenderQueue(unittest.TestCase):
+    
+    def setUp(self):
+        self.queue = RenderQueue()
+    
+    def tearDown(self):
+        Scene()
+    
+    def _cubes(self, color, depths):
+        return [GameObject(Transform((0, 0, z)), Cube(color)).renderables[0]
+                for z in depths]
+    
+    def testRadixSort(self):
+        keys = numpy.random.randint(0, 1 << 52, 1000).astype(numpy.uint64)
+        keys[::3] = keys[0]
+        order = radixsort(keys, 52)
+        assert (numpy.diff(keys[order].astype(numpy.int64)) >= 0).all()
+        assert list(order[keys[order] == keys[0]]) == range(0, 1000, 3)
+    
+    def testOpaque(self):
+        red = self._cubes(Color.red, (10, 2, 5))
+        blue = self._cubes(Color.blue, (1, 20))
+        self.queue.build([red[0], blue[0], red[1], blue[1], red[2]],
+                         numpy.identity(4), .1, 100)
+        assert self.queue.opaque == [red[1], red[2], red[0], blue[0], blue[1]]
+        assert self.queue.transparent == []
+    
+    def testTransparent(self):
+        red = self._cubes(Color.red, (10,))
+        glass = self._cubes((1, 1, 1, .5), (2, 10, 5))
+        emitter = GameObject(Transform((0, 0, 7)), ParticleEmitter())
+        particles = emitter.renderables[0]
+        self.queue.build(red + glass + [particles], numpy.identity(4), .1, 100)
+        assert self.queue.opaque == red
+        assert self.queue.transparent == [glass[1], particles, glass[2],
+                                          glass[0]]
+
+
+@unittest.skipUnless(os.environ.get('PYOPENGL_PLATFORM') == 'egl',
+                     "Set PYOPENGL_PLATFORM=egl to render offscreen")
+class TestInstancedRendering(TestInstancing):
+    """
+    Renders offscreen through EGL, for example with Mesa's software rasterizer::
+    
+        PYOPENGL_PLATFORM=egl EGL_PLATFORM=surfaceless LIBGL_ALWAYS_SOFTWARE=1
+    """
+    
+    @classmethod
+    def setUpClass(cls):
+        OpenGLRenderer.initheadless((64, 64))
+        OpenGL.GL.glDisable(OpenGL.GL.GL_LIGHTING)
+    
+    @classmethod
+    def tearDownClass(cls):
+        OpenGLRenderer.quit()
+    
+    def _pixel(self, x, y):
+        pixel = OpenGL.GL.glReadPixels(x, y, 1, 1, OpenGL.GL.GL_RGBA,
+                                       OpenGL.GL.GL_UNSIGNED_BYTE)
+        return tuple(bytearray(pixel))
+    
+    def testRender(self):
+        OpenGLRenderer.clearscreen()
+        InstancedRenderer.render(self.renderables)
+        OpenGLRenderer.flip()
+        assert self._pixel(16, 32) == (255, 0, 0, 255)
+        assert self._pixel(47, 32) == (0, 255, 0, 255)
+        assert self._pixel(32, 60) == (128, 128, 128, 255)
+    
+    def testRenderFixedFunction(self):
+        OpenGLRenderer.clearscreen()
+        for renderable in self.renderables:
+            renderable.render()
+        OpenGLRenderer.flip()
+        assert self._pixel(16, 32) == (255, 0, 0, 255)
+        assert self._pixel(47, 32) == (0, 255, 0, 255)
+    
+    def testRenderLoop(self):
+        game = Game()
+        game._instancing = True
+        GameObject(Transform((-1, 0, 5)), Cube(Color.red))
+        GameObject(Transform((1, 0, 5)), Cube((0, 1, 0, .5)))
+        GameObject(Transform((0, 0, -5)), Cube(Color.blue))
+        game._renderloop()
+        assert self._pixel(16, 32) == (255, 0, 0, 255)
+        assert all(abs(a - b) <= 1 for a, b in
+                   zip(self._pixel(47, 32), (64, 191, 64, 255)))
+        assert game.renderstats == {'submitted': 2, 'culled': 1}
+    
+    def testFrustumMatrices(self):
+        camera = Camera((0, 2, 20), (-30, 10, 5))
+        GameObject(Transform((1, 2, 3)), camera)
+        OpenGL.GL.glMatrixMode(OpenGL.GL.GL_MODELVIEW)
+        OpenGL.GL.glLoadIdentity()
+        camera.push()
+        view = OpenGL.GL.glGetFloatv(OpenGL.GL.GL_MODELVIEW_MATRIX)
+        camera.pop()
+        projection = OpenGL.GL.glGetFloatv(OpenGL.GL.GL_PROJECTION_MATRIX)
+        assert numpy.allclose(numpy.reshape(view, (4, 4)).T,
+                              camera.viewmatrix(), atol=1e-4)
+        assert numpy.allclose(numpy.reshape(projection, (4, 4)).T,
+                              OpenGLRenderer.projectionmatrix(), atol=1e-5)
+    
+    def testFreeGeometry(self):
+        key = ('testcube',)
+        geometry = Geometry.get(key, lambda: Geometry(*primitives.cube()))
+        before = Geometry.memory()
+        gameobject = GameObject(Transform((0, 0, 5)),
+                                Renderable(Color.red, geometry),
+                                Renderable(Color.blue, geometry))
+        renderables = gameobject.renderables
+        for renderable in renderables:
+            renderable.render()
+        InstancedRenderer.render(renderables)
+        assert renderables[0].gl_list == renderables[1].gl_list
+        assert Geometry.memory() - before == 2 * geometry.nbytes
+        gameobject.destroy()
+        assert Geometry.memory() == before
+        assert key not in Geometry._cache
+
+
+class TestEntityStore(unittest.TestCase):
+    
+    def setUp(self):
+        self.store = EntityStore()
+        self.entities = [self.store.create(position=(i, 0, 0),
+                                           velocity=(0, 1, 0))
+                         for i in xrange(100)]
+        self.still = self.store.create(position=(0, 0, 5))
+    
+    def tearDown(self):
+        Scene()
+    
+    def testQuery(self):
+        assert len(self.store) == 101
+        assert len(self.store.query('position')) == 2
+        archetype, = self.store.query('velocity')
+        assert len(archetype) == 100 and archetype.capacity == 128
+        self.assertRaises(ValueError, self.store.create, mass=1)
+    
+    def testRun(self):
+        def move(position, velocity):
+            position += velocity * 2
+        self.store.run(move, 'position', 'velocity')
+        assert tuple(self.store.get(self.entities[3], 'position')) == (3, 2, 0)
+        assert tuple(self.store.get(self.still, 'position')) == (0, 0, 5)
+        assert self.store.version == 1
+    
+    def testDestroy(self):
+        self.store.destroy(self.entities[0])
+        last = self.entities[-1]
+        assert self.store.locate(last)[1] == 0
+        assert tuple(self.store.get(last, 'position')) == (99, 0, 0)
+        assert self.entities[0] not in self.store
+    
+    def testChangeArchetype(self):
+        entity = self.entities[5]
+        self.store.addcomponents(entity, color=(1, 0, 0, 1))
+        assert self.store.has(entity, 'color')
+        assert tuple(self.store.get(entity, 'position')) == (5, 0, 0)
+        self.store.removecomponents(entity, 'velocity', 'color')
+        assert self.store.locate(entity)[0] is self.store.locate(self.still)[0]
+        assert tuple(self.store.get(entity, 'position')) == (5, 0, 0)
+    
+    def testPack(self):
+        entity = self.store.create(position=(1, 2, 3), scale=(2, 2, 2),
+                                   rotation=(.5, .5, .5, .5))
+        data = self.store.pack('scale')
+        expected = Transform._modelmatrix((1, 2, 3), (.5, .5, .5, .5),
+                                          (2, 2, 2))
+        assert data.shape == (1, 20)
+        assert numpy.allclose(data[0, :16], expected)
+        assert tuple(data[0, 16:]) == (1, 1, 1, 1)
+        assert self.store.pack().shape == (102, 20)
+    
+    def testTransform(self):
+        entity = self.entities[1]
+        transform = EntityTransform(self.store, entity)
+        gameobject = GameObject(transform)
+        assert transform.position == (1, 0, 0) and transform.scale == (1, 1, 1)
+        def move(position, velocity):
+            position += velocity
+        self.store.run(move, 'position', 'velocity')
+        assert transform.position == (1, 1, 0)
+        transform.translate((0, 0, 1))
+        assert tuple(self.store.get(entity, 'position')) == (1, 1, 1)
+        transform.scale = (2, 2, 2)
+        assert tuple(self.store.get(entity, 'scale')) == (2, 2, 2)
+        assert transform.matrix[0] == 2
+        gameobject.destroy()
+        assert entity in self.store
+    
+    def testOwnedTransform(self):
+        transform = EntityTransform(self.store, position=(0, 1, 0))
+        gameobject = GameObject(transform, EntityRenderable(
+            self.store, transform.entity, Geometry(*primitives.cube()),
+            Color.red))
+        renderable = gameobject.renderables[0]
+        assert tuple(self.store.get(transform.entity, 'color')) == (1, 0, 0, 1)
+        renderable.color = (0, 1, 0, 1)
+        assert renderable.color == (0, 1, 0, 1)
+        gameobject.destroy()
+        assert transform.entity not in self.store
+
+
+@unittest.skipUnless(os.environ.get('PYOPENGL_PLATFORM') == 'egl',
+                     "needs an offscreen OpenGL context")
+class TestTextureManager(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        OpenGLRenderer.initheadless((16, 16))
+
+    @classmethod
+    def tearDownClass(cls):
+        OpenGLRenderer.quit()
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.paths = []
+        for name in ('a.png', 'b.png'):
+            path = os.path.join(self.folder, name)
+            pygame.image.save(pygame.Surface((16, 16)), path)
+            self.paths.append(path)
+        self.budget = TextureManager.budget
+
+    def tearDown(self):
+        TextureManager.budget = self.budget
+        TextureManager.clear()
+        shutil.rmtree(self.folder)
+
+    def testShared(self):
+        a1 = TextureManager.load(self.paths[0])
+        a2 = TextureManager.load(self.paths[0])
+        nearest = TextureManager.load(self.paths[0], OpenGL.GL.GL_NEAREST)
+        assert a1 is a2 and a1.refcount == 2
+        assert nearest is not a1 and nearest.id != a1.id
+        assert TextureManager.byid(a1.id) is a1
+        assert TextureManager.memory() == 2 * (16 * 16 * 4 * 4 // 3)
+
+    def testEviction(self):
+        a = TextureManager.load(self.paths[0])
+        TextureManager.budget = a.nbytes
+        a.release()
+        assert a.id is not None
+        assert TextureManager.stats()['unused'] == 1
+        b = TextureManager.load(self.paths[1])
+        assert a.id is None and b.id is not None
+        assert TextureManager.memory() == b.nbytes
+        a.acquire()
+        assert a.id is not None and b.id is not None
+
+    def testLoadAsync(self):
+        future = TextureManager.loadasync(self.paths[0])
+        AssetLoader.waitall()
+        texture = future.result()
+        assert texture.refcount == 1 and texture.id is not None
+        assert (texture.width, texture.height) == (16, 16)
+    
+    def testRelease(self):
+        texture_id = OpenGLRenderer.load_texture(self.paths[0])
+        OpenGLRenderer.delete_texture(texture_id)
+        texture = TextureManager.get(self.paths[0])
+        assert texture.refcount == 0
+        self.assertRaises(ValueError, texture.release)
 
 
 if __name__ == "__main__":